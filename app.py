@@ -2,25 +2,35 @@ import streamlit as st
 
 st.set_page_config(layout="wide")
 
-import threading
-
+# page modules other than the front page are imported on first navigation, see src/page_registry.py
 import src.pages.front_page as front_page
-import src.pages.air_quality as air_quality
-import src.pages.monthly_averages as monthly_averages
-import src.pages.pickups_dropoffs as pickups_dropoffs
+import src.page_registry
 
-import ag_grid_hack
+import src.hot_reload
+import src.static_assets
+import src.telemetry
+import src.warmup
 
 import base64
 import json
 
+# resolve and patch static assets once per process; app.py itself re-executes on every rerun,
+# but src.static_assets keeps its state across reruns
+src.static_assets.prepare()
+# background watcher that reloads datasets when files under data/ change, started once per process
+src.hot_reload.start()
+# loads every page's dataset in the background, unless `python -m src.warmup serve` already started it
+src.warmup.start()
+
 ## retro code review comment
 
 PAGES = {
     "Central Business District Tolling Program": {
-        "NYC Air Quality": air_quality,
-        "TLC Monthly Averages": monthly_averages,
-        "TLC Pickups and Dropoffs": pickups_dropoffs
+        "NYC Air Quality": src.page_registry.get("src.pages.air_quality"),
+        "TLC Monthly Averages": src.page_registry.get("src.pages.monthly_averages"),
+        "TLC Pickups and Dropoffs": src.page_registry.get("src.pages.pickups_dropoffs"),
+        "TLC Zone-to-Zone Flows": src.page_registry.get("src.pages.od_flows"),
+        "Zone Lookup": src.page_registry.get("src.pages.zone_lookup")
     }
 }
 
@@ -35,10 +45,16 @@ def main() -> None:
     """Main function of the App"""
     # render_svg_example()
 
-    ag_grid_hack.inject_css()
+    src.telemetry.begin_rerun()
+    # this rerun uses the dataset versions live now, even if a reload swaps in new ones meanwhile
+    src.hot_reload.begin_rerun()
+    # unpinned even when the page raises or calls st.stop()
+    try:
+        with src.telemetry.span("assets"):
+            src.static_assets.inject_stylesheets()
 
-    st.markdown(
-        """ <style>
+        st.markdown(
+            """ <style>
         .css-18e3th9 {{
                 padding-top: 0rem;
                 padding-right: -1rem;
@@ -56,44 +72,61 @@ def main() -> None:
         #MainMenu {visibility: hidden;}
         footer {visibility: hidden;}
          </style> """,
-        unsafe_allow_html=True,
-    )
+            unsafe_allow_html=True,
+        )
 ## retro code review comment
 
-    # Initialize session state:
-    page_session_key = "page_selected"
-    if page_session_key not in st.session_state:
-        st.session_state[page_session_key] = None
-
-    # Multi hierarchy sidebar:
-    with st.sidebar:
-        parents = [k for k in PAGES.keys()]
-        parent_selection = None
-        child_selection = None
-        expanders = {}
-        for parent in parents:
-            expanders[parent] = st.expander(parent, expanded=False)
-            for page in PAGES[parent].keys():
-                with expanders[parent]:
-                    blank, button_col = st.columns((0.05, 0.95))
-                    with button_col:
-                        st.button(
-                            page,
-                            key=f"{parent}${page}",
-                            on_click=set_session_state,
-                            args=(page_session_key, parent, page),
-                        )
+        # Initialize session state:
+        page_session_key = "page_selected"
+        if page_session_key not in st.session_state:
+            st.session_state[page_session_key] = None
+
+        # Multi hierarchy sidebar:
+        with st.sidebar:
+            parents = [k for k in PAGES.keys()]
+            parent_selection = None
+            child_selection = None
+            expanders = {}
+            for parent in parents:
+                expanders[parent] = st.expander(parent, expanded=False)
+                for page in PAGES[parent].keys():
+                    with expanders[parent]:
+                        blank, button_col = st.columns((0.05, 0.95))
+                        with button_col:
+                            st.button(
+                                page,
+                                key=f"{parent}${page}",
+                                on_click=set_session_state,
+                                args=(page_session_key, parent, page),
+                            )
 ## retro code review comment
 
-    # Call page
-    if st.session_state[page_session_key]:
-        parent_selection = st.session_state[page_session_key]["parent_selection"]
-        child_selection = st.session_state[page_session_key]["child_selection"]
-        PAGES[parent_selection][child_selection].app()
-        # report statistics
-        # count_pageview(f"{parent_selection}: {child_selection}")
-    else:
-        front_page.app()
+        # Call page
+        if st.session_state[page_session_key]:
+            parent_selection = st.session_state[page_session_key]["parent_selection"]
+            child_selection = st.session_state[page_session_key]["child_selection"]
+            src.telemetry.set_page(child_selection)
+            with src.telemetry.span("page"):
+                PAGES[parent_selection][child_selection].app()
+            # report statistics
+            src.telemetry.count_pageview(child_selection)
+        else:
+            src.telemetry.set_page("front_page")
+            with src.telemetry.span("page"):
+                front_page.app()
+            src.telemetry.count_pageview("front_page")
+
+        # after the page, so the page loaded by this rerun is listed too
+        if src.page_registry.profiling_enabled():
+            with st.sidebar:
+                for page, import_seconds, warm_seconds in src.page_registry.load_profile(PAGES):
+                    st.caption(f"{page}: import {import_seconds:.2f}s, data {warm_seconds:.2f}s")
+
+        if src.telemetry.debug_enabled():
+            src.telemetry.debug_panel()
+        src.telemetry.maybe_export()
+    finally:
+        src.hot_reload.end_rerun()
 
 
 if __name__ == "__main__":
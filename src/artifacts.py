@@ -0,0 +1,96 @@
+import json
+import os
+
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import src.cache
+
+# Compiled data artifacts
+# `python -m src.dataprocessing.compile_data` turns the raw files under data/ into typed, pre-joined and
+# pre-filtered Feather (Arrow IPC) files plus a manifest. Files are written uncompressed so they can be
+# memory-mapped: numeric and categorical columns are backed by the page cache instead of being parsed,
+# and geometry is stored once as WKB.
+
+COMPILED_DIR = os.path.join('data', 'compiled')
+MANIFEST_PATH = os.path.join(COMPILED_DIR, 'manifest.json')
+MANIFEST_VERSION = 1
+
+
+def artifact_path(name):
+    return os.path.join(COMPILED_DIR, f"{name}.feather")
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': MANIFEST_VERSION, 'artifacts': {}}
+
+
+def write_manifest(manifest):
+    os.makedirs(COMPILED_DIR, exist_ok = True)
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent = 2, sort_keys = True)
+    # atomic swap, so a running app never reads a half-written manifest
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+# writes a (Geo)DataFrame as an uncompressed Feather file and returns its manifest entry
+# schema_version is bumped by a page whenever its transform changes shape, which invalidates old artifacts
+def write_artifact(name, df, sources, schema_version):
+    os.makedirs(COMPILED_DIR, exist_ok = True)
+    geometry_column = None
+    crs = None
+    if isinstance(df, gpd.GeoDataFrame):
+        geometry_column = df.geometry.name
+        crs = df.crs.to_string() if df.crs is not None else None
+        df = df.to_wkb()
+
+    # named indexes (e.g. LocationID) are stored as columns and restored on read
+    table = pa.Table.from_pandas(df, preserve_index = None)
+    path = artifact_path(name)
+    tmp_path = f"{path}.tmp"
+    feather.write_feather(table, tmp_path, compression = 'uncompressed')
+    os.replace(tmp_path, path)
+
+    return {
+        'path': os.path.basename(path),
+        'schema_version': schema_version,
+        'rows': table.num_rows,
+        'bytes': os.path.getsize(path),
+        'sha256': src.cache.file_signature(path)[3],
+        'schema': {field.name: str(field.type) for field in table.schema},
+        'geometry_column': geometry_column,
+        'crs': crs,
+        'sources': {source: src.cache.file_signature(source)[3] for source in sources},
+    }
+
+
+# returns the compiled artifact when it exists, has the expected schema version, passes its checksum
+# and was built from the current versions of its sources, otherwise None so the caller falls back to
+# parsing the raw files. A source that is not present at all is accepted, which lets an image ship
+# only data/compiled/
+def read_artifact(name, schema_version, columns = None):
+    entry = load_manifest()['artifacts'].get(name)
+    if entry is None or entry.get('schema_version') != schema_version:
+        return None
+
+    path = os.path.join(COMPILED_DIR, entry['path'])
+    if src.cache.file_signature(path)[3] != entry['sha256']:
+        return None
+    for source, checksum in entry['sources'].items():
+        current = src.cache.file_signature(source)[3]
+        if current is not None and current != checksum:
+            return None
+
+    table = feather.read_table(path, columns = columns, memory_map = True)
+    df = table.to_pandas(split_blocks = True, self_destruct = True)
+    geometry_column = entry.get('geometry_column')
+    if geometry_column and geometry_column in df.columns:
+        df[geometry_column] = gpd.GeoSeries.from_wkb(df[geometry_column], crs = entry.get('crs'))
+        df = gpd.GeoDataFrame(df, geometry = geometry_column, crs = entry.get('crs'))
+    return df
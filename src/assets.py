@@ -5,8 +5,6 @@ import streamlit as st
 def create_header(title: str):
     return st.markdown(
         f"""
-        <link rel="stylesheet" type="text/css" href="http://dashboard.mta.info/default.css">
-        <link rel="stylesheet" type="text/css" href="http://dashboard.mta.info/app.css">
         <nav id="subway-nav-container" class="navbar">
             <div class="container-fluid">
                 <div id="navbar-header-container" class="pull-left navbar-title">
@@ -0,0 +1,444 @@
+import argparse
+import datetime
+import importlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import threading
+import time
+import traceback
+import warnings
+
+import numpy as np
+
+import src.benchmarks.run
+
+# Concurrent-session load test
+# Many simulated sessions rerun a page at once, the way the Streamlit server runs them: every session is a
+# thread with its own session state and script-run context, and reruns either the whole app (app.py executed
+# afresh, sidebar navigation included) or the page's app(). Streamlit 1.17 has no testing API, so sessions are
+# driven the way its ScriptRunner drives them: before each rerun the session sends the widget states a
+# browser would, with the values its script changes, and the messages the rerun produces are counted
+# instead of sent. Sessions are spread over worker processes, each a fresh interpreter, like replicas.
+#
+# A session lands on the page, then replays a filter-change script: a seeded random sequence of the widget
+# changes an analyst makes (time period, service, metric, zones, view, ...), SCRIPTS below. Per page the
+# report holds the rerun latency percentiles, reruns per second over all processes, the bytes of the
+# messages a rerun sends, the peak RSS of each worker process, and the cache hit rates in the workers.
+#
+#   python -m src.benchmarks.loadtest                                        # every page -> loadtest.json
+#   python -m src.benchmarks.loadtest --pages pickups_dropoffs --sessions 48 --processes 4 --steps 30
+#   python -m src.benchmarks.loadtest --scale 10 --baseline before.json --fail-on-regression
+
+RESULTS_VERSION = 1
+DEFAULT_SESSIONS = 16
+DEFAULT_PROCESSES = 2
+DEFAULT_STEPS = 20
+PERCENTILES = (50, 95, 99)
+# the sidebar group of the pages in app.PAGES
+APP_GROUP = "Central Business District Tolling Program"
+# random points for the Zone Lookup text box are drawn in this (west, south, east, north) box
+NYC_BOUNDS = (-74.05, 40.58, -73.75, 40.90)
+
+
+# Filter-change scripts: per page, (weight, change) pairs; a change takes the page's widget options and a
+# random generator and returns the widget values (by key) a user sets before one rerun
+def _pickups_dropoffs_options(page):
+    return page.filter_options()
+
+
+def _air_quality_options(page):
+    options = page.filter_options()
+    return {'indicator_name': options['indicator_name'],
+            'time': sorted({time for times in options['time'].values() for time in times})}
+
+
+def _monthly_averages_options(page):
+    months = sorted(page.load_and_transform_data()['month_year'].dt.date.unique())
+    return {'month_year': months, 'metric': ['monthly_trips', 'monthly_miles', 'monthly_time']}
+
+
+def _od_flows_options(page):
+    if not page.available():
+        return None
+    keys = page.flow_matrices().keys
+    return {'month_year': list(dict.fromkeys(month for month, _ in keys)), 'service': sorted({service for _, service in keys})}
+
+
+def _zone_lookup_options(page):
+    return {}
+
+
+def _date_range(months, rng):
+    start, end = sorted(rng.sample(range(len(months)), 2))
+    return (months[start], months[end])
+
+
+def _points(rng):
+    west, south, east, north = NYC_BOUNDS
+    return '\n'.join(f"{rng.uniform(south, north):.5f}, {rng.uniform(west, east):.5f}" for _ in range(rng.randint(1, 20)))
+
+
+SCRIPTS = {
+    'pickups_dropoffs': (_pickups_dropoffs_options, [
+        (5, lambda options, rng: {'randomkey1': rng.choice(options['month_year'])}),
+        (2, lambda options, rng: {'randomkey3': rng.choice(options['service'])}),
+        (2, lambda options, rng: {'randomkey4': rng.choice(['Pickups', 'Dropoffs'])}),
+        (1, lambda options, rng: {'randomkey2': rng.sample(options['CBD_Zone'], rng.randint(1, len(options['CBD_Zone'])))}),
+        (2, lambda options, rng: {'view:pickups_dropoffs': rng.choice(["Map", "Chart", "Data"])}),
+        (1, lambda options, rng: {'view:pickups_dropoffs': "Map", 'map_mode': rng.choice(["Single month", "Animated"])}),
+    ]),
+    'air_quality': (_air_quality_options, [
+        (5, lambda options, rng: {'randomkey1': rng.choice(options['time'])}),
+        (2, lambda options, rng: {'randomkey3': rng.choice(options['indicator_name'])}),
+        (2, lambda options, rng: {'view:air_quality': rng.choice(["Map", "Chart", "Trend", "Data"])}),
+    ]),
+    'monthly_averages': (_monthly_averages_options, [
+        (3, lambda options, rng: {'monthly_dates': _date_range(options['month_year'], rng)}),
+        (2, lambda options, rng: {'monthly_metric': rng.choice(options['metric'])}),
+        (1, lambda options, rng: {'view:monthly_averages': rng.choice(['Chart', 'Table'])}),
+    ]),
+    'od_flows': (_od_flows_options, [
+        (4, lambda options, rng: {'od_month': rng.choice(options['month_year'])}),
+        (2, lambda options, rng: {'od_service': rng.choice(options['service'])}),
+        (2, lambda options, rng: {'od_direction': rng.choice(["All flows", "Into the CBD", "Out of the CBD", "Within the CBD"])}),
+        (1, lambda options, rng: {'od_top': rng.choice(range(10, 201, 10))}),
+        (2, lambda options, rng: {'view:od_flows': rng.choice(["Flow map", "Matrix", "Change", "Data"])}),
+    ]),
+    'zone_lookup': (_zone_lookup_options, [
+        (1, lambda options, rng: {'zone_lookup_points': _points(rng)}),
+    ]),
+}
+
+
+# the widget values set before each rerun of one session, the landing rerun first
+def session_script(page, options, steps, seed):
+    rng = random.Random(seed)
+    if options is None:
+        return [{} for _ in range(steps + 1)]
+    weights, changes = zip(*SCRIPTS[page][1])
+    return [{}] + [rng.choices(changes, weights)[0](options, rng) for _ in range(steps)]
+
+
+class Session:
+    """One simulated browser session: its session state, script-run context and the bytes it receives"""
+
+    def __init__(self, session_id):
+        from streamlit.runtime.scriptrunner import ScriptRunContext
+        from streamlit.runtime.state import SafeSessionState, SessionState
+        from streamlit.runtime.uploaded_file_manager import UploadedFileManager
+
+        self.state = SessionState()
+        self.bytes = 0
+        self.ctx = ScriptRunContext(
+            session_id = session_id,
+            _enqueue = self._enqueue,
+            query_string = '',
+            session_state = SafeSessionState(self.state),
+            uploaded_file_mgr = UploadedFileManager(),
+            page_script_hash = '',
+            user_info = {'email': 'loadtest@example.com'},
+        )
+
+    def _enqueue(self, msg):
+        self.bytes += msg.ByteSize()
+
+    # reruns entry() in the calling thread with the widget values in values, returns the bytes sent
+    def rerun(self, entry, values = None, triggers = ()):
+        from streamlit.proto.WidgetStates_pb2 import WidgetStates
+        from streamlit.runtime.scriptrunner import add_script_run_ctx
+
+        values = dict(values or {})
+        states = {state.id: state for state in self.state.get_widget_states()}
+        # a widget shown in the previous rerun changes through its state, as the browser sends it
+        for key in list(values) + list(triggers):
+            widget_id = self.state._key_id_mapping.get(key)
+            if widget_id in self.state._new_widget_state.widget_metadata:
+                states[widget_id] = self._widget_state(widget_id, values.pop(key, True))
+        add_script_run_ctx(threading.current_thread(), self.ctx)
+        self.ctx.reset()
+        self.state.on_script_will_rerun(WidgetStates(widgets = list(states.values())))
+        # any other one through st.session_state, as the pages do for widgets they have not drawn yet
+        for key, value in values.items():
+            self.state[key] = value
+        self.bytes = 0
+        entry()
+        self.state.on_script_finished(self.ctx.widget_ids_this_run)
+        return self.bytes
+
+    def _widget_state(self, widget_id, value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        metadata = self.state._new_widget_state.widget_metadata[widget_id]
+        state = WidgetState(id = widget_id)
+        if metadata.value_type == 'trigger_value':
+            state.trigger_value = True
+            return state
+        serialized = metadata.serializer(value)
+        if metadata.value_type.endswith('_array_value'):
+            getattr(state, metadata.value_type).data.extend(serialized)
+        else:
+            setattr(state, metadata.value_type, serialized)
+        return state
+
+
+# what a session reruns: app.py after navigating to the page in the sidebar, or the page's app()
+def entry_points(page, entry):
+    module = importlib.import_module(f"src.pages.{page}")
+    if entry == 'page':
+        return module.app, ()
+    path = importlib.util.find_spec('app').origin
+    with open(path, 'r') as f:
+        code = compile(f.read(), path, 'exec')
+
+    # executed afresh every rerun like Streamlit's ScriptRunner does, so module-level state of app.py (PAGES)
+    # does not outlive a rerun here either
+    def rerun_app():
+        exec(code, {'__name__': '__main__', '__file__': path})
+
+    namespace = {'__name__': 'app', '__file__': path}
+    exec(code, namespace)
+    name = next(name for name, lazy_page in namespace['PAGES'][APP_GROUP].items() if lazy_page.module_name == module.__name__)
+    return rerun_app, (f"{APP_GROUP}${name}",)
+
+
+def run_session(session, entry, navigation, script, think, samples):
+    # the front page, whose sidebar holds the navigation buttons
+    if navigation:
+        session.rerun(entry)
+    for step, values in enumerate(script):
+        start = time.perf_counter()
+        try:
+            nbytes = session.rerun(entry, values, navigation if step == 0 else ())
+        except Exception as e:
+            samples['errors'].append(f"{type(e).__name__}: {e}")
+            traceback.print_exc()
+            continue
+        seconds = time.perf_counter() - start
+        samples['landing' if step == 0 else 'latency'].append(seconds)
+        samples['bytes'].append(nbytes)
+        if think:
+            time.sleep(think)
+
+
+def _quiet():
+    # the "use streamlit run" and session-state warnings; Streamlit sets the level of every logger it creates,
+    # so it is set through Streamlit for the loggers created later too
+    import streamlit.logger
+    streamlit.logger.set_log_level(logging.ERROR)
+    warnings.filterwarnings('ignore')
+
+
+# one worker process: warms the page, waits for the other workers, then runs its sessions as threads
+def worker(page, entry, sessions, steps, think, seed, warm, barrier, results):
+    # the workers measure the page, not the warm-up, reload watcher or metrics export of other pages
+    os.environ['MTA_WARMUP'] = '0'
+    os.environ['MTA_HOT_RELOAD'] = '0'
+    os.environ['MTA_METRICS_INTERVAL'] = 'inf'
+    _quiet()
+    result = {'pid': os.getpid(), 'latency': [], 'landing': [], 'bytes': [], 'errors': [], 'warm_s': None}
+    try:
+        entry_point, navigation = entry_points(page, entry)
+        module = importlib.import_module(f"src.pages.{page}")
+        start = time.perf_counter()
+        if warm:
+            Session('warm').rerun(module.app)
+        result['warm_s'] = time.perf_counter() - start
+        options = SCRIPTS[page][0](module)
+    except Exception as e:
+        traceback.print_exc()
+        result['errors'].append(f"{type(e).__name__}: {e}")
+        barrier.abort()
+        results.put(result)
+        return
+
+    threads = [threading.Thread(target = run_session, name = f"session-{session}",
+                                args = (Session(f"session-{session}"), entry_point, navigation,
+                                        session_script(page, options, steps, seed + session), think, result))
+               for session in sessions]
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    result['start'] = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result['end'] = time.time()
+
+    import src.telemetry
+    # kilobytes on Linux
+    result['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    result['caches'] = {name: {'hit_rate': stats['hit_rate'], 'bytes': stats['bytes']}
+                        for name, stats in src.telemetry.cache_stats().items()}
+    results.put(result)
+
+
+def percentiles(values):
+    if not values:
+        return {f"p{q}": None for q in PERCENTILES}
+    return {f"p{q}": float(value) for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def summarize(workers, sessions, processes):
+    latency = [seconds for worker in workers for seconds in worker['latency']]
+    landing = [seconds for worker in workers for seconds in worker['landing']]
+    nbytes = [size for worker in workers for size in worker['bytes']]
+    errors = [error for worker in workers for error in worker['errors']]
+    started = [worker for worker in workers if 'start' in worker]
+    wall = max(worker['end'] for worker in started) - min(worker['start'] for worker in started) if started else None
+    reruns = len(latency) + len(landing)
+    caches = {}
+    for worker in started:
+        for name, stats in worker['caches'].items():
+            caches.setdefault(name, []).append(stats['hit_rate'])
+    return {
+        'sessions': sessions,
+        'processes': processes,
+        'reruns': reruns,
+        'errors': len(errors),
+        'first_error': errors[0] if errors else None,
+        'wall_s': wall,
+        'throughput_rps': reruns / wall if wall else None,
+        'latency_s': {**percentiles(latency), 'mean': float(np.mean(latency)) if latency else None,
+                      'max': max(latency, default = None)},
+        'landing_s': percentiles(landing),
+        'rerun_bytes': {**percentiles(nbytes), 'max': max(nbytes, default = None)},
+        'warm_s': max((worker['warm_s'] for worker in workers if worker['warm_s'] is not None), default = None),
+        'peak_rss_mb': max((worker['peak_rss_bytes'] / 1e6 for worker in started), default = None),
+        'rss_mb_per_process': [round(worker['peak_rss_bytes'] / 1e6, 1) for worker in started],
+        'cache_hit_rate': {name: float(np.mean(rates)) for name, rates in caches.items()},
+    }
+
+
+# runs one page: sessions spread round-robin over fresh worker processes
+def load_page(page, entry, sessions, processes, steps, think, seed, warm):
+    context = multiprocessing.get_context('spawn')
+    processes = max(1, min(processes, sessions))
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    workers = [context.Process(target = worker, name = f"loadtest-{page}-{i}",
+                               args = (page, entry, list(range(i, sessions, processes)), steps, think, seed, warm, barrier, results))
+               for i in range(processes)]
+    for process in workers:
+        process.start()
+    collected = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+    return summarize(collected, sessions, processes)
+
+
+def run(pages, entry, sessions, processes, steps, think, seed, warm, scale, source_dir):
+    workdir = None
+    if scale:
+        workdir, _ = src.benchmarks.run.prepare_workdir(source_dir, scale)
+    report = {}
+    try:
+        with src.benchmarks.run.working_directory(workdir or os.getcwd()):
+            for page in pages:
+                report[page] = load_page(page, entry, sessions, processes, steps, think, seed, warm)
+                result = report[page]
+                print(f"{page}: {result['reruns']} reruns, p95 {_ms(result['latency_s']['p95'])}, "
+                      f"{result['throughput_rps'] or 0:.1f}/s, peak RSS {result['peak_rss_mb'] or 0:.0f}MB, {result['errors']} errors")
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors = True)
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec = 'seconds'),
+        'commit': src.benchmarks.run.git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'entry': entry, 'sessions': sessions, 'processes': processes, 'steps': steps,
+                   'think_s': think, 'seed': seed, 'warm': warm, 'scale': scale},
+        'pages': report,
+    }
+
+
+# adds the baseline p95, throughput and peak RSS to every page measured in both runs, returns the pages
+# whose p95 latency regressed
+def compare(report, baseline, threshold):
+    regressions = []
+    for page, result in report['pages'].items():
+        before = baseline['pages'].get(page)
+        if before is None or not before['latency_s']['p95'] or not result['latency_s']['p95']:
+            continue
+        result['baseline'] = {
+            'p95_s': before['latency_s']['p95'],
+            'throughput_rps': before['throughput_rps'],
+            'peak_rss_mb': before['peak_rss_mb'],
+            'p95_ratio': result['latency_s']['p95'] / before['latency_s']['p95'],
+        }
+        result['regressed'] = result['baseline']['p95_ratio'] > threshold
+        if result['regressed']:
+            regressions.append(page)
+    report['baseline'] = {'commit': baseline.get('commit'), 'created': baseline.get('created'), 'threshold': threshold}
+    return regressions
+
+
+def _ms(seconds):
+    return '' if seconds is None else f"{seconds * 1000:.1f}ms"
+
+
+def print_report(report):
+    print(f"{'page':<18} {'reruns':>7} {'p50':>10} {'p95':>10} {'p99':>10} {'rerun/s':>8} {'RSS MB':>7} {'p95 before':>11}")
+    for page, result in report['pages'].items():
+        latency = result['latency_s']
+        baseline = result.get('baseline', {})
+        print(f"{page:<18} {result['reruns']:>7} {_ms(latency['p50']):>10} {_ms(latency['p95']):>10} {_ms(latency['p99']):>10} "
+              f"{result['throughput_rps'] or 0:>8.1f} {result['peak_rss_mb'] or 0:>7.0f} "
+              f"{_ms(baseline.get('p95_s')):>11}{' !' if result.get('regressed') else ''}")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Rerun the pages from many concurrent simulated sessions')
+    parser.add_argument('--pages', nargs = '+', default = list(SCRIPTS), help = f"pages to load (default: all of {', '.join(SCRIPTS)})")
+    parser.add_argument('--sessions', type = int, default = DEFAULT_SESSIONS, help = 'concurrent sessions per page')
+    parser.add_argument('--processes', type = int, default = DEFAULT_PROCESSES, help = 'worker processes the sessions are spread over')
+    parser.add_argument('--steps', type = int, default = DEFAULT_STEPS, help = 'filter changes per session after landing on the page')
+    parser.add_argument('--think', type = float, default = 0.0, help = 'seconds a session waits between reruns')
+    parser.add_argument('--entry', choices = ['app', 'page'], default = 'app', help = "rerun app.py or the page's app()")
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--cold', action = 'store_true', help = 'do not load the page in each worker before the sessions start')
+    parser.add_argument('--scale', type = int, default = None, help = 'TLC row multiplier (default: the data/ directory as is)')
+    parser.add_argument('--source-dir', default = 'data', help = 'directory with the source datasets, for --scale')
+    parser.add_argument('--output', default = 'loadtest.json', help = 'where to write the JSON results')
+    parser.add_argument('--baseline', help = 'earlier JSON results to compare against')
+    parser.add_argument('--threshold', type = float, default = src.benchmarks.run.DEFAULT_THRESHOLD,
+                        help = 'p95 latency ratio above which a page counts as regressed')
+    parser.add_argument('--fail-on-regression', action = 'store_true', help = 'exit with status 1 when a page regressed')
+    args = parser.parse_args(argv)
+    unknown = [page for page in args.pages if page not in SCRIPTS]
+    if unknown:
+        parser.error(f"unknown page(s) {', '.join(unknown)}")
+
+    _quiet()
+    report = run(args.pages, args.entry, args.sessions, args.processes, args.steps, args.think, args.seed,
+                 not args.cold, args.scale, args.source_dir)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 2)
+    print_report(report)
+    print(f"wrote {args.output}")
+    if regressions:
+        print(f"{len(regressions)} page(s) with a p95 rerun latency over {args.threshold}x the baseline")
+        return 1 if args.fail_on_regression else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+import argparse
+import contextlib
+import datetime
+import importlib
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+# Page benchmark harness
+# Times each stage of the three pages separately, without a browser: dataset load (cold and cached), filter,
+# figure construction, Plotly JSON serialization, table page preparation and export encoding. The TLC
+# datasets are scaled with src.benchmarks.synthetic; every scale runs in its own working directory holding
+# a data/ tree, so the pages read the raw files exactly as they do in the app (no compiled artifacts).
+# Widgets run in Streamlit's bare mode and return their defaults.
+#
+#   python -m src.benchmarks.run                                    # 1x, 10x and 100x -> benchmark.json
+#   python -m src.benchmarks.run --scales 1 10 --repeat 5 --output before.json
+#   python -m src.benchmarks.run --baseline before.json --fail-on-regression
+
+RESULTS_VERSION = 1
+DEFAULT_SCALES = [1, 10, 100]
+DEFAULT_REPEAT = 3
+# a stage counts as regressed when its median is this many times the baseline median
+DEFAULT_THRESHOLD = 1.25
+# stages faster than this are reported but never flagged, their timings are mostly noise
+MIN_COMPARABLE_SECONDS = 0.005
+STATIC_FILES = ['CBD_Taxi.geojson', 'UHF_42_DOHMH.geojson', 'Outdoor_Air_and_Health_Data.csv']
+EXPORT_FORMATS = ['csv', 'csv.gz', 'parquet']
+
+
+def measure(fn, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def clear_caches():
+    import src.cache
+    for cache in (src.cache.dataset_cache, src.cache.figure_cache, src.cache.export_cache):
+        cache.clear()
+    src.cache.reset_datasets()
+
+
+# drops the values derived from a loaded dataset (partition indexes, feature stores) but keeps the dataset
+def clear_derived():
+    import src.cache
+    src.cache.dataset_cache.discard(lambda key: key[0] == 'derived')
+
+
+class Recorder:
+
+    def __init__(self, scale, repeat):
+        self.scale = scale
+        self.repeat = repeat
+        self.results = []
+
+    def stage(self, page, stage, fn, repeat = None, rows = None):
+        timings, result = measure(fn, repeat or self.repeat)
+        self.results.append({
+            'page': page,
+            'scale': self.scale,
+            'stage': stage,
+            'rows': rows,
+            'runs': len(timings),
+            'median_s': statistics.median(timings),
+            'min_s': min(timings),
+            'max_s': max(timings),
+        })
+        return result
+
+    # the first call after clearing the caches, i.e. what the first visitor of a new dataset version pays
+    def cold(self, page, stage, fn, rows = None, clear = clear_caches):
+        def run():
+            clear()
+            return fn()
+        return self.stage(page, stage, run, rows = rows)
+
+
+def bench_air_quality(recorder):
+    import src.exports
+    import src.tables
+    page = importlib.import_module('src.pages.air_quality')
+    name = 'air_quality'
+
+    dataset = recorder.cold(name, 'load', page.load_and_transform_data)
+    values = dataset[0]
+    recorder.stage(name, 'load_cached', page.load_and_transform_data, rows = len(values))
+    # the cube and its trends are built once per dataset version, so they are timed on their own
+    recorder.cold(name, 'cube', page.air_cube, rows = len(values), clear = clear_derived)
+    recorder.cold(name, 'filter_cold', page.filter_data, rows = len(values), clear = clear_derived)
+    all_data, extras, map_time, map_indicator = recorder.stage(name, 'filter', page.filter_data, rows = len(values))
+    fig = recorder.stage(name, 'choromap', lambda: page.build_choromap(all_data, extras), rows = len(all_data))
+    recorder.stage(name, 'barchart', lambda: page.build_barchart(all_data, extras), rows = len(all_data))
+    recorder.stage(name, 'plotly_json', fig.to_json, rows = len(all_data))
+    trend, trend_extras = recorder.stage(name, 'trend', lambda: page.query_rows(map_indicator), rows = len(values))
+    recorder.stage(name, 'trend_map', lambda: page.build_trend_map(trend, trend_extras), rows = len(trend))
+    table = page.join_neighborhoods(all_data)
+    geometry = table.geometry.iloc[:src.tables.DEFAULT_PAGE_SIZE]
+    recorder.stage(name, 'table_page', lambda: src.tables.geometry_summary(geometry), rows = len(geometry))
+    for fmt in EXPORT_FORMATS + ['geojson']:
+        recorder.stage(name, f"export_{fmt}", lambda: src.exports.to_bytes(table, fmt), rows = len(table))
+
+
+def bench_pickups_dropoffs(recorder):
+    import src.exports
+    import src.tables
+    page = importlib.import_module('src.pages.pickups_dropoffs')
+    name = 'pickups_dropoffs'
+
+    dataset = recorder.cold(name, 'load', page.load_and_transform_data)
+    facts = dataset[0]
+    recorder.stage(name, 'load_cached', page.load_and_transform_data, rows = len(facts))
+    recorder.cold(name, 'filter_cold', page.filter_data, rows = len(facts), clear = clear_derived)
+    all_data, gray_data, _, zone, service, time_metric = recorder.stage(name, 'filter', page.filter_data, rows = len(facts))
+    # the feature store is built once per dataset version, so it is timed on its own
+    recorder.cold(name, 'zone_features', page.zone_features, rows = len(dataset[1]), clear = clear_derived)
+    fig = recorder.stage(name, 'choromap', lambda: page.build_tlc_choromap(all_data, gray_data, time_metric), rows = len(all_data))
+    recorder.stage(name, 'barchart', lambda: page.build_tlc_barchart(all_data, time_metric), rows = len(all_data))
+    recorder.stage(name, 'plotly_json', fig.to_json, rows = len(all_data))
+    # the animated map: every month of the service as color-only frames
+    month_data, month_gray = recorder.stage(name, 'month_rows', lambda: page.month_rows(zone, service, time_metric), rows = len(facts))
+    animated = recorder.stage(name, 'animated_choromap', lambda: page.build_tlc_animated_choromap(month_data, month_gray), rows = len(month_data))
+    recorder.stage(name, 'animated_json', animated.to_json, rows = len(month_data))
+    geometry = all_data.geometry.iloc[:src.tables.DEFAULT_PAGE_SIZE]
+    recorder.stage(name, 'table_page', lambda: src.tables.geometry_summary(geometry), rows = len(geometry))
+    for fmt in EXPORT_FORMATS + ['geojson']:
+        recorder.stage(name, f"export_{fmt}", lambda: src.exports.to_bytes(all_data, fmt), rows = len(all_data))
+    recorder.stage(name, 'export_all_months', lambda: src.exports.stream_csv_gz(page.all_months_chunks()), repeat = 1, rows = len(facts))
+
+
+def bench_monthly_averages(recorder):
+    import src.exports
+    page = importlib.import_module('src.pages.monthly_averages')
+    name = 'monthly_averages'
+
+    df = recorder.cold(name, 'load', page.load_and_transform_data)
+    recorder.stage(name, 'load_cached', page.load_and_transform_data, rows = len(df))
+    all_data, _, _, _ = recorder.stage(name, 'filter', lambda: page.data_filters(df), rows = len(df))
+    for fmt in EXPORT_FORMATS:
+        recorder.stage(name, f"export_{fmt}", lambda: src.exports.to_bytes(all_data, fmt), rows = len(all_data))
+
+
+PAGES = {
+    'air_quality': bench_air_quality,
+    'pickups_dropoffs': bench_pickups_dropoffs,
+    'monthly_averages': bench_monthly_averages,
+}
+
+
+# a data/ tree for one scale: the static files linked from source_dir and the TLC CSVs scaled by factor
+def prepare_workdir(source_dir, factor):
+    import src.benchmarks.synthetic
+    workdir = tempfile.mkdtemp(prefix = f"mta-bench-{factor}x-")
+    data_dir = os.path.join(workdir, 'data')
+    os.makedirs(data_dir)
+    for file in STATIC_FILES:
+        os.symlink(os.path.abspath(os.path.join(source_dir, file)), os.path.join(data_dir, file))
+    rows = src.benchmarks.synthetic.write_scaled(source_dir, workdir, factor)
+    return workdir, rows
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(source_dir, scales, pages, repeat):
+    results = []
+    datasets = {}
+    for factor in scales:
+        workdir, rows = prepare_workdir(source_dir, factor)
+        datasets[str(factor)] = rows
+        try:
+            with working_directory(workdir):
+                for page in pages:
+                    recorder = Recorder(factor, repeat)
+                    PAGES[page](recorder)
+                    results.extend(recorder.results)
+                    print(f"{factor}x {page}: {sum(result['median_s'] for result in recorder.results):.3f}s over {len(recorder.results)} stages")
+        finally:
+            clear_caches()
+            shutil.rmtree(workdir, ignore_errors = True)
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec = 'seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'datasets': datasets,
+        'results': results,
+    }
+
+
+# adds the baseline median and ratio to every result measured in both runs, returns the regressed results
+def compare(report, baseline, threshold):
+    previous = {(result['page'], result['scale'], result['stage']): result for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        before = previous.get((result['page'], result['scale'], result['stage']))
+        if before is None:
+            continue
+        result['baseline_median_s'] = before['median_s']
+        result['ratio'] = result['median_s'] / before['median_s'] if before['median_s'] else None
+        result['regressed'] = bool(result['ratio'] and result['ratio'] > threshold
+                                   and max(result['median_s'], before['median_s']) >= MIN_COMPARABLE_SECONDS)
+        if result['regressed']:
+            regressions.append(result)
+    report['baseline'] = {'commit': baseline.get('commit'), 'created': baseline.get('created'), 'threshold': threshold}
+    return regressions
+
+
+def print_report(report):
+    print(f"{'page':<18} {'scale':>5} {'stage':<18} {'rows':>9} {'median':>10} {'baseline':>10} {'ratio':>7}")
+    for result in report['results']:
+        baseline = result.get('baseline_median_s')
+        ratio = result.get('ratio')
+        print(f"{result['page']:<18} {result['scale']:>4}x {result['stage']:<18} {result['rows'] or '':>9} "
+              f"{result['median_s'] * 1000:>8.1f}ms "
+              f"{'' if baseline is None else f'{baseline * 1000:.1f}ms':>10} "
+              f"{'' if ratio is None else f'{ratio:.2f}':>6}{' !' if result.get('regressed') else ''}")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the page stages on scaled datasets')
+    parser.add_argument('--scales', type = int, nargs = '+', default = DEFAULT_SCALES, help = 'TLC row multipliers (default: 1 10 100)')
+    parser.add_argument('--pages', nargs = '+', default = list(PAGES), help = f"pages to benchmark (default: all of {', '.join(PAGES)})")
+    parser.add_argument('--repeat', type = int, default = DEFAULT_REPEAT, help = 'runs per stage, the median is reported')
+    parser.add_argument('--source-dir', default = 'data', help = 'directory with the source datasets')
+    parser.add_argument('--output', default = 'benchmark.json', help = 'where to write the JSON results')
+    parser.add_argument('--baseline', help = 'earlier JSON results to compare against')
+    parser.add_argument('--threshold', type = float, default = DEFAULT_THRESHOLD, help = 'ratio above which a stage counts as regressed')
+    parser.add_argument('--fail-on-regression', action = 'store_true', help = 'exit with status 1 when a stage regressed')
+    args = parser.parse_args(argv)
+    unknown = [page for page in args.pages if page not in PAGES]
+    if unknown:
+        parser.error(f"unknown page(s) {', '.join(unknown)}")
+
+    # bare-mode widgets warn on every call
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    warnings.filterwarnings('ignore')
+
+    report = run(args.source_dir, args.scales, args.pages, args.repeat)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 2)
+    print_report(report)
+    print(f"wrote {args.output}")
+    if regressions:
+        print(f"{len(regressions)} stage(s) slower than {args.threshold}x the baseline")
+        return 1 if args.fail_on_regression else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+import src.partitions
+
+# Synthetic scaled TLC datasets
+# Grows map_pickup.csv, map_dropoff.csv, monthly.csv (and od_flows.csv, when present) by an integer factor, for benchmarking how each page
+# stage scales with history. Copy i of the source rows is shifted back by whole spans of the source months
+# and, once the month copies run out, relabelled as an extra service ("Yellow Taxi 2", ...), so every copy
+# keeps the (service, month_year, LocationID) key unique and the result has exactly factor times the rows.
+#
+#   python -m src.benchmarks.synthetic --factor 10 --output-dir /tmp/tlc_10x
+
+# dataset -> how many copies may be shifted back in time before services are added; monthly.csv uses
+# two-digit years, which stop round-tripping before 1969
+MAX_MONTH_COPIES = {'map_pickup': 10, 'map_dropoff': 10, 'monthly': 1, 'od_flows': 10}
+
+
+def scale_dataset(df, factor, month_format, max_month_copies):
+    months = pd.to_datetime(df['month_year'], format = month_format).dt.to_period('M')
+    span = (months.max() - months.min()).n + 1
+    month_copies = min(factor, max_month_copies)
+
+    copies = []
+    for i in range(factor):
+        shift, service_copy = i % month_copies, i // month_copies
+        copy = df.copy()
+        if shift:
+            shifted = months - shift * span
+            copy['month_year'] = shifted.dt.strftime(month_format)
+            if 'year' in copy.columns:
+                copy['year'] = shifted.dt.year
+        if service_copy:
+            copy['service'] = copy['service'] + f" {service_copy + 1}"
+        copies.append(copy)
+    return pd.concat(copies, ignore_index = True)
+
+
+# writes the scaled TLC datasets as CSVs under output_dir/data/, the layout the pages read from
+def write_scaled(source_dir, output_dir, factor):
+    data_dir = os.path.join(output_dir, 'data')
+    os.makedirs(data_dir, exist_ok = True)
+    rows = {}
+    for name, spec in src.partitions.DATASETS.items():
+        source = os.path.join(source_dir, os.path.basename(spec['path']))
+        # od_flows.csv is only there once aggregate_trips has produced it
+        if not os.path.exists(source):
+            continue
+        df = pd.read_csv(source)
+        df.columns = [column.lstrip('\ufeff') for column in df.columns]
+        scaled = scale_dataset(df, factor, spec['month_format'], MAX_MONTH_COPIES[name])
+        scaled.to_csv(os.path.join(data_dir, os.path.basename(spec['path'])), index = False)
+        rows[name] = len(scaled)
+    return rows
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Write TLC datasets scaled by an integer factor')
+    parser.add_argument('--factor', type = int, required = True, help = 'row multiplier, e.g. 10 or 100')
+    parser.add_argument('--source-dir', default = 'data', help = 'directory with map_pickup.csv, map_dropoff.csv and monthly.csv')
+    parser.add_argument('--output-dir', required = True, help = 'the CSVs are written to <output-dir>/data/')
+    args = parser.parse_args(argv)
+    if args.factor < 1:
+        parser.error('--factor must be at least 1')
+
+    for name, count in write_scaled(args.source_dir, args.output_dir, args.factor).items():
+        print(f"{name}: {count} rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,390 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+import pandas as pd
+
+# Process-wide caches shared by every Streamlit session
+# Streamlit runs each session's script in its own thread inside one server process, so anything stored here
+# is loaded once and then shared by all sessions. Cached values are shared objects: callers must treat them
+# as read-only and copy before mutating (pandas filtering, rename, etc. already return new frames)
+
+DEFAULT_DATASET_CACHE_MB = 512
+DEFAULT_FIGURE_CACHE_MB = 128
+DEFAULT_EXPORT_CACHE_MB = 64
+
+
+class LRUCache:
+    """Thread-safe least-recently-used cache bounded by an approximate byte budget"""
+
+    # retain(key) marks entries that are referenced elsewhere and would stay in memory anyway: they count
+    # towards the budget but are never evicted, so the other entries make room for them
+    def __init__(self, max_bytes, retain = None):
+        self.max_bytes = max_bytes
+        self.retain = retain
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default = None):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, nbytes = None):
+        if nbytes is None:
+            nbytes = estimate_nbytes(value)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, nbytes)
+            self._evict()
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return None if entry is None else entry[0]
+
+    def discard(self, predicate):
+        # removes every entry whose key matches the predicate, e.g. older versions of a dataset
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def get_or_create(self, key, builder, sizeof = None):
+        # single-flight: concurrent sessions missing the same key wait for one build instead of each building
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][0]
+                self.misses += 1
+            try:
+                value = builder()
+                self.put(key, value, sizeof(value) if sizeof else None)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    @property
+    def nbytes(self):
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def _evict(self):
+        # the newest entry is always kept, even when it alone exceeds the budget
+        total = self.nbytes
+        for key in list(self._entries)[:-1]:
+            if total <= self.max_bytes:
+                break
+            if self.retain is not None and self.retain(key):
+                continue
+            _, nbytes = self._entries.pop(key)
+            total -= nbytes
+            self.evictions += 1
+
+
+# approximate resident size of a cached value, including shapely geometries in GeoDataFrames
+def estimate_nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        nbytes = int(value.memory_usage(index = True, deep = True).sum())
+        for column in value.columns[value.dtypes == 'geometry']:
+            nbytes += _geometry_nbytes(value[column])
+        return nbytes
+    if isinstance(value, pd.Series):
+        nbytes = int(value.memory_usage(index = True, deep = True))
+        if str(value.dtype) == 'geometry':
+            nbytes += _geometry_nbytes(value)
+        return nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(estimate_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_nbytes(item) for item in value.values())
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+def _geometry_nbytes(geometries):
+    return sum(len(geometry.wkb) for geometry in geometries if geometry is not None)
+
+
+_hash_lock = threading.Lock()
+_content_hashes = {}
+
+
+# identifies one version of a source file: path plus mtime/size, and a content hash that is only
+# recomputed when mtime or size change. Missing files get an all-None signature so that deployments
+# shipping only compiled artifacts can still key their caches
+def file_signature(path):
+    path = os.path.abspath(path)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return (path, None, None, None)
+    stat_key = (path, stat.st_mtime_ns, stat.st_size)
+    with _hash_lock:
+        content_hash = _content_hashes.get(stat_key)
+    if content_hash is None:
+        content_hash = file_sha256(path)
+        with _hash_lock:
+            _content_hashes[stat_key] = content_hash
+    return stat_key + (content_hash,)
+
+
+def file_sha256(path, chunk_size = 1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def signature_digest(signatures):
+    digest = hashlib.sha256()
+    for signature in signatures:
+        digest.update(repr(signature).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+# the live value of every dataset is held by its DatasetBuffer, so it stays counted in the budget and the
+# derived values and older versions are evicted around it
+dataset_cache = LRUCache(int(os.environ.get('MTA_DATASET_CACHE_MB', DEFAULT_DATASET_CACHE_MB)) * 1024 * 1024,
+                         retain = lambda key: _is_live(key))
+figure_cache = LRUCache(int(os.environ.get('MTA_FIGURE_CACHE_MB', DEFAULT_FIGURE_CACHE_MB)) * 1024 * 1024)
+export_cache = LRUCache(int(os.environ.get('MTA_EXPORT_CACHE_MB', DEFAULT_EXPORT_CACHE_MB)) * 1024 * 1024)
+
+
+# versions of a derived value kept per kind: the current one and the one before it, which reruns pinned
+# before a swap still use while the reload pre-warms the new one
+DERIVED_GENERATIONS = 2
+
+_derived_lock = threading.Lock()
+# per kind, the versions in the order they were first asked for
+_derived_versions = {}
+# per ('derived', kind, version), the number of reruns in flight that use it
+_derived_users = {}
+
+
+# caches a value derived from a dataset (feature store, filter index, ...) for one dataset version.
+# Versions older than the last DERIVED_GENERATIONS of the same kind are dropped once no rerun in flight
+# uses them, so a rerun pinned to the old version and one on the new version never evict each other
+def derived_value(kind, version, build, sizeof = None):
+    key = ('derived', kind, version)
+    in_use = getattr(_pins, 'derived', None)
+    with _derived_lock:
+        versions = _derived_versions.setdefault(kind, [])
+        if version not in versions:
+            versions.append(version)
+        if in_use is not None and key not in in_use:
+            in_use.add(key)
+            _derived_users[key] = _derived_users.get(key, 0) + 1
+    value = dataset_cache.get_or_create(key, build, sizeof)
+    _drop_old_derived(kind)
+    return value
+
+
+def _drop_old_derived(kind):
+    with _derived_lock:
+        versions = _derived_versions.get(kind, [])
+        dropped = [version for version in versions[:-DERIVED_GENERATIONS] if ('derived', kind, version) not in _derived_users]
+        for version in dropped:
+            versions.remove(version)
+    for version in dropped:
+        dataset_cache.pop(('derived', kind, version))
+
+
+# Double-buffered datasets
+# Each cached_dataset keeps its live value in a DatasetBuffer as one (generation, key, value) tuple that is
+# replaced whole. Without the hot-reload watcher (offline tools, benchmarks) every call checks the source
+# signatures and reloads synchronously, as before. Once src.hot_reload has started the watcher, calls never
+# touch the files: the watcher builds the new value in the background, warms its derived values, then swaps
+# the tuple, and each rerun pins the tuples it started with so it finishes on one consistent version.
+
+_pins = threading.local()
+_buffers = {}
+_generation_lock = threading.Lock()
+_generation = 0
+_watching = False
+
+
+def generation():
+    return _generation
+
+
+def set_watching(watching):
+    global _watching
+    _watching = watching
+
+
+def dataset_buffers():
+    return list(_buffers.values())
+
+
+# pins the current version of every loaded dataset for the rest of this thread's rerun
+def pin_datasets():
+    _pins.buffers = {name: buffer.current for name, buffer in _buffers.items() if buffer.current is not None}
+    _pins.derived = set()
+
+
+# releases the pins, and the derived values this rerun used that are now older than the kept generations
+def unpin_datasets():
+    in_use = getattr(_pins, 'derived', None) or set()
+    _pins.buffers = {}
+    _pins.derived = None
+    with _derived_lock:
+        for key in in_use:
+            _derived_users[key] -= 1
+            if not _derived_users[key]:
+                del _derived_users[key]
+    for kind in {key[1] for key in in_use}:
+        _drop_old_derived(kind)
+
+
+def _is_live(key):
+    return any((buffer.current is not None and buffer.current[1] == key) or buffer.pending == key
+               for buffer in list(_buffers.values()))
+
+
+# forgets the live value of every dataset, so the next call loads again (benchmarks, tests of cold starts)
+def reset_datasets():
+    for buffer in _buffers.values():
+        buffer.current = None
+        buffer.seen_key = None
+
+
+class DatasetBuffer:
+    """The live value of one cached dataset, swapped whole when its source files change"""
+
+    def __init__(self, name, paths, loader):
+        self.name = name
+        self.paths = paths
+        self.loader = loader
+        self.warmers = []
+        self.current = None
+        self.seen_key = None
+        # the version being loaded and warmed by the watcher, not yet live
+        self.pending = None
+        self._lock = threading.Lock()
+
+    def key(self):
+        return (self.name, tuple(file_signature(path) for path in self.paths))
+
+    def get(self):
+        pinned = getattr(_pins, 'buffers', {}).get(self.name)
+        if pinned is not None:
+            return pinned
+        current = self.current
+        if current is not None and _watching:
+            return current
+        key = self.key()
+        if current is None or current[1] != key:
+            current = self._swap(key, self._load(key))
+        return current
+
+    def _load(self, key):
+        value = dataset_cache.get_or_create(key, self.loader)
+        # drop entries built from older versions of the same files
+        dataset_cache.discard(lambda other: other[0] == self.name and other != key)
+        return value
+
+    def _swap(self, key, value):
+        global _generation
+        with self._lock:
+            if self.current is not None and self.current[1] == key:
+                return self.current
+            with _generation_lock:
+                _generation += 1
+                self.current = (_generation, key, value)
+            return self.current
+
+    # called by the watcher: reloads in the calling thread once the sources changed and then stayed unchanged
+    # for one more poll (so a file still being written is not read), warms the derived values of the new
+    # version and swaps it in; returns True when a new version went live
+    def reload_if_changed(self):
+        if self.current is None:
+            return False
+        key = self.key()
+        if key == self.current[1]:
+            self.seen_key = None
+            return False
+        if key != self.seen_key:
+            self.seen_key = key
+            return False
+
+        self.pending = key
+        try:
+            value = self._load(key)
+            pinned = getattr(_pins, 'buffers', {})
+            _pins.buffers = {**pinned, self.name: (None, key, value)}
+            try:
+                for warm in self.warmers:
+                    warm()
+            finally:
+                _pins.buffers = pinned
+            self._swap(key, value)
+        finally:
+            self.pending = None
+        self.seen_key = None
+        return True
+
+
+# caches a page's load_and_transform_data in the process-wide dataset cache
+# The entry is keyed by the loader plus the signature of every source file, so editing or replacing a file
+# under data/ invalidates it. The wrapped function gains a version() helper returning a short digest of the
+# signatures of the version in use, and warm_with() to register functions (feature stores, filter indexes)
+# that the hot-reload watcher runs against a new version before it goes live
+def cached_dataset(*paths):
+    def decorator(loader):
+        name = f"{loader.__module__}.{loader.__qualname__}"
+        buffer = _buffers[name] = DatasetBuffer(name, paths, loader)
+
+        @wraps(loader)
+        def wrapper():
+            return buffer.get()[2]
+
+        wrapper.version = lambda: signature_digest(buffer.get()[1][1])
+        wrapper.warm_with = lambda *warmers: buffer.warmers.extend(warmers)
+        wrapper.paths = paths
+        return wrapper
+
+    return decorator
@@ -0,0 +1,102 @@
+import json
+import os
+from datetime import date, datetime
+
+import pandas as pd
+import plotly.utils
+import streamlit as st
+
+import src.cache
+import src.telemetry
+
+# Cached chart rendering
+# Most sessions look at the same few filter combinations, so built figures are kept in the process-wide
+# figure cache, keyed by chart name, the normalized filter tuple and the dataset version.
+# On the Streamlit versions in SPEC_STREAMLIT_VERSIONS, Plotly figures are cached as the JSON spec
+# st.plotly_chart would send and written straight into a PlotlyChart element, so a repeat view skips both
+# figure construction and serialization. That path uses Streamlit internals (the element proto, its config
+# and theme defaults, the private enqueue), so on any other version the figure is cached and rendered with
+# the public st.plotly_chart instead.
+# Altair charts are cached as chart objects; Streamlit still converts their data on every call.
+
+# figure spec bytes a map should stay within; src/topology.py fits the polygons in it, and the bytes each
+# chart sends are exported by src.telemetry against it
+PAYLOAD_BUDGET = int(float(os.environ.get('MTA_MAP_BUDGET_KB', 200)) * 1000)
+# versions whose st.plotly_chart the spec path below was checked against
+SPEC_STREAMLIT_VERSIONS = ('1.17.',)
+# what st.plotly_chart(fig) sends as config with its default arguments, on those versions
+PLOTLY_CONFIG = json.dumps({'showLink': False, 'linkText': False})
+
+try:
+    from streamlit.proto.PlotlyChart_pb2 import PlotlyChart as PlotlyChartProto
+except ImportError:
+    PlotlyChartProto = None
+
+
+def send_spec_supported():
+    return (st.__version__.startswith(SPEC_STREAMLIT_VERSIONS) and PlotlyChartProto is not None
+            and hasattr(st, '_main'))
+
+
+# filter values as a hashable tuple that does not depend on widget return types or selection order
+def normalize_key(*parts):
+    return tuple(_normalize(part) for part in parts)
+
+
+def _normalize(value):
+    if isinstance(value, (list, tuple, set, frozenset, pd.Index, pd.Series)):
+        return tuple(sorted(str(item) for item in value))
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+# renders a Plotly figure built by build() at most once per (name, key, version)
+def plotly_chart(name, key, version, build):
+    def build_entry():
+        with src.telemetry.span('figure_build'):
+            fig = build()
+        with src.telemetry.span('figure_serialize'):
+            spec = json.dumps(fig, cls = plotly.utils.PlotlyJSONEncoder)
+        # (what is sent, its size): the spec itself, or the figure for st.plotly_chart
+        return (spec, len(spec)) if send_spec_supported() else (fig, len(spec))
+
+    content, nbytes = src.cache.figure_cache.get_or_create((name, normalize_key(*key), version), build_entry,
+                                                           sizeof = lambda entry: entry[1])
+    # over-budget figures show up in the exported chart payloads (within_budget), not on stdout
+    src.telemetry.record_payload(name, nbytes, PAYLOAD_BUDGET)
+    with src.telemetry.span('chart_send'):
+        if isinstance(content, str):
+            return _send_spec(content)
+        return st.plotly_chart(content)
+
+
+# writes a serialized figure into a PlotlyChart element, as st.plotly_chart(fig) does on SPEC_STREAMLIT_VERSIONS
+def _send_spec(spec):
+    proto = PlotlyChartProto()
+    proto.use_container_width = False
+    proto.figure.spec = spec
+    proto.figure.config = PLOTLY_CONFIG
+    proto.theme = 'streamlit'
+    # _enqueue writes into the active container (tab, column, ...) like st.plotly_chart does
+    return st._main._enqueue('plotly_chart', proto)
+
+
+# renders an Altair chart built by build() at most once per (name, key, version)
+def altair_chart(name, key, version, build, use_container_width = False):
+    def build_chart():
+        with src.telemetry.span('figure_build'):
+            return build()
+
+    chart = src.cache.figure_cache.get_or_create(
+        (name, normalize_key(*key), version),
+        build_chart,
+        sizeof = lambda chart: src.cache.estimate_nbytes(chart.data)
+    )
+    # Streamlit serializes the chart spec and its data here, on every rerun
+    with src.telemetry.span('figure_serialize'):
+        return st.altair_chart(chart, use_container_width = use_container_width)
+
+
+def figure_cache_stats():
+    return src.cache.figure_cache.stats()
@@ -0,0 +1,157 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import src.cache
+
+# Dense value cubes
+# A long-format frame of (indicator, time, location, value) rows is held as one float32 array shaped
+# (indicators, times, locations), with NaN where a combination was not measured. Picking an indicator and
+# a time is an array index instead of a DataFrame filter, and the cross-time analytics are computed for
+# every cell at once when the cube is built, once per dataset version:
+#   change, change_pct  difference from the previous time period, absolute and in percent
+#   slope               least-squares trend per (indicator, location), in value units per time unit
+#   percentile          rank of a location among all locations for the same indicator and time, 0-100
+#   value_range         (min, max) per indicator over all times and locations, for fixed color scales
+#   quantiles           across locations per (indicator, time), e.g. the citywide median
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+class Cube:
+    """Values of a long-format frame as a dense (indicator, time, location) array with precomputed trends"""
+
+    def __init__(self, df, indicator, time, location, value, indicator_columns = (), location_columns = ()):
+        indicators = df[indicator].astype(str)
+        times = df[time].astype(str)
+        # indicators in order of appearance, times in numeric order when they are numbers (years)
+        self.indicators = list(pd.unique(indicators))
+        self.times = sorted(pd.unique(times), key = _time_sort_key)
+        self.locations = np.sort(pd.unique(df[location]))
+        self.time_values = _time_values(self.times)
+
+        positions = (pd.Index(self.indicators).get_indexer(indicators),
+                     pd.Index(self.times).get_indexer(times),
+                     np.searchsorted(self.locations, df[location].to_numpy()))
+        self.values = np.full((len(self.indicators), len(self.times), len(self.locations)), np.nan, dtype = np.float32)
+        self.values[positions] = df[value].to_numpy(dtype = np.float32)
+
+        # attributes constant per indicator (e.g. units) and per location (e.g. names), as arrays
+        first = df.assign(**{indicator: indicators}).drop_duplicates(indicator).set_index(indicator).reindex(self.indicators)
+        self.indicator_attributes = {column: first[column].to_numpy() for column in indicator_columns}
+        first = df.drop_duplicates(location).set_index(location).reindex(self.locations)
+        self.location_attributes = {column: first[column].to_numpy() for column in location_columns}
+
+        self._precompute()
+
+    def _precompute(self):
+        values = self.values
+        measured = ~np.isnan(values)
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            self.change = np.full_like(values, np.nan)
+            self.change[:, 1:] = values[:, 1:] - values[:, :-1]
+            self.change_pct = np.full_like(values, np.nan)
+            self.change_pct[:, 1:] = self.change[:, 1:] / values[:, :-1] * 100
+
+            # ordinary least squares over the measured times of each (indicator, location)
+            x = self.time_values[None, :, None]
+            count = measured.sum(axis = 1)
+            x_mean = np.where(measured, x, 0).sum(axis = 1) / count
+            y_mean = np.nansum(values, axis = 1) / count
+            dx = np.where(measured, x - x_mean[:, None, :], 0)
+            dy = np.where(measured, values - y_mean[:, None, :], 0)
+            self.slope = ((dx * dy).sum(axis = 1) / (dx ** 2).sum(axis = 1)).astype(np.float32)
+            self.slope[count < 2] = np.nan
+
+            # rank among the measured locations of the same indicator and time; NaN sorts last
+            order = np.argsort(values, axis = 2, kind = 'stable')
+            ranks = np.empty_like(order)
+            np.put_along_axis(ranks, order, np.broadcast_to(np.arange(values.shape[2]), order.shape), axis = 2)
+            measured_count = measured.sum(axis = 2, keepdims = True)
+            self.percentile = np.where(measured, ranks / np.maximum(measured_count - 1, 1) * 100, np.nan).astype(np.float32)
+
+            self.value_range = np.stack([np.nanmin(values, axis = (1, 2)), np.nanmax(values, axis = (1, 2))], axis = 1)
+            self.slope_range = np.nanmax(np.abs(self.slope), axis = 1)
+
+        # times without any measurement have all-NaN quantiles
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.quantiles = np.nanquantile(values, QUANTILES, axis = 2).astype(np.float32)
+
+    def position(self, indicator, time = None):
+        i = self.indicators.index(indicator)
+        return i if time is None else (i, self.times.index(time))
+
+    # times with at least one measured location for the indicator
+    def times_of(self, indicator):
+        measured = ~np.isnan(self.values[self.position(indicator)]).all(axis = 1)
+        return [time for time, present in zip(self.times, measured) if present]
+
+    # attribute values of one indicator
+    def attributes(self, indicator):
+        i = self.position(indicator)
+        return {column: values[i] for column, values in self.indicator_attributes.items()}
+
+    # arrays over the measured locations of (indicator, time): location, its attributes, value, change,
+    # change_pct and percentile
+    def cells(self, indicator, time):
+        i, t = self.position(indicator, time)
+        measured = ~np.isnan(self.values[i, t])
+        return {
+            'location': self.locations[measured],
+            **{column: values[measured] for column, values in self.location_attributes.items()},
+            'value': self.values[i, t, measured],
+            'change': self.change[i, t, measured],
+            'change_pct': self.change_pct[i, t, measured],
+            'percentile': self.percentile[i, t, measured],
+        }
+
+    # arrays over the locations with a trend for the indicator: location, its attributes and slope
+    def trends(self, indicator):
+        slope = self.slope[self.position(indicator)]
+        measured = ~np.isnan(slope)
+        return {
+            'location': self.locations[measured],
+            **{column: values[measured] for column, values in self.location_attributes.items()},
+            'slope': slope[measured],
+        }
+
+    # QUANTILES across locations per measured time of the indicator, as {'time': [...], 'q50': [...], ...}
+    def summary(self, indicator):
+        i = self.position(indicator)
+        measured = ~np.isnan(self.quantiles[0, i])
+        return {
+            'time': [time for time, present in zip(self.times, measured) if present],
+            **{f"q{round(q * 100)}": self.quantiles[k, i, measured].tolist() for k, q in enumerate(QUANTILES)},
+        }
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.values, self.change, self.change_pct, self.slope, self.percentile, self.quantiles))
+
+
+def _time_sort_key(time):
+    try:
+        return (0, float(time), time)
+    except ValueError:
+        return (1, 0.0, time)
+
+
+# numeric positions of the time labels for the trend slopes: the labels themselves when they are numbers
+# (so slopes are per year), otherwise their order
+def _time_values(times):
+    try:
+        return np.asarray([float(time) for time in times])
+    except ValueError:
+        return np.arange(len(times), dtype = float)
+
+
+# returns the cached cube of a dataset version, building it on first use
+def cube(name, version, build_frame, indicator, time, location, value, indicator_columns = (), location_columns = ()):
+    return src.cache.derived_value(
+        f"cube:{name}",
+        version,
+        lambda: Cube(build_frame(), indicator, time, location, value, indicator_columns, location_columns),
+        sizeof = lambda cube: cube.nbytes
+    )
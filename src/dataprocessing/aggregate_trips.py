@@ -0,0 +1,239 @@
+import argparse
+import calendar
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Local streaming aggregation of raw TLC trip records
+# Reads the monthly trip-record Parquet files published by the TLC (yellow_tripdata_YYYY-MM.parquet,
+# green_tripdata_YYYY-MM.parquet, fhvhv_tripdata_YYYY-MM.parquet) and produces the aggregated datasets the
+# pages consume: map_pickup, map_dropoff, monthly and od_flows. Files are split into row-group chunks that are
+# aggregated in parallel by a process pool; each worker streams record batches and keeps only fixed-size
+# per-zone accumulators, so memory stays bounded however many rows an HVFHV month has.
+#
+# All aggregates count weekday (Monday-Friday) trips whose pickup falls in the file's month; daily
+# averages divide by the number of weekdays in the month; od_flows counts trips per (pickup zone, dropoff
+# zone) pair, listing only the pairs with trips. monthly.csv covers trips that begin and/or end
+# in a CBD zone, as listed in the CBD_Zone property of data/CBD_Taxi.geojson.
+#
+#   python -m src.dataprocessing.aggregate_trips raw/                 # write map_pickup.csv, map_dropoff.csv, monthly.csv, od_flows.csv to data/aggregated/
+#   python -m src.dataprocessing.aggregate_trips raw/ --ingest        # append the months as partitions instead
+#   python -m src.dataprocessing.aggregate_trips raw/ --workers 8 --batch-size 250000
+
+FILE_PATTERN = re.compile(r'(?P<kind>yellow|green|fhvhv)_tripdata_(?P<year>\d{4})-(?P<month>\d{2})\.parquet$')
+
+# raw file kind -> service name and the columns holding pickup/dropoff time and trip distance
+SERVICES = {
+    'yellow': {'service': 'Yellow Taxi', 'pickup': 'tpep_pickup_datetime', 'dropoff': 'tpep_dropoff_datetime', 'miles': 'trip_distance'},
+    'green': {'service': 'Green Taxi', 'pickup': 'lpep_pickup_datetime', 'dropoff': 'lpep_dropoff_datetime', 'miles': 'trip_distance'},
+    'fhvhv': {'service': 'HVFHV', 'pickup': 'pickup_datetime', 'dropoff': 'dropoff_datetime', 'miles': 'trip_miles'},
+}
+
+CBD_GEOJSON_PATH = os.path.join('data', 'CBD_Taxi.geojson')
+MAX_LOCATION_ID = 265
+DEFAULT_BATCH_SIZE = 500_000
+DEFAULT_ROW_GROUPS_PER_TASK = 4
+
+
+# LocationIDs whose CBD_Zone is 'CBD', read from the GeoJSON properties without parsing geometry
+def cbd_location_ids(path = CBD_GEOJSON_PATH):
+    with open(path, 'r') as f:
+        features = json.load(f)['features']
+    return sorted({int(feature['properties']['LocationID']) for feature in features
+                   if feature['properties'].get('CBD_Zone') == 'CBD'})
+
+
+def weekdays_in_month(year, month):
+    days = calendar.monthrange(year, month)[1]
+    return int(np.busday_count(f"{year:04d}-{month:02d}-01", np.datetime64(f"{year:04d}-{month:02d}-01") + np.timedelta64(days, 'D')))
+
+
+class MonthAggregate:
+    """Additive per-zone, zone-to-zone and CBD accumulators for one (service, month)"""
+
+    def __init__(self):
+        self.pickups = np.zeros(MAX_LOCATION_ID + 1, dtype = np.int64)
+        self.dropoffs = np.zeros(MAX_LOCATION_ID + 1, dtype = np.int64)
+        # trips from pickup zone (row) to dropoff zone (column)
+        self.od = np.zeros((MAX_LOCATION_ID + 1, MAX_LOCATION_ID + 1), dtype = np.int64)
+        self.cbd_trips = 0
+        self.cbd_miles = 0.0
+        self.cbd_hours = 0.0
+        self.rows_read = 0
+
+    def merge(self, other):
+        self.pickups += other.pickups
+        self.dropoffs += other.dropoffs
+        self.od += other.od
+        self.cbd_trips += other.cbd_trips
+        self.cbd_miles += other.cbd_miles
+        self.cbd_hours += other.cbd_hours
+        self.rows_read += other.rows_read
+        return self
+
+
+# worker: streams one chunk of row groups of one file and returns its MonthAggregate
+def aggregate_chunk(path, kind, year, month, row_groups, cbd_ids, batch_size):
+    columns = SERVICES[kind]
+    month_start = np.datetime64(f"{year:04d}-{month:02d}-01", 'us')
+    month_end = month_start.astype('datetime64[M]') + np.timedelta64(1, 'M')
+    month_end = month_end.astype('datetime64[us]')
+    is_cbd = np.zeros(MAX_LOCATION_ID + 1, dtype = bool)
+    is_cbd[cbd_ids] = True
+
+    aggregate = MonthAggregate()
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size = batch_size, row_groups = row_groups,
+                                           columns = [columns['pickup'], columns['dropoff'], columns['miles'],
+                                                      'PULocationID', 'DOLocationID']):
+        aggregate.rows_read += batch.num_rows
+        pickup = pc.cast(batch.column(columns['pickup']), 'timestamp[us]').to_numpy(zero_copy_only = False)
+        dropoff = pc.cast(batch.column(columns['dropoff']), 'timestamp[us]').to_numpy(zero_copy_only = False)
+        pu = batch.column('PULocationID').fill_null(0).to_numpy(zero_copy_only = False).astype(np.int64)
+        do = batch.column('DOLocationID').fill_null(0).to_numpy(zero_copy_only = False).astype(np.int64)
+        miles = batch.column(columns['miles']).fill_null(0).to_numpy(zero_copy_only = False).astype(np.float64)
+
+        # weekday trips picked up inside the file's month, with known zones (1970-01-01 was a Thursday)
+        days = pickup.astype('datetime64[D]').astype(np.int64)
+        keep = ((pickup >= month_start) & (pickup < month_end) & ((days + 3) % 7 < 5)
+                & (pu >= 1) & (pu <= MAX_LOCATION_ID) & (do >= 1) & (do <= MAX_LOCATION_ID))
+        pu, do, miles = pu[keep], do[keep], miles[keep]
+        hours = (dropoff[keep] - pickup[keep]).astype('timedelta64[s]').astype(np.float64) / 3600
+
+        aggregate.pickups += np.bincount(pu, minlength = MAX_LOCATION_ID + 1)
+        aggregate.dropoffs += np.bincount(do, minlength = MAX_LOCATION_ID + 1)
+        aggregate.od += np.bincount(pu * (MAX_LOCATION_ID + 1) + do, minlength = (MAX_LOCATION_ID + 1) ** 2).reshape(aggregate.od.shape)
+        cbd = is_cbd[pu] | is_cbd[do]
+        aggregate.cbd_trips += int(cbd.sum())
+        aggregate.cbd_miles += float(miles[cbd].sum())
+        aggregate.cbd_hours += float(np.clip(hours[cbd], 0, None).sum())
+    return aggregate
+
+
+def discover(input_dir):
+    files = []
+    for name in sorted(os.listdir(input_dir)):
+        match = FILE_PATTERN.search(name)
+        if match:
+            files.append((os.path.join(input_dir, name), match['kind'], int(match['year']), int(match['month'])))
+    return files
+
+
+def tasks_for(files, row_groups_per_task):
+    for path, kind, year, month in files:
+        num_row_groups = pq.ParquetFile(path).num_row_groups
+        for start in range(0, num_row_groups, row_groups_per_task):
+            yield path, kind, year, month, list(range(start, min(start + row_groups_per_task, num_row_groups)))
+
+
+def aggregate_files(files, cbd_ids, workers = None, batch_size = DEFAULT_BATCH_SIZE, row_groups_per_task = DEFAULT_ROW_GROUPS_PER_TASK):
+    aggregates = defaultdict(MonthAggregate)
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        futures = {pool.submit(aggregate_chunk, path, kind, year, month, row_groups, cbd_ids, batch_size): (kind, year, month)
+                   for path, kind, year, month, row_groups in tasks_for(files, row_groups_per_task)}
+        for future in as_completed(futures):
+            aggregates[futures[future]].merge(future.result())
+    return aggregates
+
+
+# turns the accumulators into frames with exactly the columns of map_pickup.csv, map_dropoff.csv, monthly.csv
+# and od_flows.csv
+def to_frames(aggregates):
+    pickups, dropoffs, monthly, flows = [], [], [], []
+    for (kind, year, month), aggregate in sorted(aggregates.items(), key = lambda item: (item[0][1], item[0][2], item[0][0])):
+        service = SERVICES[kind]['service']
+        weekdays = weekdays_in_month(year, month)
+        label = pd.Timestamp(year = year, month = month, day = 1)
+        for counts, prefix, frames in [(aggregate.pickups, 'PU', pickups), (aggregate.dropoffs, 'DO', dropoffs)]:
+            location_ids = np.flatnonzero(counts)
+            frames.append(pd.DataFrame({
+                'service': service,
+                'year': year,
+                'month_year': label.strftime('%b-%Y'),
+                f"{prefix}LocationID": location_ids,
+                f"{prefix}_Monthly_Total": counts[location_ids],
+                f"{prefix}_Daily_Average": np.rint(counts[location_ids] / weekdays).astype(np.int64),
+            }))
+        origins, destinations = np.nonzero(aggregate.od)
+        flows.append(pd.DataFrame({
+            'service': service,
+            'year': year,
+            'month_year': label.strftime('%b-%Y'),
+            'PULocationID': origins,
+            'DOLocationID': destinations,
+            'trips': aggregate.od[origins, destinations],
+        }))
+        monthly.append({
+            'Weekday_Check': 'Weekday',
+            'service': service,
+            'year': year,
+            'month_year': label.strftime('%b-%y'),
+            'CBD_Check': 'CBD',
+            'trips': aggregate.cbd_trips,
+            'trip_miles': round(aggregate.cbd_miles, 2),
+            'trip_time': round(aggregate.cbd_hours, 3),
+            'monthly_trips': int(round(aggregate.cbd_trips / weekdays)),
+            'monthly_miles': int(round(aggregate.cbd_miles / weekdays)),
+            'monthly_time': int(round(aggregate.cbd_hours / weekdays)),
+        })
+    return {
+        'map_pickup': pd.concat(pickups, ignore_index = True),
+        'map_dropoff': pd.concat(dropoffs, ignore_index = True),
+        'monthly': pd.DataFrame(monthly),
+        'od_flows': pd.concat(flows, ignore_index = True),
+    }
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Aggregate raw TLC trip-record Parquet files')
+    parser.add_argument('input_dir', help = 'directory with yellow/green/fhvhv_tripdata_YYYY-MM.parquet files')
+    parser.add_argument('--output-dir', default = os.path.join('data', 'aggregated'), help = 'where to write the CSVs (default: data/aggregated)')
+    parser.add_argument('--ingest', action = 'store_true', help = 'append the months as data/partitions instead of writing CSVs')
+    parser.add_argument('--replace', action = 'store_true', help = 'with --ingest, allow rewriting months that already exist')
+    parser.add_argument('--workers', type = int, default = None, help = 'worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type = int, default = DEFAULT_BATCH_SIZE, help = 'rows per streamed record batch')
+    parser.add_argument('--row-groups-per-task', type = int, default = DEFAULT_ROW_GROUPS_PER_TASK)
+    parser.add_argument('--cbd-geojson', default = CBD_GEOJSON_PATH, help = 'GeoJSON with LocationID and CBD_Zone properties')
+    args = parser.parse_args(argv)
+
+    files = discover(args.input_dir)
+    if not files:
+        parser.error(f"no TLC trip-record files found in {args.input_dir}")
+
+    start = time.perf_counter()
+    aggregates = aggregate_files(files, cbd_location_ids(args.cbd_geojson), workers = args.workers,
+                                 batch_size = args.batch_size, row_groups_per_task = args.row_groups_per_task)
+    rows = sum(aggregate.rows_read for aggregate in aggregates.values())
+    print(f"aggregated {rows} trips from {len(files)} files in {time.perf_counter() - start:.1f}s")
+
+    frames = to_frames(aggregates)
+    if args.ingest:
+        import src.partitions
+        # all datasets or none: a month rejected for one of them leaves the partitions as they were
+        try:
+            written, version = src.partitions.ingest_all(frames, replace = args.replace)
+        except src.partitions.IngestError as e:
+            print(f"ingest failed: {e}", file = sys.stderr)
+            return 1
+        for name, keys in written.items():
+            print(f"{name}: ingested {', '.join(keys)}, dataset version {version}")
+    else:
+        os.makedirs(args.output_dir, exist_ok = True)
+        for name, df in frames.items():
+            path = os.path.join(args.output_dir, f"{name}.csv")
+            df.to_csv(path, index = False)
+            print(f"wrote {path} ({len(df)} rows)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import src.artifacts
+import src.partitions
+import src.pages.air_quality as air_quality
+import src.pages.monthly_averages as monthly_averages
+import src.pages.od_flows as od_flows
+import src.pages.pickups_dropoffs as pickups_dropoffs
+
+# Offline "compile data" step
+# Runs each page's raw-file transform once and stores the result under data/compiled/ as typed, pre-joined
+# Feather artifacts with a manifest (schema, row counts, checksums of the artifact and of every source).
+# The pages memory-map these artifacts instead of parsing CSV/GeoJSON at request time.
+#
+#   python -m src.dataprocessing.compile_data            # compile everything whose sources exist
+#   python -m src.dataprocessing.compile_data --strict   # fail instead of skipping missing sources
+
+# artifact name -> page module providing build_dataset(), SCHEMA_VERSION and its source files
+# pages whose build_dataset returns several frames list them in ARTIFACT_PARTS; each part is written as
+# its own artifact named <name>.<part>
+ARTIFACTS = {
+    'air_quality': (air_quality, [air_quality.GEOJSON_PATH, air_quality.AIR_QUALITY_PATH]),
+    'monthly': (monthly_averages, [monthly_averages.MONTHLY_PATH, src.partitions.MANIFEST_PATH]),
+    'pickups_dropoffs': (pickups_dropoffs, [pickups_dropoffs.GEOJSON_PATH, pickups_dropoffs.PICKUP_PATH, pickups_dropoffs.DROPOFF_PATH,
+                                            src.partitions.MANIFEST_PATH]),
+    'od_flows': (od_flows, [od_flows.GEOJSON_PATH, od_flows.OD_PATH, src.partitions.MANIFEST_PATH]),
+}
+
+
+def compile_artifacts(names, strict = False):
+    manifest = src.artifacts.load_manifest()
+    manifest['version'] = src.artifacts.MANIFEST_VERSION
+
+    for name in names:
+        page, sources = ARTIFACTS[name]
+        # the partition manifest is optional, and a CSV may be absent once it has been partitioned
+        missing = [source for source in sources
+                   if source != src.partitions.MANIFEST_PATH and not os.path.exists(source) and not src.partitions.covers(source)]
+        if missing:
+            if strict:
+                raise FileNotFoundError(f"{name}: missing source file(s) {', '.join(missing)}")
+            print(f"skipping {name}: missing source file(s) {', '.join(missing)}")
+            continue
+
+        start = time.perf_counter()
+        dataset = page.build_dataset()
+        parts = getattr(page, 'ARTIFACT_PARTS', None)
+        frames = {f"{name}.{part}": frame for part, frame in zip(parts, dataset)} if parts else {name: dataset}
+        for artifact_name, frame in frames.items():
+            entry = src.artifacts.write_artifact(artifact_name, frame, sources, page.SCHEMA_VERSION)
+            entry['compiled_at'] = datetime.now(timezone.utc).isoformat()
+            manifest['artifacts'][artifact_name] = entry
+            print(f"compiled {artifact_name}: {entry['rows']} rows, {entry['bytes'] / 1e6:.1f} MB")
+        print(f"built {name} in {time.perf_counter() - start:.2f}s")
+
+    src.artifacts.write_manifest(manifest)
+    return manifest
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Compile data/ into memory-mappable artifacts')
+    parser.add_argument('names', nargs = '*', help = f"artifacts to compile, any of {', '.join(ARTIFACTS)} (default: all)")
+    parser.add_argument('--strict', action = 'store_true', help = 'fail when a source file is missing')
+    args = parser.parse_args(argv)
+    unknown = sorted(set(args.names) - set(ARTIFACTS))
+    if unknown:
+        parser.error(f"unknown artifact(s): {', '.join(unknown)}")
+    compile_artifacts(args.names or list(ARTIFACTS), strict = args.strict)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import argparse
+import os
+import sys
+
+import pandas as pd
+
+import src.partitions
+
+# Incremental monthly ingestion for the TLC datasets
+#
+#   python -m src.dataprocessing.ingest bootstrap                        # split data/*.csv into month partitions (one-off)
+#   python -m src.dataprocessing.ingest add map_pickup new_month.csv     # validate and append new month(s)
+#   python -m src.dataprocessing.ingest add monthly fix.csv --replace    # rewrite months that already exist
+#   python -m src.dataprocessing.ingest list
+#
+# Running apps memory-map only the new partitions, but still rebuild each affected page frame over every month
+# (see src/partitions.py).
+
+
+def bootstrap(names):
+    for name in names:
+        written, version = src.partitions.bootstrap(name)
+        print(f"{name}: {len(written)} partitions ({written[0]} to {written[-1]}), dataset version {version}")
+
+
+def add(name, path, replace):
+    df = pd.read_csv(path, engine = 'pyarrow')
+    written, version = src.partitions.ingest(name, df, replace = replace)
+    print(f"{name}: wrote {', '.join(written)} ({len(df)} rows), dataset version {version}")
+
+
+def list_partitions():
+    manifest = src.partitions.load_manifest()
+    print(f"dataset version {manifest['version']}")
+    for name, dataset in sorted(manifest['datasets'].items()):
+        partitions = dataset['partitions']
+        rows = sum(partition['rows'] for partition in partitions.values())
+        keys = sorted(partitions)
+        print(f"{name}: {len(keys)} partitions, {rows} rows" + (f", {keys[0]} to {keys[-1]}" if keys else ''))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Month-partitioned ingestion of the TLC datasets')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    bootstrap_parser = subparsers.add_parser('bootstrap', help = 'split the existing CSVs into month partitions')
+    bootstrap_parser.add_argument('names', nargs = '*', help = f"datasets, any of {', '.join(src.partitions.DATASETS)} (default: all)")
+    add_parser = subparsers.add_parser('add', help = 'validate a CSV of new rows and append it as month partitions')
+    add_parser.add_argument('name', choices = list(src.partitions.DATASETS))
+    add_parser.add_argument('path', help = 'CSV with the same columns as the dataset')
+    add_parser.add_argument('--replace', action = 'store_true', help = 'allow rewriting months that already exist')
+    subparsers.add_parser('list', help = 'show partitions and the dataset version')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'bootstrap':
+            unknown = sorted(set(args.names) - set(src.partitions.DATASETS))
+            if unknown:
+                parser.error(f"unknown dataset(s): {', '.join(unknown)}")
+            # by default every dataset whose CSV exists; od_flows.csv only once aggregate_trips has produced it
+            bootstrap(args.names or [name for name, spec in src.partitions.DATASETS.items() if os.path.exists(spec['path'])])
+        elif args.command == 'add':
+            add(args.name, args.path, args.replace)
+        else:
+            list_partitions()
+    except src.partitions.IngestError as e:
+        print(f"ingest failed: {e}", file = sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
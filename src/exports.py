@@ -0,0 +1,115 @@
+import gzip
+import io
+import tempfile
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv
+import streamlit as st
+
+import src.cache
+import src.charts
+import src.telemetry
+
+# Download payloads
+# Export bytes are produced only when a user asks for them, then kept in the process-wide export cache
+# keyed by export name, normalized filter tuple, dataset version and format, so the next user asking for
+# the same slice gets them without re-encoding. Tabular formats leave geometry out; GeoJSON keeps it.
+
+FORMATS = {
+    'csv': {'label': 'CSV', 'extension': '.csv', 'mime': 'text/csv'},
+    'csv.gz': {'label': 'CSV (gzip)', 'extension': '.csv.gz', 'mime': 'application/gzip'},
+    'parquet': {'label': 'Parquet', 'extension': '.parquet', 'mime': 'application/vnd.apache.parquet'},
+    'geojson': {'label': 'GeoJSON', 'extension': '.geojson', 'mime': 'application/geo+json'},
+}
+TABULAR_FORMATS = ('csv', 'csv.gz', 'parquet')
+
+CHUNK_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+# geometry columns are found by dtype, since the tables rename 'geometry' for display
+def geometry_columns(df):
+    return [column for column, dtype in df.dtypes.items() if dtype == 'geometry']
+
+
+def to_bytes(df, fmt):
+    geometry = geometry_columns(df)
+    if fmt == 'geojson':
+        return gpd.GeoDataFrame(df, geometry = geometry[0]).to_json().encode('utf-8')
+    if geometry:
+        df = pd.DataFrame(df.drop(columns = geometry))
+    if fmt == 'csv':
+        return df.to_csv(index = False).encode('utf-8')
+    if fmt == 'csv.gz':
+        return gzip.compress(df.to_csv(index = False).encode('utf-8'), compresslevel = 6)
+    if fmt == 'parquet':
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index = False)
+        return buffer.getvalue()
+    raise ValueError(f"unknown export format {fmt}")
+
+
+# gzip-compressed CSV written chunk by chunk, so only one chunk is ever held as text
+# chunks is an iterable of DataFrames with identical columns; pyarrow's CSV writer is several times faster
+# than DataFrame.to_csv on millions of rows
+def stream_csv_gz(chunks):
+    with tempfile.SpooledTemporaryFile(max_size = CHUNK_SPOOL_BYTES) as spool:
+        with gzip.GzipFile(fileobj = spool, mode = 'wb', compresslevel = 6) as compressed:
+            header = True
+            for chunk in chunks:
+                pyarrow.csv.write_csv(pa.Table.from_pandas(chunk, preserve_index = False), compressed,
+                                      pyarrow.csv.WriteOptions(include_header = header))
+                header = False
+        spool.seek(0)
+        return spool.read()
+
+
+def _request(state_key, cache_key):
+    st.session_state[state_key] = cache_key
+
+
+def _cached_download_button(label, state_key, cache_key, build, file_name, fmt):
+    # payloads are built only after the user asked for this exact slice and format, or when another
+    # session already built them
+    if cache_key in src.cache.export_cache or st.session_state.get(state_key) == cache_key:
+        with src.telemetry.span('export'):
+            data = src.cache.export_cache.get_or_create(cache_key, build, sizeof = len)
+        st.download_button(
+                label = label,
+                data = data,
+                file_name = f"{file_name}{FORMATS[fmt]['extension']}",
+                mime = FORMATS[fmt]['mime'],
+                key = f"{state_key}:download"
+        )
+    else:
+        st.button(f"Prepare {label}", key = f"{state_key}:prepare", on_click = _request, args = (state_key, cache_key))
+
+
+# key of a download button's format picker, kept while its view is hidden (src/views.py)
+def widget_keys(name):
+    return [f"export:{name}:format"]
+
+
+# format picker plus an on-demand download button for the frame returned by build_frame()
+def download_button(label, name, key, version, build_frame, file_name, formats = TABULAR_FORMATS):
+    state_key = f"export:{name}"
+    format_col, button_col = st.columns([1, 3])
+    with format_col:
+        fmt = st.selectbox(
+                "Format",
+                options = list(formats),
+                format_func = lambda fmt: FORMATS[fmt]['label'],
+                key = f"{state_key}:format",
+                label_visibility = 'collapsed'
+        )
+    with button_col:
+        cache_key = (name, src.charts.normalize_key(*key), version, fmt)
+        _cached_download_button(label, state_key, cache_key, lambda: to_bytes(build_frame(), fmt), file_name, fmt)
+
+
+# on-demand gzip CSV of a whole dataset, built from build_chunks() one chunk at a time
+def bulk_download_button(label, name, version, build_chunks, file_name):
+    state_key = f"export:{name}:bulk"
+    cache_key = (name, 'bulk', version, 'csv.gz')
+    _cached_download_button(label, state_key, cache_key, lambda: stream_csv_gz(build_chunks()), file_name, 'csv.gz')
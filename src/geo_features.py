@@ -0,0 +1,89 @@
+import numpy as np
+from shapely.geometry import mapping
+
+import src.cache
+import src.topology
+
+# Pre-serialized GeoJSON feature stores for the choropleth maps
+# Each polygon layer (UHF42 neighborhoods, taxi zones) is converted to GeoJSON once per dataset version
+# and kept in the process-wide cache, keyed by a stable feature id (UHFCODE / LocationID). Figures pick
+# features by id and reference them through featureidkey, so a rerun only changes the value column.
+# Coordinates are held as rounded NumPy arrays: Plotly deep-copies trace properties when building a
+# figure and copying a few hundred arrays is far cheaper than copying millions of coordinate tuples.
+# The maps' stores hold the polygons after src/topology.py has quantized and simplified them to the
+# variant that fits the map payload budget; the full-precision geometries stay with the datasets.
+
+COORDINATE_PRECISION = 6
+
+
+class FeatureStore:
+    """GeoJSON features serialized once per geometry layer and looked up by feature id"""
+
+    def __init__(self, geometries, precision = COORDINATE_PRECISION, zoom = None):
+        self.precision = precision
+        # zoom variant of src.topology the polygons were simplified for, None when they were not
+        self.zoom = zoom
+        self.features = {}
+        for feature_id, geometry in geometries.items():
+            if geometry is None or geometry.is_empty:
+                continue
+            feature_id = _plain(feature_id)
+            self.features[feature_id] = {
+                'type': 'Feature',
+                'id': feature_id,
+                'geometry': self._geometry(geometry),
+            }
+
+    # FeatureCollection holding only the requested features, or every feature when ids is None
+    def collection(self, ids = None):
+        if ids is None:
+            features = list(self.features.values())
+        else:
+            features = [self.features[_plain(feature_id)] for feature_id in ids if _plain(feature_id) in self.features]
+        return {'type': 'FeatureCollection', 'features': features}
+
+    @property
+    def nbytes(self):
+        return sum(ring.nbytes for feature in self.features.values() for ring in _rings(feature['geometry']))
+
+    def _geometry(self, geometry):
+        if geometry.geom_type == 'Polygon':
+            return {'type': 'Polygon', 'coordinates': self._polygon(geometry)}
+        if geometry.geom_type == 'MultiPolygon':
+            return {'type': 'MultiPolygon', 'coordinates': [self._polygon(polygon) for polygon in geometry.geoms]}
+        return mapping(geometry)
+
+    def _polygon(self, polygon):
+        return [np.round(np.asarray(ring.coords)[:, :2], self.precision)
+                for ring in [polygon.exterior, *polygon.interiors]]
+
+
+def _rings(geometry):
+    if geometry['type'] == 'Polygon':
+        return geometry['coordinates']
+    if geometry['type'] == 'MultiPolygon':
+        return [ring for polygon in geometry['coordinates'] for ring in polygon]
+    return []
+
+
+# feature ids are compared by value in the browser, so NumPy scalars become plain ints/strings
+def _plain(feature_id):
+    if isinstance(feature_id, (float, np.floating)) and float(feature_id).is_integer():
+        return int(feature_id)
+    if isinstance(feature_id, np.generic):
+        return feature_id.item()
+    return feature_id
+
+
+# feature store of the zoom variant maps use (src.topology.Topology.map_zoom)
+def map_features(geometries):
+    topology = src.topology.Topology(geometries)
+    zoom = topology.map_zoom()
+    return FeatureStore(topology.geometries(zoom), precision = topology.precision, zoom = zoom)
+
+
+# returns the cached feature store for a layer, building it from a GeoSeries indexed by feature id
+# the first time a dataset version is seen
+def feature_store(layer, version, build_geometries):
+    return src.cache.derived_value(f"features:{layer}", version, lambda: map_features(build_geometries()),
+                                   sizeof = lambda store: store.nbytes)
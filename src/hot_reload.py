@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+import traceback
+
+# Background hot reload of the page datasets
+# A daemon thread polls the source signatures of every dataset that has been loaded (the files under data/,
+# the compiled-artifact manifest and the partition manifest). When a dataset's sources change, the new
+# version is built and warmed on that thread and swapped in whole, see src.cache.DatasetBuffer; reruns
+# already in flight keep the version they pinned in begin_rerun() and the next rerun sees the new one.
+# A failed reload is logged and the old version stays live, so a bad refresh never takes a page down.
+#
+# MTA_RELOAD_INTERVAL sets the poll interval in seconds (default 30), MTA_HOT_RELOAD=0 turns the watcher off.
+# app.py imports this module before first paint, so src.cache (pandas) is imported where it is used.
+
+RELOAD_INTERVAL = float(os.environ.get('MTA_RELOAD_INTERVAL', 30))
+
+_lock = threading.Lock()
+_thread = None
+
+
+def enabled():
+    return os.environ.get('MTA_HOT_RELOAD', '1') not in ('', '0')
+
+
+# reloads every dataset whose sources changed, returns the names of the datasets that went live
+def check_now():
+    import src.cache
+
+    reloaded = []
+    for buffer in src.cache.dataset_buffers():
+        try:
+            if buffer.reload_if_changed():
+                reloaded.append(buffer.name)
+        except Exception:
+            print(f"Reloading {buffer.name} failed, keeping the current version")
+            traceback.print_exc()
+    return reloaded
+
+
+def _watch(interval):
+    import src.cache
+
+    src.cache.set_watching(True)
+    while True:
+        time.sleep(interval)
+        start = time.perf_counter()
+        for name in check_now():
+            print(f"Reloaded {name} in {time.perf_counter() - start:.1f}s, generation {src.cache.generation()}")
+
+
+# starts the watcher once per process; calls from later reruns are no-ops
+def start(interval = None):
+    global _thread
+    if not enabled():
+        return False
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target = _watch, args = (interval or RELOAD_INTERVAL,), name = 'dataset-reload', daemon = True)
+            _thread.start()
+    return True
+
+
+# called at the start and end of every rerun, so a rerun uses one version of each dataset throughout
+def begin_rerun():
+    import src.cache
+    src.cache.pin_datasets()
+
+
+def end_rerun():
+    import src.cache
+    src.cache.unpin_datasets()
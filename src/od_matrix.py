@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+import src.cache
+
+# Sparse origin-destination matrices
+# Zone-to-zone trip counts are held per key (e.g. (month_year, service)) as a scipy CSR matrix over the zone
+# ids, rows being pickup zones and columns dropoff zones. Most of the ~70,000 taxi zone pairs have no trips
+# in a given month, green and yellow taxis especially, so only the pairs with trips are stored instead of a
+# dense months x services x zones² pivot. All keys are stacked into one CSR, one block of rows per key:
+#   matrix(key)         one key's matrix, a row slice of the stacked matrix
+#   top(key, k)         the k largest flows, optionally only from/to a set of zones
+#   region_totals(mask) trips within, into and out of a set of zones (the CBD) for every key at once, from
+#                       two sparse matrix-vector products over the stacked matrix
+#   change(key, other)  the difference of two keys' matrices, e.g. month over month
+
+
+class FlowMatrices:
+    """Sparse origin-destination matrices for every key of a long-format flow frame"""
+
+    def __init__(self, df, keys, origin, destination, value, size):
+        self.size = size
+        # keys in category order, so months follow the calendar
+        groups = df.groupby(keys, observed = True, sort = True)
+        codes = groups.ngroup().to_numpy()
+        self.keys = [tuple(key) for key in groups.size().index]
+        self.key_names = list(keys)
+        self._positions = {key: i for i, key in enumerate(self.keys)}
+
+        rows = codes.astype(np.int64) * size + df[origin].to_numpy(dtype = np.int64)
+        self.stacked = sp.csr_matrix(
+            (df[value].to_numpy(dtype = np.int64), (rows, df[destination].to_numpy(dtype = np.int64))),
+            shape = (len(self.keys) * size, size)
+        )
+        self.stacked.sum_duplicates()
+
+    def position(self, key):
+        return self._positions[tuple(key)]
+
+    def __contains__(self, key):
+        return tuple(key) in self._positions
+
+    def matrix(self, key):
+        i = self.position(key)
+        return self.stacked[i * self.size:(i + 1) * self.size]
+
+    # the k largest flows of a key as (origin, destination, value) arrays, largest first; origins and
+    # destinations are optional boolean masks over the zone ids
+    def top(self, key, k, origins = None, destinations = None):
+        return _top(self.matrix(key).tocoo(), k, origins, destinations)
+
+    # (key, other) differences: the k largest increases and the k largest decreases
+    def change(self, key, other, k, origins = None, destinations = None):
+        difference = (self.matrix(key) - self.matrix(other)).tocoo()
+        increases = _top(difference, k, origins, destinations)
+        decreases = _top(-difference, k, origins, destinations)
+        return increases, tuple(-values if i == 2 else values for i, values in enumerate(decreases))
+
+    # trips within the zones of mask, into them from outside and out of them to outside, for every key
+    def region_totals(self, mask):
+        inside = np.asarray(mask, dtype = np.float64)
+        to_region = (self.stacked @ inside).reshape(len(self.keys), self.size)
+        from_zone = np.asarray(self.stacked.sum(axis = 1)).reshape(len(self.keys), self.size)
+        totals = pd.DataFrame({
+            'within': to_region @ inside,
+            'into': to_region @ (1 - inside),
+            'out_of': (from_zone - to_region) @ inside,
+            'total': from_zone.sum(axis = 1),
+        }, index = pd.MultiIndex.from_tuples(self.keys, names = self.key_names))
+        return totals.astype(np.int64)
+
+    # dense block of a key's matrix restricted to the given zone ids, for a heatmap
+    def dense(self, key, zones):
+        zones = np.asarray(zones)
+        return self.matrix(key)[zones][:, zones].toarray()
+
+    @property
+    def nbytes(self):
+        return self.stacked.data.nbytes + self.stacked.indices.nbytes + self.stacked.indptr.nbytes
+
+
+def _top(coo, k, origins, destinations):
+    keep = coo.data > 0
+    if origins is not None:
+        keep &= np.asarray(origins)[coo.row]
+    if destinations is not None:
+        keep &= np.asarray(destinations)[coo.col]
+    row, col, data = coo.row[keep], coo.col[keep], coo.data[keep]
+    if len(data) > k:
+        largest = np.argpartition(data, -k)[-k:]
+        row, col, data = row[largest], col[largest], data[largest]
+    order = np.lexsort((col, row, -data))
+    return row[order], col[order], data[order]
+
+
+# returns the cached flow matrices of a dataset version, building them on first use
+def flow_matrices(name, version, build_frame, keys, origin, destination, value, size):
+    return src.cache.derived_value(
+        f"flows:{name}",
+        version,
+        lambda: FlowMatrices(build_frame(), keys, origin, destination, value, size),
+        sizeof = lambda flows: flows.nbytes
+    )
@@ -0,0 +1,134 @@
+import argparse
+import importlib
+import os
+import subprocess
+import sys
+import threading
+import time
+
+# Lazy page registry
+# app.py lists pages as LazyPage references instead of importing them, so the sidebar and front page render
+# without loading geopandas, plotly or altair. A page module is imported, and its dataset warmed, the first
+# time someone navigates to it; the process keeps both for every later session.
+# Streamlit re-executes app.py on every rerun, so the LazyPage objects live here, one per module for the
+# whole process, and app.py and the warm-up (src/warmup.py) look them up with get().
+#
+# Set MTA_IMPORT_PROFILE=1 to show page import/warm-up timings in the sidebar, or run
+#   python -m src.page_registry profile             # cold-start import cost of app.py and each page
+#   python -m src.page_registry profile --top 25
+
+PROFILE_ENV = 'MTA_IMPORT_PROFILE'
+# the shell is app.py with everything it imports, profiled without starting the warm-up or the reload watcher
+SHELL_MODULES = ['app']
+PROFILE_ENV_OVERRIDES = {'MTA_WARMUP': '0', 'MTA_HOT_RELOAD': '0'}
+
+
+class LazyPage:
+    """A page module imported, and its dataset loaded, on first use"""
+
+    def __init__(self, module_name):
+        self.module_name = module_name
+        self.import_seconds = None
+        self.warm_seconds = None
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    # imports the module without loading its dataset
+    def load_module(self):
+        if self.import_seconds is None:
+            start = time.perf_counter()
+            importlib.import_module(self.module_name)
+            self.import_seconds = time.perf_counter() - start
+        return sys.modules[self.module_name]
+
+    # imports the module and loads its dataset once per process; concurrent first visits wait for the same load
+    def load(self):
+        if self._module is not None:
+            return self._module
+        with self._lock:
+            if self._module is None:
+                module = self.load_module()
+
+                # warm() loads what the first render needs (or asks the query sidecar for it)
+                start = time.perf_counter()
+                if hasattr(module, 'warm'):
+                    module.warm()
+                elif hasattr(module, 'load_and_transform_data'):
+                    module.load_and_transform_data()
+                self.warm_seconds = time.perf_counter() - start
+                self._module = module
+        return self._module
+
+    def app(self):
+        return self.load().app()
+
+
+_pages = {}
+_pages_lock = threading.Lock()
+
+
+# the process-wide LazyPage of a page module
+def get(module_name):
+    with _pages_lock:
+        if module_name not in _pages:
+            _pages[module_name] = LazyPage(module_name)
+        return _pages[module_name]
+
+
+def profiling_enabled():
+    return os.environ.get(PROFILE_ENV, '') not in ('', '0')
+
+
+# (page, import seconds, warm-up seconds) for every page loaded by this process
+def load_profile(pages):
+    return [(name, page.import_seconds, page.warm_seconds)
+            for children in pages.values() for name, page in children.items()
+            if isinstance(page, LazyPage) and page.loaded]
+
+
+# runs `python -X importtime` for a module in a fresh interpreter and returns
+# (total seconds, [(cumulative seconds, self seconds, module)]) sorted by cumulative time
+def import_times(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            capture_output = True, text = True, check = True, env = {**os.environ, **PROFILE_ENV_OVERRIDES})
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us) / 1e6, int(self_us) / 1e6, name[1:].rstrip()))
+    total = sum(row[0] for row in rows if not row[2].startswith(' '))
+    return total, sorted(rows, reverse = True)
+
+
+def profile(modules, top):
+    for module in modules:
+        total, rows = import_times(module)
+        print(f"{module}: {total:.3f}s")
+        for cumulative, own, name in rows[:top]:
+            print(f"  {cumulative:8.3f}s cumulative {own:8.3f}s self  {name.strip()}")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Report where app start-up time goes')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    profile_parser = subparsers.add_parser('profile', help = 'import cost of the app shell and each page, in fresh interpreters')
+    profile_parser.add_argument('modules', nargs = '*', help = 'modules to profile (default: the app shell and every page)')
+    profile_parser.add_argument('--top', type = int, default = 15, help = 'slowest imports to list per module')
+    args = parser.parse_args(argv)
+
+    if args.command == 'profile':
+        modules = args.modules
+        if not modules:
+            import src.warmup
+            modules = SHELL_MODULES + src.warmup.PAGES
+        profile(modules, args.top)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
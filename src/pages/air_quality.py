@@ -4,6 +4,17 @@ import geopandas as gpd
 import streamlit as st
 import plotly.express as px
 import src.assets
+import src.artifacts
+import src.cache
+import src.charts
+import src.cube
+import src.exports
+import src.geo_features
+import src.query_service
+import src.schemas
+import src.tables
+import src.telemetry
+import src.views
 
 # This Streamlit application allows users to explore and visualize air quality data for New York City
 # Users can filter the data based on air quality indicator and time period
@@ -12,69 +23,196 @@ import src.assets
 # The air quality dataset is sourced from the Environmental and Health Data Portal GitHub - https://github.com/nychealth/EHDP-data/blob/production/neighborhood-reports/data/Outdoor_Air_and_Health_data.csv
 # The GeoJSON file is from after conversion of EHDP GitHub's shapefiles - https://github.com/nychealth/EHDP-data/tree/production/geography/UHF%2042
 
-# loading and transforming data
+GEOJSON_PATH = 'data/UHF_42_DOHMH.geojson'
+AIR_QUALITY_PATH = 'data/Outdoor_Air_and_Health_Data.csv'
+INDICATORS = ['Fine particles (PM 2.5)', 'Nitrogen dioxide (NO2)', 'Ozone (O3)']
+# bump whenever build_dataset changes its output, so stale compiled artifacts are ignored
+SCHEMA_VERSION = 4
+# build_dataset returns one frame per part, compiled as air_quality.values and air_quality.neighborhoods
+ARTIFACT_PARTS = ('values', 'neighborhoods')
+# name of this dataset in the query sidecar
+SERVICE_DATASET = 'air_quality'
+# precomputed analytics shown on hover and in the table
+HOVER_COLUMNS = {'change': 'Change from previous year', 'change_pct': 'Change (%)', 'percentile': 'Citywide percentile'}
+
+# The dataset is stored in two parts:
+# - values: one row per (indicator_name, time, geo_join_id) with the measured data_value
+# - neighborhoods: one row per UHF42 neighborhood, indexed by geo_join_id, holding its polygon once
+# The page reads the values from a dense (indicator, time, neighborhood) cube (src/cube.py), so switching
+# the indicator or year is an array index; polygons are joined only onto the rows that are exported
+
+# loading data, cached process-wide until one of the source files or the compiled artifact changes
+# the compiled artifacts are used when they are up to date, otherwise the raw files are parsed
+@src.cache.cached_dataset(GEOJSON_PATH, AIR_QUALITY_PATH, src.artifacts.MANIFEST_PATH)
 def load_and_transform_data():
-    gdf = gpd.read_file('data/UHF_42_DOHMH.geojson')
-    data_df = pd.read_csv(
-        r'data/Outdoor_Air_and_Health_Data.csv', 
-        engine = 'pyarrow'
+    values = src.artifacts.read_artifact('air_quality.values', SCHEMA_VERSION)
+    neighborhoods = src.artifacts.read_artifact('air_quality.neighborhoods', SCHEMA_VERSION)
+    if values is None or neighborhoods is None:
+        return build_dataset()
+    return values, neighborhoods
+
+# transforming the raw source files, also used by the offline compile step
+def build_dataset():
+    # only the columns the page uses, and only PM 2.5, NO2, and O3 measurements for air quality,
+    # both applied while the CSV is parsed (src/schemas.py); the GeoJSON is parsed at the same time
+    gdf, values = src.schemas.read_concurrently(
+        ('uhf42', {'columns': ['UHFCODE', 'geometry']}),
+        ('air_quality', {
+            'columns': ['indicator_name', 'measure_name', 'display_type', 'time', 'geo_join_id', 'neighborhood', 'data_value'],
+            'filters': [('indicator_name', 'in', INDICATORS)],
+        })
     )
     
-    # only including PM 2.5, NO2, and O3 measurements for air quality
-    data_df = data_df[data_df['indicator_name'].isin(['Fine particles (PM 2.5)', 'Nitrogen dioxide (NO2)', 'Ozone (O3)'])]
-    # joining GeoJSON file and CSV file
-    df = pd.merge(data_df, gdf, how = 'left', right_on = 'UHFCODE', left_on = 'geo_join_id')
-    # converting to GeoDataFrame with only necessary columns
-    geo_df = gpd.GeoDataFrame(df[['indicator_name', 'measure_name', 'display_type', 'time', 'neighborhood', 'data_value', 'geometry']])
+    # neighborhood dimension: the polygon of every UHF code that has measurements, stored once
+    neighborhoods = gdf.drop_duplicates('UHFCODE').rename(columns = {'UHFCODE': 'geo_join_id'}).set_index('geo_join_id')
+    neighborhoods = neighborhoods[neighborhoods.index.isin(values['geo_join_id'])][['geometry']]
     
-    return geo_df
+    return values, neighborhoods
+
+# (indicator, time, neighborhood) cube of the values with changes, trends and ranks, built once per dataset version
+def air_cube():
+    return src.cube.cube(
+        'air_quality',
+        load_and_transform_data.version(),
+        lambda: load_and_transform_data()[0],
+        'indicator_name', 'time', 'geo_join_id', 'data_value',
+        indicator_columns = ['measure_name', 'display_type'],
+        location_columns = ['neighborhood']
+    )
+
+# The dataset is held in-process, or by the query sidecar when MTA_QUERY_SERVICE is set (src/query_service.py);
+# the functions below answer either way, the local_* functions are what the sidecar runs
+def dataset_version():
+    if src.query_service.enabled():
+        return src.query_service.version(SERVICE_DATASET)
+    return load_and_transform_data.version()
+
+# UHF42 polygons serialized once per dataset version and keyed by UHF code
+def uhf42_features():
+    return src.geo_features.feature_store('uhf42', dataset_version(), uhf42_geometries)
+
+def uhf42_geometries():
+    if src.query_service.enabled():
+        return src.query_service.geometries(SERVICE_DATASET)
+    return local_geometries()
+
+def local_geometries():
+    return load_and_transform_data()[1].geometry
+
+# built ahead of time by the hot-reload watcher whenever the dataset changes
+load_and_transform_data.warm_with(uhf42_features, air_cube)
+
+# widget options: indicators, and the time periods measured for each indicator
+def filter_options():
+    if src.query_service.enabled():
+        return src.query_service.options(SERVICE_DATASET)
+    return local_filter_options()
+
+def local_filter_options():
+    cube = air_cube()
+    return {
+        'indicator_name': cube.indicators,
+        'time': {indicator: cube.times_of(indicator) for indicator in cube.indicators},
+    }
+
+# loads the options ahead of the first render, called by the page registry
+def warm():
+    filter_options()
 
 # creating data filters for air quality indicator and time period
-def filter_data(geo_df):
+def filter_data():
+    options = filter_options()
     col1, col2 = st.columns([1.5, 1])
 
     with col2:
         indicator = st.selectbox(
                 "Select Indicator:", 
-                options = geo_df['indicator_name'].unique(),
+                options = options['indicator_name'],
                 key = 'randomkey3'
                 )
-            
-    filtered_geo_df = geo_df[geo_df['indicator_name'] == indicator]
     
     with col1:
         time = st.select_slider(
                 "Select Time Period:",
-                options = filtered_geo_df["time"].unique(),
+                options = options['time'][indicator],
                 key = 'randomkey1'
                 )
     
-    # GeoDataFrame changes based on selected filters         
-    all_data = filtered_geo_df[(filtered_geo_df["time"] == time) & (filtered_geo_df["indicator_name"] == indicator)]
+    all_data, extras = query_rows(indicator, time)
     
-    return all_data, time, indicator
+    return all_data, extras, time, indicator
+
+# rows for one indicator, read from the cube: one row per neighborhood for a time period, or one row per
+# neighborhood with its long-run trend when time is None; extras hold the indicator's fixed color ranges
+def query_rows(indicator, time = None):
+    if src.query_service.enabled():
+        return src.query_service.query(SERVICE_DATASET, indicator = indicator, time = time)
+    return local_query(indicator, time)
+
+def local_query(indicator, time = None):
+    cube = air_cube()
+    i = cube.position(indicator)
+    attributes = cube.attributes(indicator)
+    extras = {
+        'value_range': cube.value_range[i].tolist(),
+        'slope_range': float(cube.slope_range[i]),
+        'display_type': str(attributes['display_type']),
+    }
+    if time is None:
+        trends = cube.trends(indicator)
+        extras['citywide'] = cube.summary(indicator)
+        return pd.DataFrame({'geo_join_id': trends['location'], 'neighborhood': trends['neighborhood'],
+                             'slope': trends['slope']}), extras
+
+    cells = cube.cells(indicator, time)
+    return pd.DataFrame({
+        'indicator_name': indicator,
+        'measure_name': attributes['measure_name'],
+        'display_type': attributes['display_type'],
+        'time': time,
+        'geo_join_id': cells['location'],
+        'neighborhood': cells['neighborhood'],
+        'data_value': cells['value'],
+        'change': cells['change'],
+        'change_pct': cells['change_pct'].round(1),
+        'percentile': cells['percentile'].round(0),
+    }), extras
+
+# joining the neighborhood polygons onto the rows that are exported or shown in the table
+def join_neighborhoods(rows):
+    return gpd.GeoDataFrame(rows.join(uhf42_geometries().rename('geometry'), on = 'geo_join_id'), geometry = 'geometry',
+                            crs = uhf42_geometries().crs)
 
 def app():
     
     st.title("NYC Air Quality")
     
-    geo_df = load_and_transform_data()
-    all_data, map_time, map_indicator = filter_data(geo_df)
+    with src.telemetry.span('load'):
+        warm()
+    with src.telemetry.span('filter'):
+        all_data, extras, map_time, map_indicator = filter_data()
     
-    # creating separate tabs for different visualizations
-    tab1, tab2, tab3 = st.tabs(["Map ", "Chart", "Data"])  
+    # creating separate tabs for different visualizations; only the open one is built
+    view = src.views.view_tabs('air_quality', ["Map", "Chart", "Trend", "Data"],
+                               keep = src.tables.widget_keys('air_quality') + src.exports.widget_keys('air_quality'))
 
-    with tab1:
+    if view == "Map":
         st.write(
             "The map below shows the yearly average value for the selected air quality indicator, based on data from the New York City Community Air Survey (NYCCAS), NYC's comprehensive air quality monitoring and modeling network."
             )
-        air_quality_choromap(all_data)
+        air_quality_choromap(all_data, extras, map_time, map_indicator)
 
-    with tab2:
+    elif view == "Chart":
         st.write('The graph below shows the same data and will filter based on your selected criteria.')
-        air_quality_barchart(all_data)
+        air_quality_barchart(all_data, extras, map_time, map_indicator)
 
-    with tab3:
+    elif view == "Trend":
+        st.write(
+            "The map below shows the long-run trend of the selected indicator in each neighborhood, as the average change per year over all measured years. The chart shows the citywide median with the 10th and 90th percentile neighborhoods."
+            )
+        air_quality_trend(map_indicator)
+
+    else:
         st.write(
         "This table dynamically changes to only display the raw data selected for the map/graph. It includes more in-depth information such as the geometric shape of each neighborhood."
         )
@@ -86,13 +224,22 @@ def app():
              ''')
     src.assets.create_footer()
 
-# plotting choroploeth map
-def air_quality_choromap(all_data):
-    map_fig = px.choropleth_mapbox(
-                geojson = all_data.geometry,
-                locations = all_data.index,
-                color = all_data['data_value'],
-                hover_name = all_data['neighborhood'],
+# plotting choroploeth map, built once per (indicator, time) and dataset version
+def air_quality_choromap(all_data, extras, map_time, map_indicator):
+    src.charts.plotly_chart('air_quality_choromap', (map_indicator, map_time), dataset_version(),
+                            lambda: build_choromap(all_data, extras))
+
+# the color scale is fixed per indicator, so colors compare across years
+def build_choromap(all_data, extras):
+    return px.choropleth_mapbox(
+                all_data.rename(columns = HOVER_COLUMNS),
+                geojson = uhf42_features().collection(all_data['geo_join_id']),
+                locations = 'geo_join_id',
+                featureidkey = 'id',
+                color = 'data_value',
+                hover_name = 'neighborhood',
+                hover_data = {'geo_join_id': False, **{column: True for column in HOVER_COLUMNS.values()}},
+                range_color = extras['value_range'],
                 color_continuous_scale = 'Orrd',
                 mapbox_style = 'carto-positron',
                 zoom = 9.5, 
@@ -101,48 +248,90 @@ def air_quality_choromap(all_data):
             ).update_layout(height = 600, width = 1400, 
                             margin = {"r":0,"t":0,"l":0,"b":0}, 
                             coloraxis_colorbar_title_text = '')
-    st.plotly_chart(map_fig)
 
-# plotting bar chart
-def air_quality_barchart(all_data):
-    bar_fig = px.bar(
+# plotting bar chart, built once per (indicator, time) and dataset version
+def air_quality_barchart(all_data, extras, map_time, map_indicator):
+    src.charts.plotly_chart('air_quality_barchart', (map_indicator, map_time), dataset_version(),
+                            lambda: build_barchart(all_data, extras))
+
+def build_barchart(all_data, extras):
+    return px.bar(
                   x = all_data['neighborhood'],
                   y = all_data['data_value'],
                   template = 'seaborn'
                   ).update_layout(xaxis_tickangle = -45,
                                   xaxis_title = '',
                                   yaxis_title = '',
+                                  yaxis_range = [0, extras['value_range'][1]],
                                   width = 1000,
                                   height = 600)
-    st.plotly_chart(bar_fig)
+
+# plotting the trend map and the citywide chart, built once per indicator and dataset version
+def air_quality_trend(map_indicator):
+    trend, extras = query_rows(map_indicator)
+    src.charts.plotly_chart('air_quality_trend_map', (map_indicator,), dataset_version(),
+                            lambda: build_trend_map(trend, extras))
+    src.charts.plotly_chart('air_quality_trend_chart', (map_indicator,), dataset_version(),
+                            lambda: build_trend_chart(extras))
+
+def build_trend_map(trend, extras):
+    return px.choropleth_mapbox(
+                geojson = uhf42_features().collection(trend['geo_join_id']),
+                locations = trend['geo_join_id'],
+                featureidkey = 'id',
+                color = trend['slope'],
+                hover_name = trend['neighborhood'],
+                range_color = [-extras['slope_range'], extras['slope_range']],
+                color_continuous_scale = 'RdBu_r',
+                mapbox_style = 'carto-positron',
+                zoom = 9.5, 
+                opacity = 0.7,
+                center = {"lat": 40.70, "lon": -73.97}
+            ).update_layout(height = 600, width = 1400, 
+                            margin = {"r":0,"t":0,"l":0,"b":0}, 
+                            coloraxis_colorbar_title_text = f"{extras['display_type']} per year")
+
+def build_trend_chart(extras):
+    citywide = pd.DataFrame(extras['citywide']).rename(columns = {'q10': '10th percentile', 'q50': 'Median', 'q90': '90th percentile'})
+    return px.line(
+                   citywide,
+                   x = 'time',
+                   y = ['10th percentile', 'Median', '90th percentile'],
+                   markers = True,
+                   template = 'seaborn'
+                   ).update_layout(xaxis_title = '',
+                                   yaxis_title = extras['display_type'],
+                                   yaxis_range = extras['value_range'],
+                                   legend_title_text = '',
+                                   width = 1000,
+                                   height = 500)
 
 # generating data table and download button for the filtered dataset
 def air_quality_table(all_data, map_time, map_indicator):
     
-    all_data = all_data.rename(columns = {'indicator_name': 'Indicator', 
+    def table_frame():
+        return join_neighborhoods(all_data).rename(columns = {'indicator_name': 'Indicator', 
                                 'measure_name': 'Measure', 
+                                'display_type': 'Units',
                                 'time': 'Time', 
+                                'geo_join_id': 'UHF Code',
                                 'neighborhood': 'Neighborhood', 
                                 'data_value': 'Value', 
                                 'geometry': 'Geometry',
+                                **HOVER_COLUMNS,
                                 })
     
-    csv = all_data.to_csv().encode('utf-8')
-    st.download_button(
-            label = f"{map_time} {map_indicator} Dataset", 
-            data = csv, 
-            file_name = f"{map_time}_{map_indicator}.csv", 
-            mime = 'text/csv' 
+    # the payload is encoded only when requested, once per filter combination, format and dataset version
+    src.exports.download_button(
+            label = f"{map_time} {map_indicator} Dataset",
+            name = 'air_quality',
+            key = (map_indicator, map_time),
+            version = dataset_version(),
+            build_frame = table_frame,
+            file_name = f"{map_time}_{map_indicator}",
+            formats = src.exports.TABULAR_FORMATS + ('geojson',)
     )
     
-    # styles the data table left-aligned text and inline display
-    all_data['Geometry'] = all_data['Geometry'].astype(str)
-    all_data = all_data.style.set_table_styles([
-    {'selector': 'th', 'props': [('text-align', 'left')]},
-    {'selector': 'td', 'props': [('text-align', 'left')]}
-    ]).set_table_attributes("style='display:inline'")
-
-    st.write(all_data)
-
-            
-    
+    # paged table, polygons shown as area and vertex count with WKT for the selected row
+    src.tables.data_table('air_quality', table_frame(), (map_indicator, map_time), dataset_version(),
+                          geometry_column = 'Geometry')
@@ -1,8 +1,15 @@
 # importing necessary libraries
-import pandas as pd
 import streamlit as st
 import altair as alt
 import src.assets
+import src.artifacts
+import src.cache
+import src.charts
+import src.exports
+import src.partitions
+import src.schemas
+import src.telemetry
+import src.views
 from datetime import datetime
 
 # This Streamlit application allows users to explore and visualize monthly weekday average metrics for Taxi and FHV Trips within the CBD
@@ -11,17 +18,28 @@ from datetime import datetime
 
 #The dataset, which is a CSV file, is sourced internally from a TLC data cleaning and aggregation script in Databricks - https://adb-6027096853111749.9.azuredatabricks.net/?o=6027096853111749#notebook/771935850484747/command/3583169199257004
 
-# loading and transforming data
+MONTHLY_PATH = 'data/monthly.csv'
+# bump whenever build_dataset changes its output, so stale compiled artifacts are ignored
+SCHEMA_VERSION = 2
+
+# loading data, cached process-wide until the source file or the compiled artifact changes
+# the compiled artifact is used when it is up to date, otherwise the raw file is parsed
+@src.cache.cached_dataset(MONTHLY_PATH, src.artifacts.MANIFEST_PATH, src.partitions.MANIFEST_PATH)
 def load_and_transform_data():
-    df = pd.read_csv(
-        r'data/monthly.csv', 
-        engine = 'pyarrow',
-        usecols=['month_year', 'monthly_trips', 'monthly_miles', 'monthly_time', 'service']
+    df = src.artifacts.read_artifact('monthly', SCHEMA_VERSION)
+    if df is None:
+        df = build_dataset()
+    return df
+
+# transforming the raw source file, also used by the offline compile step
+def build_dataset():
+    # month partitions when the data has been partitioned, otherwise the CSV file; 'month year' is parsed
+    # to a datetime (abbrv. month name and last two digits of year) while reading, see src/schemas.py
+    df = src.schemas.read(
+        'monthly',
+        columns = ['month_year', 'monthly_trips', 'monthly_miles', 'monthly_time', 'service']
     )
     
-    # converting 'month year' column to a datetime datatype with abbrv. month name and last two digits of year
-    df['month_year'] = pd.to_datetime(df['month_year'], format='%b-%y')
-    
     return df
 
 # creating data filters for date range and metric
@@ -37,7 +55,8 @@ def data_filters(df):
                                 value=(min_date.date(),
                                         max_date.date()),
                                 min_value=min_date.date(),
-                                format='MMM YYYY')
+                                format='MMM YYYY',
+                                key='monthly_dates')
         
         # retrieving the start and end date range selected by the user
         MIN_PICKED_DATE = date_filter[0]
@@ -54,7 +73,8 @@ def data_filters(df):
     with metric_filter:
         metric_filter = st.selectbox('Select a Metric:', 
                                   options = list(tooltip_dict.keys()), 
-                                  format_func = lambda x: tooltip_dict[x])
+                                  format_func = lambda x: tooltip_dict[x],
+                                  key = 'monthly_metric')
     
     # DataFrame changes based on selected filters        
     all_data = df[
@@ -69,23 +89,31 @@ def app():
     
     st.title("Taxi & Limousine Commission Monthly Averages")
     
-    df = load_and_transform_data()
-    all_data, title_dict, tooltip_dict, metric_filter = data_filters(df)
+    with src.telemetry.span('load'):
+        df = load_and_transform_data()
+    with src.telemetry.span('filter'):
+        all_data, title_dict, tooltip_dict, metric_filter = data_filters(df)
     
     domain = ["HVFHV", "Yellow Taxi", "Green Taxi"]
     range_ = ["Black", "Yellow", "Green"]
 
-    #creating separate tabs for different visualizations
-    tab1, tab2 = st.tabs(['Chart', 'Table'])
+    # identifies the chart and the exports of this filter combination
+    date_range = (all_data['month_year'].min(), all_data['month_year'].max())
+
+    #creating separate tabs for different visualizations; only the open one is built
+    view = src.views.view_tabs('monthly_averages', ['Chart', 'Table'],
+                               keep = src.exports.widget_keys('monthly_chart') + src.exports.widget_keys('monthly_table'))
     
-    with tab1:
+    if view == 'Chart':
         
         st.write(
         "The graph below shows the monthly weekday average metrics of taxi and for-hire-vehicle (FHV) trips that begin and/or end within Manhattan south of 60th Street (the Central Business District), based on self-reported data by the Taxi & Limousine Commission from 2019 to present."
         )
         
         # plotting stacked line chart and creating download button for the graph
-        line_chart = (
+        # the chart is built once per (metric, date range) and dataset version
+        def line_chart():
+            return (
             alt.Chart(all_data, height = 500, title = title_dict[metric_filter])
             .mark_line(point = True, size = 3)
             .encode(
@@ -97,17 +125,20 @@ def app():
             ])
             .configure_legend(orient = "bottom")
             .configure_title(fontSize = 18)
-        )
-        st.altair_chart(line_chart, use_container_width = True)
+            )
+        src.charts.altair_chart('monthly_line_chart', (metric_filter,) + date_range, load_and_transform_data.version(),
+                                line_chart, use_container_width = True)
 
-        st.download_button(
+        src.exports.download_button(
             label = f"Download Monthly CBD Weekday Average {tooltip_dict[metric_filter]}",
-            data=all_data.to_csv(index = False),
-            file_name = "MTA beta, raw data.csv",
-            mime = "text/csv"
+            name = 'monthly_chart',
+            key = (metric_filter,) + date_range,
+            version = load_and_transform_data.version(),
+            build_frame = lambda: all_data,
+            file_name = "MTA beta, raw data"
         )
         
-    with tab2:
+    else:
         
         # generating data table and download button for the filtered dataset
         display_table = all_data[['month_year', 'service', metric_filter]] 
@@ -115,12 +146,13 @@ def app():
         display_table['Month'] = display_table['Month'].dt.strftime('%b-%y')
         display_table[tooltip_dict[metric_filter]] = display_table[tooltip_dict[metric_filter]].apply(lambda x: '{:,}'.format(x))
         
-        csv = display_table.to_csv().encode('utf-8')
-        st.download_button(
-            label = f"Average Hourly {tooltip_dict[metric_filter]} Dataset", 
-            data = csv, 
-            file_name = f"TLCMonthlyAverage{tooltip_dict[metric_filter]}.csv", 
-            mime = 'text/csv' 
+        src.exports.download_button(
+            label = f"Average Hourly {tooltip_dict[metric_filter]} Dataset",
+            name = 'monthly_table',
+            key = (metric_filter,) + date_range,
+            version = load_and_transform_data.version(),
+            build_frame = lambda: display_table,
+            file_name = f"TLCMonthlyAverage{tooltip_dict[metric_filter]}"
         )
         
         st.write(
@@ -135,8 +167,4 @@ def app():
     ''')
     st.write("Complete NYC TLC Taxi and FHV Trip Data and other visualization tools are available on the [TLC Data Hub](https://tlcanalytics.shinyapps.io/Data-hub/).")
     
-src.assets.create_footer()
-
-
-
-
+    src.assets.create_footer()
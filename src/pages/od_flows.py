@@ -0,0 +1,316 @@
+# importing necessary libraries
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+import plotly.express as px
+import plotly.graph_objects as go
+import src.artifacts
+import src.assets
+import src.cache
+import src.charts
+import src.exports
+import src.od_matrix
+import src.partitions
+import src.schemas
+import src.telemetry
+import src.views
+
+# This Streamlit application allows users to explore zone-to-zone trips of Taxi and FHV Trips in NYC
+# Users can filter the data based on time period, industry, direction relative to the CBD, and number of flows
+# The application presents a flow map, an origin-destination matrix, month-over-month changes, and a data table
+
+# The CSV file of zone-to-zone trips is produced from the TLC trip records by src/dataprocessing/aggregate_trips.py
+# The GeoJSON file is the same combination of taxi zones and CBDTP zones the pickups/dropoffs page maps
+
+GEOJSON_PATH = 'data/CBD_Taxi.geojson'
+OD_PATH = 'data/od_flows.csv'
+# bump whenever build_dataset changes its output, so stale compiled artifacts are ignored
+SCHEMA_VERSION = 1
+# build_dataset returns one frame per part, compiled as od_flows.flows and od_flows.zones
+ARTIFACT_PARTS = ('flows', 'zones')
+
+ZONE_COUNT = src.partitions.MAX_LOCATION_ID + 1
+DIRECTIONS = ["All flows", "Into the CBD", "Out of the CBD", "Within the CBD"]
+# zones shown as rows and columns of the matrix view
+MATRIX_ZONES = 30
+# line widths of the flow map, from the smallest to the largest fifth of the shown flows
+FLOW_WIDTHS = [1, 2, 4, 7, 11]
+
+# The data model:
+# - flows: one row per (service, month_year, PULocationID, DOLocationID) with trips, only pairs with trips;
+#   held in memory as one sparse matrix per (month_year, service), see src/od_matrix.py
+# - zones: one row per taxi zone, indexed by LocationID, holding zone, borough, CBD_Zone and the lon/lat of
+#   a point inside the zone that anchors its flow lines
+
+# loading data, cached process-wide until one of the source files or the compiled artifact changes
+# the compiled artifacts are used when they are up to date, otherwise the raw files are parsed
+@src.cache.cached_dataset(GEOJSON_PATH, OD_PATH, src.artifacts.MANIFEST_PATH, src.partitions.MANIFEST_PATH)
+def load_and_transform_data():
+    flows = src.artifacts.read_artifact('od_flows.flows', SCHEMA_VERSION)
+    zones = src.artifacts.read_artifact('od_flows.zones', SCHEMA_VERSION)
+    if flows is None or zones is None:
+        return build_dataset()
+    return flows, zones
+
+# transforming the raw source files into the flow and zone tables, also used by the offline compile step
+def build_dataset():
+    gdf, flows = src.schemas.read_concurrently(
+        ('taxi_zones', {'columns': ['LocationID', 'zone', 'borough', 'CBD_Zone', 'geometry']}),
+        ('od_flows', {'columns': ['service', 'month_year', 'PULocationID', 'DOLocationID', 'trips']})
+    )
+
+    zones = gdf.drop_duplicates(subset = 'LocationID', keep = 'first').set_index('LocationID')
+    anchors = zones.geometry.representative_point()
+    zones = pd.DataFrame(zones[['zone', 'borough', 'CBD_Zone']]).assign(
+        lon = anchors.x.astype('float32'),
+        lat = anchors.y.astype('float32')
+    )
+
+    # flows from or to zones missing from the GeoJSON are dropped, like on the pickups/dropoffs page
+    known = np.zeros(ZONE_COUNT, dtype = bool)
+    known[zones.index[zones.index < ZONE_COUNT]] = True
+    flows = flows[known[flows['PULocationID'].to_numpy()] & known[flows['DOLocationID'].to_numpy()]].reset_index(drop = True)
+    return flows, zones
+
+# the zone-to-zone data is optional; it exists once aggregate_trips has produced it
+def available():
+    return (os.path.exists(OD_PATH) or src.partitions.covers(OD_PATH)
+            or src.artifacts.read_artifact('od_flows.zones', SCHEMA_VERSION) is not None)
+
+def dataset_version():
+    return load_and_transform_data.version()
+
+# sparse matrices per (month_year, service), built once per dataset version
+def flow_matrices():
+    return src.od_matrix.flow_matrices(
+        'od_flows',
+        dataset_version(),
+        lambda: load_and_transform_data()[0],
+        keys = ['month_year', 'service'],
+        origin = 'PULocationID',
+        destination = 'DOLocationID',
+        value = 'trips',
+        size = ZONE_COUNT
+    )
+
+# True for the LocationIDs of CBD zones
+def cbd_mask():
+    zones = load_and_transform_data()[1]
+    mask = np.zeros(ZONE_COUNT, dtype = bool)
+    mask[zones.index[zones['CBD_Zone'] == 'CBD'].to_numpy()] = True
+    return mask
+
+# trips within, into and out of the CBD for every (month_year, service), computed once per dataset version
+def cbd_totals():
+    return src.cache.derived_value('flows:od_flows:cbd', dataset_version(), lambda: flow_matrices().region_totals(cbd_mask()))
+
+# origin and destination masks of a direction relative to the CBD
+def direction_masks(direction):
+    cbd = cbd_mask()
+    return {
+        "All flows": (None, None),
+        "Into the CBD": (~cbd, cbd),
+        "Out of the CBD": (cbd, ~cbd),
+        "Within the CBD": (cbd, cbd),
+    }[direction]
+
+# loads the matrices ahead of the first render, called by the page registry
+def warm():
+    if available():
+        cbd_totals()
+
+# creating data filters for time period, industry, direction, and number of flows
+def filter_data():
+    keys = flow_matrices().keys
+    months = list(dict.fromkeys(month for month, service in keys))
+    services = sorted({service for month, service in keys})
+    col1, col2 = st.columns([1.5, 1])
+
+    with col1:
+        month = st.select_slider("Select Time Period:", options = months, value = months[-1], key = 'od_month')
+    with col2:
+        service = st.selectbox("Select an Industry:", options = services, key = 'od_service')
+
+    col3, col4 = st.columns([1.5, 1])
+
+    with col3:
+        direction = st.radio("Select Flows:", DIRECTIONS, horizontal = True, key = 'od_direction')
+    with col4:
+        k = st.slider("Number of Flows:", min_value = 10, max_value = 200, value = 50, step = 10, key = 'od_top')
+
+    previous = months[months.index(month) - 1] if months.index(month) > 0 else None
+    return month, previous, service, direction, k
+
+# the k largest flows of the selection with zone names
+def top_flows(month, service, direction, k):
+    origins, destinations = direction_masks(direction)
+    flows = flow_matrices()
+    if (month, service) not in flows:
+        return flows_frame([], [], [])
+    return flows_frame(*flows.top((month, service), k, origins, destinations))
+
+def flows_frame(origins, destinations, trips, value = 'Trips'):
+    zones = load_and_transform_data()[1]
+    origins, destinations = np.asarray(origins, dtype = int), np.asarray(destinations, dtype = int)
+    return pd.DataFrame({
+        'Origin ID': origins,
+        'Origin': zones['zone'].reindex(origins).to_numpy(),
+        'Destination ID': destinations,
+        'Destination': zones['zone'].reindex(destinations).to_numpy(),
+        value: np.asarray(trips, dtype = np.int64),
+    })
+
+def cbd_metrics(month, previous, service):
+    totals = cbd_totals()
+    current = totals.loc[(month, service)] if (month, service) in totals.index else None
+    before = totals.loc[(previous, service)] if (previous, service) in totals.index else None
+    columns = st.columns(4)
+    for column, (field, label) in zip(columns, [('into', "Into the CBD"), ('out_of', "Out of the CBD"),
+                                                 ('within', "Within the CBD"), ('total', "All trips")]):
+        value = None if current is None else int(current[field])
+        delta = None if value is None or before is None else f"{value - int(before[field]):+,} vs {previous}"
+        column.metric(label, "-" if value is None else f"{value:,}", delta)
+
+def app():
+
+    st.title("Taxi & Limousine Commission Zone-to-Zone Flows")
+
+    if not available():
+        st.info("Zone-to-zone trip counts are not available yet. They are produced from the TLC trip records by `python -m src.dataprocessing.aggregate_trips`.")
+        src.assets.create_footer()
+        return
+
+    with src.telemetry.span('load'):
+        warm()
+    with src.telemetry.span('filter'):
+        month, previous, service, direction, k = filter_data()
+        flows = top_flows(month, service, direction, k)
+    filters = (month, service, direction, k)
+
+    cbd_metrics(month, previous, service)
+
+    # creating separate tabs for different visualizations; only the open one is built
+    view = src.views.view_tabs('od_flows', ["Flow map", "Matrix", "Change", "Data"],
+                               keep = src.exports.widget_keys('od_flows'))
+
+    if view == "Flow map":
+        st.write("The map below shows the largest weekday zone-to-zone flows of the selected month and industry; thicker lines carry more trips.")
+        src.charts.plotly_chart('od_flow_map', filters, dataset_version(), lambda: build_flow_map(flows))
+
+    elif view == "Matrix":
+        st.write(f"Trips between the {MATRIX_ZONES} zones with the most trips among the flows shown, origins in rows and destinations in columns.")
+        src.charts.plotly_chart('od_matrix', filters, dataset_version(), lambda: build_matrix(flows, month, service))
+
+    elif view == "Change":
+        od_change(month, previous, service, direction, k)
+
+    else:
+        st.write("This table dynamically changes to only display the flows selected for the map/matrix.")
+        src.exports.download_button(
+                label = f"{service} Zone-to-Zone Flows, {month}",
+                name = 'od_flows',
+                key = filters,
+                version = dataset_version(),
+                build_frame = lambda: flows,
+                file_name = f"TLCZoneFlows{month}"
+        )
+        with src.telemetry.span('table'):
+            st.dataframe(flows, use_container_width = True)
+
+    st.write('''
+    Trips are counted on weekdays, by the month of their pickup. This data does not include trips made by taxis and FHVs not licensed by the NYC TLC.
+    ''')
+    src.assets.create_footer()
+
+# plotting the flows as lines between zone anchors, one trace per line width
+def build_flow_map(flows):
+    zones = load_and_transform_data()[1]
+    fig = go.Figure()
+    if not flows.empty:
+        origin = zones.loc[flows['Origin ID'], ['lon', 'lat']].to_numpy()
+        destination = zones.loc[flows['Destination ID'], ['lon', 'lat']].to_numpy()
+        width_class = np.minimum((pd.Series(flows['Trips']).rank(pct = True, method = 'first') * len(FLOW_WIDTHS)).astype(int), len(FLOW_WIDTHS) - 1)
+        for i, width in enumerate(FLOW_WIDTHS):
+            shown = np.flatnonzero(width_class.to_numpy() == i)
+            if not len(shown):
+                continue
+            # one line per flow, separated by None so the trace draws them unconnected
+            lon = np.column_stack([origin[shown, 0], destination[shown, 0], np.full(len(shown), np.nan)]).ravel()
+            lat = np.column_stack([origin[shown, 1], destination[shown, 1], np.full(len(shown), np.nan)]).ravel()
+            fig.add_trace(go.Scattermapbox(lon = lon, lat = lat, mode = 'lines', line = {'width': width, 'color': '#0039A6'},
+                                           opacity = 0.6, hoverinfo = 'skip', showlegend = False))
+        # hover labels at the middle of each line
+        fig.add_trace(go.Scattermapbox(
+            lon = (origin[:, 0] + destination[:, 0]) / 2,
+            lat = (origin[:, 1] + destination[:, 1]) / 2,
+            mode = 'markers',
+            marker = {'size': 6, 'color': '#FF6319'},
+            text = [f"{o} → {d}<br>{t:,} trips" for o, d, t in zip(flows['Origin'], flows['Destination'], flows['Trips'])],
+            hoverinfo = 'text',
+            showlegend = False
+        ))
+    fig.update_layout(
+        mapbox = {'style': 'carto-positron', 'zoom': 10, 'center': {'lat': 40.7128, 'lon': -73.9560}},
+        margin = {'r': 0, 't': 0, 'l': 0, 'b': 0},
+        height = 600
+    )
+    return fig
+
+# plotting the trips between the busiest zones of the selection as a heatmap
+def build_matrix(flows, month, service):
+    zones = load_and_transform_data()[1]
+    volume = pd.concat([flows.groupby('Origin ID')['Trips'].sum(), flows.groupby('Destination ID')['Trips'].sum()])
+    busiest = volume.groupby(level = 0).sum().nlargest(MATRIX_ZONES).index.sort_values()
+    names = zones['zone'].reindex(busiest).astype(str).to_numpy()
+    matrix = flow_matrices().dense((month, service), busiest.to_numpy()) if len(busiest) else np.zeros((0, 0))
+    fig = go.Figure(go.Heatmap(
+        z = matrix,
+        x = names,
+        y = names,
+        colorscale = 'Blues',
+        hovertemplate = '%{y} → %{x}<br>%{z:,} trips<extra></extra>'
+    ))
+    fig.update_layout(
+        xaxis = {'title': 'Destination', 'tickangle': -45},
+        yaxis = {'title': 'Origin', 'autorange': 'reversed'},
+        margin = {'r': 0, 't': 20, 'l': 0, 'b': 0},
+        height = 700
+    )
+    return fig
+
+# largest increases and decreases against the previous month, and the CBD totals over time
+def od_change(month, previous, service, direction, k):
+    if previous is None:
+        st.write("There is no earlier month to compare with.")
+    else:
+        flows = flow_matrices()
+        origins, destinations = direction_masks(direction)
+        key, other = (month, service), (previous, service)
+        if key in flows and other in flows:
+            increases, decreases = flows.change(key, other, k, origins, destinations)
+            st.write(f"The zone-to-zone flows that changed the most from {previous} to {month}.")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.caption("Largest increases")
+                st.dataframe(flows_frame(*increases, value = 'Change'), use_container_width = True)
+            with col2:
+                st.caption("Largest decreases")
+                st.dataframe(flows_frame(*decreases, value = 'Change'), use_container_width = True)
+
+    st.write(f"Weekday trips within, into and out of the CBD by month, {service}.")
+    src.charts.plotly_chart('od_cbd_totals', (service,), dataset_version(), lambda: build_cbd_totals(service))
+
+def build_cbd_totals(service):
+    totals = cbd_totals().xs(service, level = 'service')
+    totals = totals.rename(columns = {'within': 'Within the CBD', 'into': 'Into the CBD', 'out_of': 'Out of the CBD'})
+    fig = px.line(
+        totals.reset_index(),
+        x = 'month_year',
+        y = ['Into the CBD', 'Out of the CBD', 'Within the CBD'],
+        markers = True,
+        labels = {'month_year': '', 'value': 'Trips', 'variable': ''}
+    )
+    fig.update_layout(legend = {'orientation': 'h', 'y': -0.2}, margin = {'r': 0, 't': 20, 'l': 0, 'b': 0})
+    return fig
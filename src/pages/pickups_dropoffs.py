@@ -1,9 +1,23 @@
 # importing necessary libraries
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 import streamlit as st
 import plotly.express as px
+import plotly.graph_objects as go
 import src.assets
+import src.artifacts
+import src.cache
+import src.charts
+import src.exports
+import src.geo_features
+import src.partition_index
+import src.partitions
+import src.query_service
+import src.schemas
+import src.tables
+import src.telemetry
+import src.views
 
 # This Streamlit application allows users to explore and visualize pickup and dropoff metrics for Taxi and FHV Trips in NYC
 # Users can filter the data based on time period, CBDTP zones, industry, and metric
@@ -12,57 +26,145 @@ import src.assets
 # The CSV files for pickup and dropoff data is sourced internally from a TLC data cleaning and aggregation script in Databricks - https://adb-6027096853111749.9.azuredatabricks.net/?o=6027096853111749#notebook/771935850484747/command/3583169199257004
 # The GeoJSON file is my combination of taxi zones and CBDTP zones, which is currently stored in CBDTP's blob container in Azure - storageexplorer://?v=2&tenantId=79c07380-cc98-41bd-806b-0ae925588f66&type=fileSystemPath&path=CBD_Taxi.geojson&container=cbdtp-data&serviceEndpoint=https%3A%2F%2Funifieddatadl02azemtd.dfs.core.windows.net
 
-# loading and transforming data
+GEOJSON_PATH = 'data/CBD_Taxi.geojson'
+PICKUP_PATH = 'data/map_pickup.csv'
+DROPOFF_PATH = 'data/map_dropoff.csv'
+# bump whenever build_dataset changes its output, so stale compiled artifacts are ignored
+SCHEMA_VERSION = 5
+# build_dataset returns one frame per part, compiled as pickups_dropoffs.facts and pickups_dropoffs.zones
+ARTIFACT_PARTS = ('facts', 'zones')
+# name of this dataset in the query sidecar
+SERVICE_DATASET = 'pickups_dropoffs'
+
+ZONE_COLUMNS = ['zone', 'borough', 'CBD_Zone', 'geometry']
+# rows per block of the all-months export
+EXPORT_CHUNK_ROWS = 50_000
+MAP_MODES = ["Single month", "Animated"]
+
+# The data model is a star schema:
+# - facts: one row per (service, month_year, LocationID) with the pickup/dropoff metrics; service and
+#   month_year are categoricals, so the table holds only small integer codes and int32 location keys
+# - zones: one row per taxi zone, indexed by LocationID, holding zone, borough, CBD_Zone and geometry
+# Zone attributes and polygons are joined lazily, only onto the rows that are rendered
+
+# loading data, cached process-wide until one of the source files or the compiled artifact changes
+# the compiled artifacts are used when they are up to date, otherwise the raw files are parsed
+@src.cache.cached_dataset(GEOJSON_PATH, PICKUP_PATH, DROPOFF_PATH, src.artifacts.MANIFEST_PATH, src.partitions.MANIFEST_PATH)
 def load_and_transform_data():
-    gdf = gpd.read_file('data/CBD_Taxi.geojson')
-    pickup_df = pd.read_csv(
-        r'data/map_pickup.csv', 
-        engine = 'pyarrow',
-        usecols = ['service', 'month_year', 'PULocationID', 'PU_Monthly_Total', 'PU_Daily_Average']
-    )
-    dropoff_df = pd.read_csv(
-        r'data/map_dropoff.csv', 
-        engine = 'pyarrow',
-        usecols = ['service', 'month_year', 'DOLocationID', 'DO_Monthly_Total', 'DO_Daily_Average']
+    facts = src.artifacts.read_artifact('pickups_dropoffs.facts', SCHEMA_VERSION)
+    zones = src.artifacts.read_artifact('pickups_dropoffs.zones', SCHEMA_VERSION)
+    if facts is None or zones is None:
+        return build_dataset()
+    return facts, zones
+
+# transforming the raw source files into the fact and zone tables, also used by the offline compile step
+def build_dataset():
+    # month partitions when the data has been partitioned, otherwise the CSV files; either way service
+    # and month_year arrive as categoricals and the counts as int32 (src/schemas.py). The three files are
+    # read at the same time
+    gdf, pickup_df, dropoff_df = src.schemas.read_concurrently(
+        ('taxi_zones', {'columns': ['LocationID'] + ZONE_COLUMNS}),
+        ('map_pickup', {'columns': ['service', 'month_year', 'PULocationID', 'PU_Monthly_Total', 'PU_Daily_Average']}),
+        ('map_dropoff', {'columns': ['service', 'month_year', 'DOLocationID', 'DO_Monthly_Total', 'DO_Daily_Average']})
     )
     
-    # joining pickup and dropoff datasets and then merging with GeoJSON file
-    merged_df = pd.merge(dropoff_df, 
-                         pickup_df[['month_year', 'PULocationID', 'PU_Monthly_Total', 'PU_Daily_Average']], 
-                         how = 'left', 
-                         left_on = ['DOLocationID', 'month_year'], 
-                         right_on = ['PULocationID', 'month_year'])
-    df = pd.merge(merged_df, 
-                  gdf, 
-                  how = 'left', 
-                  left_on = 'DOLocationID', 
-                  right_on = 'LocationID')
-
-    df = df.drop(columns = ['PULocationID', 'DOLocationID', 'LocationID'])
-    df = df.drop_duplicates(subset = ['month_year', 'service', 'geometry'], keep = 'first')
-    df = df.dropna()
-    df = df.rename(columns = {
+    # zone dimension: one row per LocationID, keeping the first polygon if the GeoJSON repeats a zone
+    zones = gdf.drop_duplicates(subset = 'LocationID', keep = 'first')
+    zones = zones.set_index('LocationID')[ZONE_COLUMNS]
+
+    # fact table: joining pickup and dropoff datasets on service, month and zone; a zone with only pickups
+    # or only dropoffs in a month has zero on the other side, zones missing from the GeoJSON are dropped.
+    # Both sides share one set of categories, so the join runs on the integer codes
+    pickup_df = pickup_df.rename(columns = {'PULocationID': 'LocationID'})
+    dropoff_df = dropoff_df.rename(columns = {'DOLocationID': 'LocationID'})
+    pickup_df, dropoff_df = src.schemas.align_categories('map_pickup', pickup_df, dropoff_df)
+    facts = pd.merge(dropoff_df, 
+                     pickup_df, 
+                     how = 'outer', 
+                     on = ['service', 'month_year', 'LocationID'])
+    counts = ['DO_Monthly_Total', 'DO_Daily_Average', 'PU_Monthly_Total', 'PU_Daily_Average']
+    facts[counts] = facts[counts].fillna(0).astype('int32')
+    facts = facts[facts['LocationID'].isin(zones.index)]
+    facts = facts.rename(columns = {
         'PU_Daily_Average': 'Daily Average Pickups',
         'PU_Monthly_Total': 'Monthly Total Pickups',
         'DO_Daily_Average': 'Daily Average Dropoffs',
         'DO_Monthly_Total': 'Monthly Total Dropoffs'
     })
     
-    # converting these columns to categorical data type for memory efficiency
-    df["month_year"] = df["month_year"].astype("category")
-    df["CBD_Zone"] = df["CBD_Zone"].astype("category")
-    df["service"] = df["service"].astype("category")
+    # only months and services that survived the join are kept as categories
+    facts["month_year"] = facts["month_year"].cat.remove_unused_categories()
+    facts["service"] = facts["service"].cat.remove_unused_categories()
+    metric_columns = ['Monthly Total Dropoffs', 'Daily Average Dropoffs', 'Monthly Total Pickups', 'Daily Average Pickups']
+    facts = facts[['service', 'month_year', 'LocationID'] + metric_columns].reset_index(drop = True)
+
+    return facts, zones
+
+# joining zone attributes and polygons onto the fact rows that are actually rendered
+def join_zones(rows, zones):
+    return gpd.GeoDataFrame(rows.join(zones, on = 'LocationID'), geometry = 'geometry', crs = zones.crs)
+
+# The dataset is held in-process, or by the query sidecar when MTA_QUERY_SERVICE is set (src/query_service.py);
+# the functions below answer either way, the local_* functions are what the sidecar runs
+def dataset_version():
+    if src.query_service.enabled():
+        return src.query_service.version(SERVICE_DATASET)
+    return load_and_transform_data.version()
+
+# taxi zone polygons serialized once per dataset version and keyed by LocationID
+def zone_features():
+    return src.geo_features.feature_store('taxi_zones', dataset_version(), zone_geometries)
 
-    return gpd.GeoDataFrame(df) 
+def zone_geometries():
+    if src.query_service.enabled():
+        return src.query_service.geometries(SERVICE_DATASET)
+    return local_geometries()
+
+def local_geometries():
+    return load_and_transform_data()[1].geometry
+
+# (month_year, service) partitions of the fact table, built once per dataset version
+# sorted, so months follow calendar (category) order
+def filter_index():
+    return src.partition_index.partition_index(
+        'pickups_dropoffs',
+        load_and_transform_data.version(),
+        lambda: load_and_transform_data()[0],
+        ['month_year', 'service'],
+        sort = True
+    )
+
+# built ahead of time by the hot-reload watcher whenever the dataset changes
+load_and_transform_data.warm_with(zone_features, filter_index)
+
+# widget options: months in calendar order, services, and CBD zone values
+def filter_options():
+    if src.query_service.enabled():
+        return src.query_service.options(SERVICE_DATASET)
+    return local_filter_options()
+
+def local_filter_options():
+    index = filter_index()
+    zones = load_and_transform_data()[1]
+    return {
+        'month_year': [str(month_year) for month_year in index.options('month_year')],
+        'service': [str(service) for service in index.options('service')],
+        'CBD_Zone': [str(zone) for zone in zones["CBD_Zone"].unique()],
+    }
+
+# loads the options ahead of the first render, called by the page registry
+def warm():
+    filter_options()
 
 # creating data filters for time period, CBDTP zones, industry, and metric
-def filter_data(geo_df):
+def filter_data():
+    options = filter_options()
     col1, col2 = st.columns([1.5, 1])
         
     with col1:
         time = st.select_slider(
             "Select Time Period:",
-            options = geo_df["month_year"].unique(),
+            options = options['month_year'],
             key = 'randomkey1'
             )
 
@@ -70,7 +172,7 @@ def filter_data(geo_df):
         zone = st.multiselect(
             "Select Zone(s):",
             default = 'CBD', 
-            options = geo_df["CBD_Zone"].unique(),
+            options = options['CBD_Zone'],
             key = 'randomkey2'
             )
             
@@ -79,7 +181,7 @@ def filter_data(geo_df):
     with col3:
         service = st.selectbox(
             "Select an Industry:",
-            options = geo_df['service'].unique(),
+            options = options['service'],
             key = 'randomkey3'
         )
             
@@ -103,43 +205,100 @@ def filter_data(geo_df):
                 key = 'randomkey5'
             )
 
-    # GeoDataFrame changes based on selected filters 
-    all_data = geo_df[(geo_df["CBD_Zone"].isin(zone)) &
-                 (geo_df["month_year"] == time) &
-                 (geo_df["service"] == service)][['service', 'month_year', time_metric, 'zone', 'borough', 'CBD_Zone', 'geometry']]
+    all_data, gray_data = query_rows(time, zone, service, time_metric)
+    
+    return all_data, gray_data, time, zone, service, time_metric
+
+# selected rows with zone attributes and polygons, and the LocationIDs of the unselected zones
+def query_rows(time, zone, service, time_metric):
+    if src.query_service.enabled():
+        all_data, extras = src.query_service.query(SERVICE_DATASET, time = time, zone = list(zone), service = service, time_metric = time_metric)
+        return all_data, pd.Series(extras['gray'], name = 'LocationID', dtype = 'int32')
+    return select_rows(load_and_transform_data(), time, zone, service, time_metric)
+
+# with time None, every month of the service instead (see select_months)
+def local_query(time, zone, service, time_metric):
+    if time is None:
+        all_data, gray_data = select_months(load_and_transform_data(), zone, service, time_metric)
+    else:
+        all_data, gray_data = select_rows(load_and_transform_data(), time, zone, service, time_metric)
+    return all_data, {'gray': gray_data.tolist()}
+
+def select_rows(dataset, time, zone, service, time_metric):
+    facts, zones = dataset
+    # GeoDataFrame changes based on selected filters: the (month, service) slice comes from the partition index,
+    # then a small zone mask over that slice and a join of zone attributes onto the selected rows only
+    rows = filter_index().take(facts, time, service)
+    in_zone = rows["LocationID"].isin(zones.index[zones["CBD_Zone"].isin(zone)])
+    all_data = join_zones(rows[in_zone], zones)[['service', 'month_year', time_metric, 'LocationID', 'zone', 'borough', 'CBD_Zone', 'geometry']]
    
-    # This GeoDataFrame is for the gray layer of the choropleth map, which changes based on the zones not selected
-    gray_data = geo_df[(~geo_df["CBD_Zone"].isin(zone)) &
-                  (geo_df["month_year"] == time) &
-                  (geo_df["service"] == service)]['geometry']
+    # These LocationIDs are for the gray layer of the choropleth map, which changes based on the zones not selected
+    gray_data = rows.loc[~in_zone, 'LocationID']
     
-    return all_data, gray_data, time, service, time_metric
+    return all_data, gray_data
+
+# every month of one service and metric for the animated map: one row per selected zone with its name and
+# one column per month in calendar order, and the LocationIDs of the unselected zones
+def month_rows(zone, service, time_metric):
+    if src.query_service.enabled():
+        all_data, extras = src.query_service.query(SERVICE_DATASET, time = None, zone = list(zone), service = service, time_metric = time_metric)
+        return all_data, pd.Series(extras['gray'], name = 'LocationID', dtype = 'int32')
+    return select_months(load_and_transform_data(), zone, service, time_metric)
+
+def select_months(dataset, zone, service, time_metric):
+    facts, zones = dataset
+    index = filter_index()
+    months = index.options('month_year', service = service)
+    rows = facts.iloc[np.concatenate([index.positions(month_year, service) for month_year in months])]
+    in_zone = rows["LocationID"].isin(zones.index[zones["CBD_Zone"].isin(zone)])
+
+    selected = rows[in_zone]
+    all_data = pd.DataFrame(
+        selected[time_metric].to_numpy(),
+        index = pd.MultiIndex.from_arrays([selected['LocationID'].to_numpy(), selected['month_year'].astype(str).to_numpy()])
+    )[0].unstack().reindex(columns = [str(month_year) for month_year in months])
+    all_data.index.name = 'LocationID'
+    all_data.columns.name = None
+    all_data.insert(0, 'zone', zones.loc[all_data.index, 'zone'].to_numpy())
+    gray_data = pd.Series(rows.loc[~in_zone, 'LocationID'].unique(), name = 'LocationID')
+
+    return all_data.reset_index(), gray_data
     
 def app():
     
     st.title("Taxi & Limousine Commission Monthly Pickups and Dropoffs")
     
-    geo_df = load_and_transform_data()
-    all_data, gray_data, time, service, time_metric = filter_data(geo_df)
+    with src.telemetry.span('load'):
+        warm()
+    with src.telemetry.span('filter'):
+        all_data, gray_data, time, zone, service, time_metric = filter_data()
+    # identifies the rendered figures in the figure cache
+    filters = (time, zone, service, time_metric)
     
-    # creating separate tabs for different visualizations
-    tab1, tab2, tab3 = st.tabs(["Map ", "Chart", "Data"])  
+    # creating separate tabs for different visualizations; only the open one is built
+    view = src.views.view_tabs('pickups_dropoffs', ["Map", "Chart", "Data"],
+                               keep = ['map_mode'] + src.tables.widget_keys('tlc') + src.exports.widget_keys('tlc'))
 
-    with tab1:
+    if view == "Map":
         st.write(
             "The map below shows the monthly total or daily average number of pickups/dropoffs for taxi and for-hire-vehicle (FHV) trips in selected CBDTP zone(s), based on self-reported data by the Taxi & Limousine Commission from 2019 to present."
             )
-        tlc_choromap(all_data, gray_data, time_metric)
+        map_mode = st.radio("Map mode:", MAP_MODES, horizontal = True, key = 'map_mode')
+        if map_mode == "Animated":
+            st.caption("Play or drag the slider below the map to step through the months; this happens in the browser, without reloading the page.")
+            tlc_animated_choromap(zone, service, time_metric)
+        else:
+            tlc_choromap(all_data, gray_data, time_metric, filters)
 
-    with tab2:
+    elif view == "Chart":
         st.write('The graph below shows the same data and will filter based on your selected criteria.')
-        tlc_barchart(all_data, time_metric)
+        tlc_barchart(all_data, time_metric, filters)
         
-    with tab3:
+    else:
         st.write(
         "This table dynamically changes to only display the raw data selected for the map/graph. It includes more in-depth information such as the geometric shape of each taxi zone."
         )
-        tlc_table(all_data, time, service, time_metric)
+        tlc_table(all_data, time, zone, service, time_metric)
         
     st.write('''
     This data does not include trips made by taxis and FHVs not licensed by the NYC TLC. Other for-hire-vehicle (e.g., black cars) trips are not shown because the NYC TLC does not collect trip start and end locations for those vehicles. Other for-hire-vehicle trips make up approximately X percent of monthly trips that NYC TLC records.\n
@@ -149,24 +308,33 @@ def app():
     st.write("Complete NYC TLC Taxi and FHV Trip Data and other visualization tools are available on the [TLC Data Hub](https://tlcanalytics.shinyapps.io/Data-hub/).")
     src.assets.create_footer()
 
-# plotting choropleth map
-def tlc_choromap(all_data, gray_data, time_metric):
+# plotting choropleth map, built once per filter combination and dataset version
+def tlc_choromap(all_data, gray_data, time_metric, filters):
+    src.charts.plotly_chart('tlc_choromap', filters, dataset_version(),
+                            lambda: build_tlc_choromap(all_data, gray_data, time_metric))
+
+def build_tlc_choromap(all_data, gray_data, time_metric):
 
     fig = choromap(all_data, time_metric)
-    
+    # every zone selected: no unselected layer
+    if len(gray_data) == 0:
+        return fig
+
     unselected_layer = px.choropleth_mapbox(
-                            geojson = gray_data.geometry,
-                            locations = gray_data.index,
+                            geojson = zone_features().collection(gray_data),
+                            locations = gray_data,
+                            featureidkey = 'id',
                             color_discrete_sequence = ['gray'],
                             opacity = 0.8
                             )
     fig.add_trace(unselected_layer.data[0])
-    st.plotly_chart(fig)
+    return fig
 
 def choromap(all_data, time_metric):
     return px.choropleth_mapbox(
-                geojson = all_data.geometry,
-                locations = all_data.index,
+                geojson = zone_features().collection(all_data['LocationID']),
+                locations = all_data['LocationID'],
+                featureidkey = 'id',
                 color = all_data[time_metric],
                 hover_name = all_data['zone'],
                 color_continuous_scale = 'Orrd',
@@ -178,9 +346,78 @@ def choromap(all_data, time_metric):
                             margin = {"r":0,"t":0,"l":0,"b":0}, 
                             coloraxis_colorbar_title_text = '')
 
-# plotting bar chart
-def tlc_barchart(all_data, time_metric):
-    bar_fig = px.bar(
+# plotting the animated map, built once per (zones, service, metric) and dataset version
+def tlc_animated_choromap(zone, service, time_metric):
+    src.charts.plotly_chart('tlc_animated_choromap', (zone, service, time_metric), dataset_version(),
+                            lambda: build_tlc_animated_choromap(*month_rows(zone, service, time_metric)))
+
+# The polygons are sent once, in the first trace; each animation frame holds only that trace's color array,
+# so scrubbing through the months restyles the map in the browser. The color scale is fixed across months
+def build_tlc_animated_choromap(all_data, gray_data):
+    months = [column for column in all_data.columns if column not in ('LocationID', 'zone')]
+    values = all_data[months].to_numpy(dtype = float)
+    fig = go.Figure(go.Choroplethmapbox(
+                geojson = zone_features().collection(all_data['LocationID']),
+                locations = all_data['LocationID'],
+                featureidkey = 'id',
+                z = color_array(values[:, 0]),
+                zmin = np.nanmin(values) if values.size else 0,
+                zmax = np.nanmax(values) if values.size else 1,
+                colorscale = 'Orrd',
+                marker_opacity = 0.7,
+                marker_line_width = 0.5,
+                text = all_data['zone'],
+                hovertemplate = '%{text}<br>%{z:,}<extra></extra>',
+                colorbar_title_text = ''
+            ))
+    fig.add_trace(go.Choroplethmapbox(
+                geojson = zone_features().collection(gray_data),
+                locations = gray_data,
+                featureidkey = 'id',
+                z = np.zeros(len(gray_data)),
+                colorscale = [[0, 'gray'], [1, 'gray']],
+                showscale = False,
+                marker_opacity = 0.8,
+                hoverinfo = 'skip'
+            ))
+    fig.frames = [go.Frame(name = month, data = [go.Choroplethmapbox(z = color_array(values[:, i]))], traces = [0])
+                  for i, month in enumerate(months)]
+
+    step = {'frame': {'duration': 0, 'redraw': True}, 'mode': 'immediate', 'transition': {'duration': 0}}
+    return fig.update_layout(
+                height = 650, width = 1400,
+                margin = {"r":0,"t":0,"l":0,"b":0},
+                mapbox = {'style': 'carto-positron', 'zoom': 9.5, 'center': {"lat": 40.70, "lon": -73.97}},
+                sliders = [{
+                    'active': 0,
+                    'currentvalue': {'prefix': 'Month: '},
+                    'pad': {'t': 10},
+                    'steps': [{'label': month, 'method': 'animate', 'args': [[month], step]} for month in months],
+                }],
+                updatemenus = [{
+                    'type': 'buttons',
+                    'direction': 'left',
+                    'x': 0, 'y': 0, 'xanchor': 'right', 'yanchor': 'top',
+                    'pad': {'t': 10, 'r': 10},
+                    'buttons': [
+                        {'label': 'Play', 'method': 'animate',
+                         'args': [None, {**step, 'frame': {'duration': 500, 'redraw': True}, 'fromcurrent': True}]},
+                        {'label': 'Pause', 'method': 'animate', 'args': [[None], step]},
+                    ],
+                }]
+            )
+
+# the metrics are counts, sent as integers unless a zone has no value that month
+def color_array(values):
+    return values if np.isnan(values).any() else values.astype(np.int64)
+
+# plotting bar chart, built once per filter combination and dataset version
+def tlc_barchart(all_data, time_metric, filters):
+    src.charts.plotly_chart('tlc_barchart', filters, dataset_version(),
+                            lambda: build_tlc_barchart(all_data, time_metric))
+
+def build_tlc_barchart(all_data, time_metric):
+    return px.bar(
                   x = all_data['zone'],
                   y = all_data[time_metric],
                   template = 'seaborn'
@@ -189,35 +426,53 @@ def tlc_barchart(all_data, time_metric):
                                   yaxis_title = '',
                                   width = 1000,
                                   height = 600)
-    st.plotly_chart(bar_fig)
 
 # generating data table and download button for the filtered dataset
-def tlc_table(all_data, time, service, time_metric):
+def tlc_table(all_data, time, zone, service, time_metric):
     
-    all_data = all_data.rename(columns = {'zone': 'Taxi Zone',
+    all_data = all_data.rename(columns = {'LocationID': 'Location ID',
+                                'zone': 'Taxi Zone',
                                 'borough': 'Borough',
                                 'CBD_Zone': 'CBD Zone',
                                 'geometry': 'Geometry'})
     
-    csv = all_data.to_csv().encode('utf-8')
-    st.download_button(
-            label = f"{time} {service} {time_metric} Dataset", 
-            data = csv, 
-            file_name = f"{time}_{service}_{time_metric}.csv", 
-            mime = 'text/csv' 
+    # the payload is encoded only when requested, once per filter combination, format and dataset version
+    src.exports.download_button(
+            label = f"{time} {service} {time_metric} Dataset",
+            name = 'tlc',
+            key = (time, zone, service, time_metric),
+            version = dataset_version(),
+            build_frame = lambda: all_data,
+            file_name = f"{time}_{service}_{time_metric}",
+            formats = src.exports.TABULAR_FORMATS + ('geojson',)
+    )
+    src.exports.bulk_download_button(
+            label = "All Months Dataset (CSV, gzip)",
+            name = 'tlc',
+            version = dataset_version(),
+            build_chunks = all_months_chunks,
+            file_name = "TLC_pickups_dropoffs_all_months"
     )
     
-    # styles the data table left-aligned text and inline display
-    all_data['Geometry'] = all_data['Geometry'].astype(str)
-    all_data = all_data.style.set_table_styles([
-    {'selector': 'th', 'props': [('text-align', 'left')]},
-    {'selector': 'td', 'props': [('text-align', 'left')]}
-    ]).set_table_attributes("style='display:inline'")
-
-    st.write(all_data)
-    
-
-    
-
+    # paged table, polygons shown as area and vertex count with WKT for the selected row
+    src.tables.data_table('tlc', all_data, (time, zone, service, time_metric), dataset_version(),
+                          geometry_column = 'Geometry')
 
+# every month of the fact table with zone attributes, in calendar order and in blocks of EXPORT_CHUNK_ROWS,
+# so the bulk export never materializes the joined history
+def all_months_chunks():
+    if src.query_service.enabled():
+        return src.query_service.export_chunks(SERVICE_DATASET)
+    return local_export_chunks()
 
+def local_export_chunks():
+    facts, zones = load_and_transform_data()
+    index = filter_index()
+    attributes = zones[['zone', 'borough', 'CBD_Zone']]
+    order = np.concatenate([index.positions(month_year, service)
+                            for month_year in index.options('month_year')
+                            for service in index.options('service', month_year = month_year)])
+    for start in range(0, len(order), EXPORT_CHUNK_ROWS):
+        rows = facts.iloc[order[start:start + EXPORT_CHUNK_ROWS]].join(attributes, on = 'LocationID')
+        rows[['service', 'month_year']] = rows[['service', 'month_year']].astype(str)
+        yield rows
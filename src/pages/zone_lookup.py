@@ -0,0 +1,147 @@
+# importing necessary libraries
+import hashlib
+import io
+
+import pandas as pd
+import streamlit as st
+import plotly.express as px
+import src.assets
+import src.cache
+import src.charts
+import src.exports
+import src.spatial_index
+import src.telemetry
+import src.views
+
+# This Streamlit application assigns coordinates to taxi zones, the Central Business District, and UHF42 neighborhoods
+# Users either type coordinates, one "latitude, longitude" pair per line, or upload a CSV file of points
+# The application returns each point's taxi zone, borough, CBD membership, and UHF42 neighborhood, with a map and a download
+
+# The polygons are the same GeoJSON files the pickups/dropoffs and air quality pages map, see src/spatial_index.py
+
+EXAMPLE_POINTS = "40.7580, -73.9855\n40.7128, -74.0060\n40.6413, -73.7781\n40.8296, -73.9262"
+# points drawn on the map; the table and the download hold every point
+MAP_POINTS = 5000
+HOVER_COLUMNS = ['LocationID', 'zone', 'borough', 'UHFNAME']
+CBD_COLORS = {'CBD': '#0039A6', 'Outside the CBD': '#FF6319', 'No taxi zone': 'gray'}
+
+
+def layers_version():
+    return src.cache.signature_digest([src.spatial_index.layer_version(layer) for layer in src.spatial_index.LAYERS])
+
+# building both zone indexes, so the first lookup only pays for the points
+def warm():
+    for layer in src.spatial_index.LAYERS:
+        src.spatial_index.zone_index(layer)
+
+# parsing "latitude, longitude" lines; returns the points and the lines that could not be read
+def parse_points(text):
+    rows, invalid = [], []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        parts = line.replace(',', ' ').split()
+        try:
+            rows.append((float(parts[0]), float(parts[1])))
+        except (IndexError, ValueError):
+            invalid.append(line)
+    return pd.DataFrame(rows, columns = ['latitude', 'longitude']), invalid
+
+# assigning the points to zones once per input and polygon version
+def lookup(points, digest, latitude, longitude):
+    return src.cache.dataset_cache.get_or_create(
+        ('zone_lookup', digest, latitude, longitude, layers_version()),
+        lambda: src.spatial_index.assign_frame(points, latitude, longitude),
+        sizeof = src.cache.estimate_nbytes
+    )
+
+# collecting points from the text box or the uploaded file; returns (points, digest, latitude, longitude)
+def point_input():
+    mode = src.views.view_tabs('zone_lookup', ["Enter coordinates", "Upload CSV"])
+
+    if mode == "Enter coordinates":
+        text = st.text_area("Latitude, longitude (one point per line):", value = EXAMPLE_POINTS, height = 150,
+                            key = 'zone_lookup_points')
+        points, invalid = parse_points(text)
+        if invalid:
+            st.warning(f"Skipped {len(invalid)} line(s) without a latitude and longitude, e.g. \"{invalid[0]}\"")
+        return points, hashlib.sha256(text.encode('utf-8')).hexdigest(), 'latitude', 'longitude'
+
+    uploaded = st.file_uploader("CSV file with a latitude and a longitude column:", type = ['csv'])
+    if uploaded is None:
+        return None, None, None, None
+    content = uploaded.getvalue()
+    digest = hashlib.sha256(content).hexdigest()
+    points = src.cache.dataset_cache.get_or_create(('zone_lookup_points', digest),
+                                                   lambda: pd.read_csv(io.BytesIO(content), engine = 'pyarrow'),
+                                                   sizeof = src.cache.estimate_nbytes)
+    try:
+        default_longitude, default_latitude = src.spatial_index.coordinate_columns(points)
+    except ValueError:
+        default_longitude, default_latitude = points.columns[min(1, len(points.columns) - 1)], points.columns[0]
+    col1, col2 = st.columns(2)
+    with col1:
+        latitude = st.selectbox("Latitude column:", points.columns, index = list(points.columns).index(default_latitude))
+    with col2:
+        longitude = st.selectbox("Longitude column:", points.columns, index = list(points.columns).index(default_longitude))
+    return points, digest, latitude, longitude
+
+def app():
+
+    st.title("Zone Lookup")
+    st.write(
+        "Find the taxi zone, CBD membership, and UHF42 neighborhood of any point in New York City. Enter coordinates below, or upload a CSV file with millions of points."
+        )
+
+    with src.telemetry.span('load'):
+        warm()
+    points, digest, latitude, longitude = point_input()
+    if points is None or points.empty:
+        src.assets.create_footer()
+        return
+
+    with src.telemetry.span('filter'):
+        result = lookup(points, digest, latitude, longitude)
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Points", f"{len(result):,}")
+    col2.metric("In a taxi zone", f"{result['LocationID'].notna().sum():,}")
+    col3.metric("In the CBD", f"{result['in_CBD'].sum():,}")
+
+    zones_map(result, digest, latitude, longitude)
+
+    src.exports.download_button(
+            label = "Points with Zones",
+            name = 'zone_lookup',
+            key = (digest, latitude, longitude),
+            version = layers_version(),
+            build_frame = lambda: result,
+            file_name = "ZoneLookup"
+    )
+    with src.telemetry.span('table'):
+        st.dataframe(result.head(MAP_POINTS), use_container_width = True)
+    if len(result) > MAP_POINTS:
+        st.caption(f"Showing the first {MAP_POINTS:,} of {len(result):,} points; the download holds all of them.")
+    src.assets.create_footer()
+
+# plotting the points colored by CBD membership, built once per input and polygon version
+def zones_map(result, digest, latitude, longitude):
+    def build():
+        shown = result.head(MAP_POINTS)
+        # plotly cannot serialize pd.NA, points outside every polygon get empty hover fields instead
+        hover = shown[HOVER_COLUMNS].astype(object).where(shown[HOVER_COLUMNS].notna(), None)
+        membership = shown['in_CBD'].map({True: 'CBD', False: 'Outside the CBD'}).where(shown['LocationID'].notna(), 'No taxi zone')
+        return px.scatter_mapbox(
+                shown.drop(columns = HOVER_COLUMNS).assign(membership = membership, **hover),
+                lat = latitude,
+                lon = longitude,
+                color = 'membership',
+                color_discrete_map = CBD_COLORS,
+                hover_data = HOVER_COLUMNS,
+                mapbox_style = 'carto-positron',
+                zoom = 9.5,
+                center = {'lat': 40.7128, 'lon': -73.9560},
+                height = 550
+                ).update_layout(margin = {'r': 0, 't': 0, 'l': 0, 'b': 0}, legend_title_text = '')
+
+    src.charts.plotly_chart('zone_lookup_map', (digest, latitude, longitude), layers_version(), build)
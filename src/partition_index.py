@@ -0,0 +1,59 @@
+import numpy as np
+
+import src.cache
+
+# Prebuilt partition indexes for the page filters
+# Instead of building full-length boolean masks on every widget change, each dataset is indexed once per
+# version by the columns its filters test for equality, e.g. (month_year, service) or (indicator_name, time).
+# A filter is then a dict lookup returning row positions, and widget option lists come from the index keys.
+
+
+class PartitionIndex:
+    """Row positions of a frame grouped by the values of its partition columns"""
+
+    def __init__(self, df, columns, sort = False):
+        self.columns = list(columns)
+        self.sort = sort
+        # rank of each value per column, so sorted option lists follow category order for categoricals
+        self.ranks = {}
+        if sort:
+            for column in self.columns:
+                values = df[column].cat.categories if df[column].dtype == 'category' else np.sort(df[column].unique())
+                self.ranks[column] = {value: rank for rank, value in enumerate(values)}
+        # groupby(...).indices maps each observed key to the positions of its rows
+        groups = df.groupby(self.columns if len(self.columns) > 1 else self.columns[0],
+                            sort = sort, observed = True).indices
+        self.partitions = {self._key(key): np.asarray(positions, dtype = np.int64) for key, positions in groups.items()}
+
+    def positions(self, *key):
+        return self.partitions.get(tuple(key), np.empty(0, dtype = np.int64))
+
+    # rows of one partition, a positional slice of the indexed frame
+    def take(self, df, *key):
+        return df.iloc[self.positions(*key)]
+
+    # distinct values of a partition column, in index order, optionally restricted by the other columns
+    def options(self, column, **fixed):
+        position = self.columns.index(column)
+        fixed_positions = {self.columns.index(name): value for name, value in fixed.items()}
+        values = {}
+        for key in self.partitions:
+            if all(key[i] == value for i, value in fixed_positions.items()):
+                values.setdefault(key[position], None)
+        if self.sort:
+            return sorted(values, key = self.ranks[column].get)
+        return list(values)
+
+    @property
+    def nbytes(self):
+        return sum(positions.nbytes for positions in self.partitions.values())
+
+    @staticmethod
+    def _key(key):
+        return key if isinstance(key, tuple) else (key,)
+
+
+# returns the cached partition index of a dataset version, building it on first use
+def partition_index(name, version, build_frame, columns, sort = False):
+    return src.cache.derived_value(f"index:{name}", version, lambda: PartitionIndex(build_frame(), columns, sort = sort),
+                                   sizeof = lambda index: index.nbytes)
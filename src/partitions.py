@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import src.cache
+
+# Month-partitioned storage for the TLC datasets
+# Each dataset is stored as one Feather file per month, data/partitions/<dataset>/<YYYY-MM>.<checksum>.feather,
+# described by data/partitions/manifest.json (schema, per-partition rows and checksums, and a dataset
+# version counter bumped by every ingest). `python -m src.dataprocessing.ingest` appends a validated
+# month as a new partition, so a monthly refresh writes one month instead of the whole history.
+# A running app maps only partitions it has not seen: partitions are remembered per process by checksum.
+# Only the mapping is incremental. A manifest change invalidates the page datasets built on the partitions,
+# and their loaders rebuild the whole page frame over every month (concat, typing, to_pandas, joins) along
+# with its derived indexes. The compiled artifacts go stale until compile_data runs again. Pages read the
+# partitions through src.schemas, which types, projects and filters the scan.
+
+PARTITIONS_DIR = os.path.join('data', 'partitions')
+MANIFEST_PATH = os.path.join(PARTITIONS_DIR, 'manifest.json')
+
+# dataset name -> CSV it replaces, month_year format, unique key, taxi zone columns and column types
+DATASETS = {
+    'map_pickup': {
+        'path': os.path.join('data', 'map_pickup.csv'),
+        'month_format': '%b-%Y',
+        'key': ['service', 'month_year', 'PULocationID'],
+        'location_columns': ['PULocationID'],
+        'columns': {'service': 'string', 'year': 'int64', 'month_year': 'string', 'PULocationID': 'int64',
+                    'PU_Monthly_Total': 'int64', 'PU_Daily_Average': 'int64'},
+    },
+    'map_dropoff': {
+        'path': os.path.join('data', 'map_dropoff.csv'),
+        'month_format': '%b-%Y',
+        'key': ['service', 'month_year', 'DOLocationID'],
+        'location_columns': ['DOLocationID'],
+        'columns': {'service': 'string', 'year': 'int64', 'month_year': 'string', 'DOLocationID': 'int64',
+                    'DO_Monthly_Total': 'int64', 'DO_Daily_Average': 'int64'},
+    },
+    'monthly': {
+        'path': os.path.join('data', 'monthly.csv'),
+        'month_format': '%b-%y',
+        'key': ['Weekday_Check', 'service', 'month_year', 'CBD_Check'],
+        'location_columns': [],
+        'columns': {'Weekday_Check': 'string', 'service': 'string', 'year': 'int64', 'month_year': 'string',
+                    'CBD_Check': 'string', 'trips': 'int64', 'trip_miles': 'float64', 'trip_time': 'float64',
+                    'monthly_trips': 'int64', 'monthly_miles': 'int64', 'monthly_time': 'int64'},
+    },
+    'od_flows': {
+        'path': os.path.join('data', 'od_flows.csv'),
+        'month_format': '%b-%Y',
+        'key': ['service', 'month_year', 'PULocationID', 'DOLocationID'],
+        'location_columns': ['PULocationID', 'DOLocationID'],
+        'columns': {'service': 'string', 'year': 'int64', 'month_year': 'string', 'PULocationID': 'int64',
+                    'DOLocationID': 'int64', 'trips': 'int64'},
+    },
+}
+
+SERVICES = ['Yellow Taxi', 'Green Taxi', 'HVFHV']
+MAX_LOCATION_ID = 265
+
+
+class IngestError(ValueError):
+    pass
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'version': 0, 'datasets': {}}
+
+
+def write_manifest(manifest):
+    os.makedirs(PARTITIONS_DIR, exist_ok = True)
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent = 2, sort_keys = True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+
+def is_partitioned(name):
+    return name in load_manifest()['datasets']
+
+
+# True when the CSV at path has been replaced by a partitioned dataset
+def covers(path):
+    manifest = load_manifest()
+    return any(os.path.normpath(spec['path']) == os.path.normpath(path) and name in manifest['datasets']
+               for name, spec in DATASETS.items())
+
+
+def partition_key(month_year, month_format):
+    return pd.to_datetime(month_year, format = month_format).strftime('%Y-%m')
+
+
+# checks a batch of rows against the dataset's schema and returns it with normalized types
+def validate(name, df):
+    spec = DATASETS[name]
+    # the air/monthly CSV exports may start with a byte order mark, whether bootstrapped or added later
+    df = df.rename(columns = lambda column: column.lstrip('\ufeff'))
+    missing = [column for column in spec['columns'] if column not in df.columns]
+    if missing:
+        raise IngestError(f"{name}: missing column(s) {', '.join(missing)}")
+    df = df[list(spec['columns'])]
+
+    if df[spec['key']].isna().any().any():
+        raise IngestError(f"{name}: empty values in key columns {', '.join(spec['key'])}")
+    try:
+        df = df.astype(spec['columns'])
+    except (TypeError, ValueError) as e:
+        raise IngestError(f"{name}: {e}") from e
+    # validated as strings, stored as plain object columns like the CSV reader produces
+    df = df.astype({column: object for column, dtype in spec['columns'].items() if dtype == 'string'})
+
+    parsed = pd.to_datetime(df['month_year'], format = spec['month_format'], errors = 'coerce')
+    if parsed.isna().any():
+        bad = df.loc[parsed.isna(), 'month_year'].unique()[:5]
+        raise IngestError(f"{name}: month_year values not in {spec['month_format']} format: {', '.join(bad)}")
+    if (parsed.dt.year != df['year']).any():
+        raise IngestError(f"{name}: year column disagrees with month_year")
+
+    unknown = set(df['service'].unique()) - set(SERVICES)
+    if unknown:
+        raise IngestError(f"{name}: unknown service(s) {', '.join(sorted(unknown))}")
+    for column in spec['location_columns']:
+        locations = df[column]
+        if ((locations < 1) | (locations > MAX_LOCATION_ID)).any():
+            raise IngestError(f"{name}: {column} outside 1-{MAX_LOCATION_ID}")
+    numeric = df.select_dtypes('number').drop(columns = 'year')
+    if (numeric < 0).any().any():
+        raise IngestError(f"{name}: negative values in {', '.join(numeric.columns[(numeric < 0).any()])}")
+    if df.duplicated(spec['key']).any():
+        raise IngestError(f"{name}: duplicate rows for key {', '.join(spec['key'])}")
+    return df.reset_index(drop = True)
+
+
+# validates rows for one or more new months and writes one partition per month
+# existing months are rejected unless replace is set, so a refresh cannot silently rewrite history
+def ingest(name, df, replace = False):
+    written, version = ingest_all({name: df}, replace = replace)
+    return written[name], version
+
+
+# ingests several datasets at once, e.g. the frames of one aggregate_trips run: every frame is validated
+# before any partition is written, and one manifest update publishes them together, so a batch rejected
+# for one dataset leaves all of them as they were
+def ingest_all(frames, replace = False):
+    manifest = load_manifest()
+    batches = {}
+    for name, df in frames.items():
+        spec = DATASETS[name]
+        df = validate(name, df)
+        partitions = manifest['datasets'].get(name, {}).get('partitions', {})
+        months = df.groupby(df['month_year'].map(lambda value: partition_key(value, spec['month_format'])), sort = True)
+        existing = [key for key, _ in months if key in partitions]
+        if existing and not replace:
+            raise IngestError(f"{name}: partition(s) {', '.join(existing)} already exist, pass replace to overwrite")
+        batches[name] = months
+
+    written = {}
+    replaced = []
+    for name, months in batches.items():
+        dataset = manifest['datasets'].setdefault(name, {'columns': DATASETS[name]['columns'], 'partitions': {}})
+        directory = os.path.join(PARTITIONS_DIR, name)
+        os.makedirs(directory, exist_ok = True)
+        written[name] = []
+        for key, rows in months:
+            # file names carry the checksum, so a replaced month never overwrites a file a running app may read
+            tmp_path = os.path.join(directory, f"{key}.tmp")
+            feather.write_feather(pa.Table.from_pandas(rows, preserve_index = False), tmp_path, compression = 'uncompressed')
+            checksum = src.cache.file_sha256(tmp_path)
+            path = os.path.join(directory, f"{key}.{checksum[:12]}.feather")
+            os.replace(tmp_path, path)
+            if key in dataset['partitions']:
+                replaced.append(os.path.join(PARTITIONS_DIR, dataset['partitions'][key]['path']))
+            dataset['partitions'][key] = {
+                'path': os.path.relpath(path, PARTITIONS_DIR),
+                'month_year': rows['month_year'].iloc[0],
+                'rows': len(rows),
+                'sha256': checksum,
+            }
+            written[name].append(key)
+
+    # the manifest is replaced last, so readers see either the old or the new set of partitions
+    manifest['version'] = manifest.get('version', 0) + 1
+    write_manifest(manifest)
+    current = {partition['path'] for dataset in manifest['datasets'].values() for partition in dataset['partitions'].values()}
+    for path in replaced:
+        if os.path.exists(path) and os.path.relpath(path, PARTITIONS_DIR) not in current:
+            os.remove(path)
+    return written, manifest['version']
+
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+# scans a partitioned dataset into one Arrow table, keeping only columns and the rows matching filter
+# (a pyarrow.dataset expression, see src.schemas). Partitions are memory-mapped once per process and
+# remembered by checksum, so a new month only maps the new file and the rest stays in the page cache.
+def read_partitions(name, columns = None, filter = None):
+    dataset = load_manifest()['datasets'][name]
+    columns = list(columns) if columns else list(dataset['columns'])
+    tables = []
+    seen = set()
+    for key in sorted(dataset['partitions']):
+        partition = dataset['partitions'][key]
+        memo_key = (name, key, partition['sha256'])
+        with _lock:
+            table = _loaded.get(memo_key)
+        if table is None:
+            path = os.path.join(PARTITIONS_DIR, partition['path'])
+            table = feather.read_table(path, memory_map = True)
+            with _lock:
+                _loaded[memo_key] = table
+        tables.append((table if filter is None else table.filter(filter)).select(columns))
+        seen.add(memo_key)
+
+    # forget partitions that were replaced or removed
+    with _lock:
+        for memo_key in [memo_key for memo_key in _loaded if memo_key[0] == name and memo_key not in seen]:
+            del _loaded[memo_key]
+
+    if not tables:
+        return pa.table({column: pa.array([], type = pa.string()) for column in columns})
+    return pa.concat_tables(tables)
+
+
+# splits an existing CSV into month partitions, the one-off migration to partitioned storage
+def bootstrap(name):
+    df = pd.read_csv(DATASETS[name]['path'], engine = 'pyarrow')
+    return ingest(name, df, replace = True)
@@ -0,0 +1,310 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+
+import src.cache
+import src.charts
+
+# Local query sidecar
+# By default every Streamlit replica holds its own copy of the page datasets. With the sidecar, one process
+# holds them and the replicas ask it for the rows of a filter combination instead:
+#
+#   python -m src.query_service serve                           # listens on 127.0.0.1:8765
+#   MTA_QUERY_SERVICE=http://127.0.0.1:8765 streamlit run app.py
+#
+# Without MTA_QUERY_SERVICE the pages answer the same questions in-process. Results travel as Arrow IPC
+# streams, geometry as WKB; the sidecar reloads changed data like the app does (src/hot_reload.py).
+#
+# A page that can be served defines, next to load_and_transform_data:
+#   local_filter_options()      -> JSON-serializable widget options
+#   local_query(**filters)      -> (DataFrame of result rows, JSON-serializable extras)
+#   local_geometries()          -> GeoSeries of the page's polygons indexed by feature id
+#   local_export_chunks()       -> (optional) DataFrames making up the all-rows export
+
+SERVICE_ENV = 'MTA_QUERY_SERVICE'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# dataset name -> page module answering its queries
+DATASETS = {
+    'air_quality': 'src.pages.air_quality',
+    'pickups_dropoffs': 'src.pages.pickups_dropoffs',
+}
+ARROW_STREAM = 'application/vnd.apache.arrow.stream'
+METADATA_KEY = b'mta'
+# how long a replica trusts the dataset version it last asked for
+VERSION_TTL = 2.0
+TIMEOUT = 30
+
+
+class QueryServiceError(RuntimeError):
+    pass
+
+
+def enabled():
+    return bool(os.environ.get(SERVICE_ENV))
+
+
+def base_url():
+    return os.environ[SERVICE_ENV].rstrip('/')
+
+
+# Arrow encoding: geometry columns become WKB, their names and CRS travel in the schema metadata
+
+def to_arrow(df, extras = None):
+    geometry = [column for column, dtype in df.dtypes.items() if dtype == 'geometry']
+    crs = df[geometry[0]].crs.to_string() if geometry and df[geometry[0]].crs is not None else None
+    if geometry:
+        df = pd.DataFrame(df).assign(**{column: df[column].to_wkb() for column in geometry})
+    table = pa.Table.from_pandas(df, preserve_index = False)
+    metadata = json.dumps({'geometry': geometry, 'crs': crs, 'extras': extras or {}}).encode('utf-8')
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: metadata})
+
+
+def from_arrow(table):
+    metadata = json.loads((table.schema.metadata or {}).get(METADATA_KEY, b'{}'))
+    df = table.to_pandas()
+    geometry = metadata.get('geometry') or []
+    for column in geometry:
+        df[column] = gpd.GeoSeries.from_wkb(df[column], crs = metadata.get('crs'))
+    if geometry:
+        df = gpd.GeoDataFrame(df, geometry = geometry[0], crs = metadata.get('crs'))
+    return df, metadata.get('extras', {})
+
+
+def ipc_bytes(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# client
+
+def _request(path, body = None):
+    data = None if body is None else json.dumps(body).encode('utf-8')
+    request = urllib.request.Request(f"{base_url()}{path}", data = data, headers = {'Content-Type': 'application/json'})
+    try:
+        return urllib.request.urlopen(request, timeout = TIMEOUT)
+    except (urllib.error.URLError, OSError) as e:
+        raise QueryServiceError(f"query service at {base_url()} failed for {path}: {e}") from e
+
+
+def _json(path):
+    with _request(path) as response:
+        return json.load(response)
+
+
+_version_lock = threading.Lock()
+_versions = {}
+
+
+def version(name):
+    now = time.monotonic()
+    with _version_lock:
+        cached = _versions.get(name)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    value = _json(f"/version/{name}")['version']
+    with _version_lock:
+        _versions[name] = (now + VERSION_TTL, value)
+    return value
+
+
+def options(name):
+    return src.cache.dataset_cache.get_or_create(('query_options', name, version(name)), lambda: _json(f"/options/{name}"))
+
+
+# result rows and extras for one filter combination, cached per dataset version
+def query(name, **filters):
+    def fetch():
+        with _request(f"/query/{name}", filters) as response:
+            return from_arrow(pa.ipc.open_stream(response).read_all())
+
+    # per filter, so names and values do not mix and a zone list is keyed regardless of its order
+    key = ('query', name, tuple((column, src.charts._normalize(value)) for column, value in sorted(filters.items())), version(name))
+    return src.cache.dataset_cache.get_or_create(key, fetch, sizeof = lambda result: src.cache.estimate_nbytes(result[0]))
+
+
+def geometries(name):
+    def fetch():
+        with _request(f"/geometries/{name}") as response:
+            df, extras = from_arrow(pa.ipc.open_stream(response).read_all())
+        return df.set_index(extras['id']).geometry
+
+    return src.cache.dataset_cache.get_or_create(('query_geometries', name, version(name)), fetch)
+
+
+# the export rows, read batch by batch from the response stream
+def export_chunks(name):
+    with _request(f"/export/{name}") as response:
+        reader = pa.ipc.open_stream(response)
+        for batch in reader:
+            yield from_arrow(pa.Table.from_batches([batch], reader.schema))[0]
+
+
+# server
+
+def page_module(name):
+    return importlib.import_module(DATASETS[name])
+
+
+class _ChunkedWriter:
+    """File-like sink writing each write() as one HTTP/1.1 chunk"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        if data:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        return len(data)
+
+    def flush(self):
+        self.wfile.flush()
+
+    def close(self):
+        if not self.closed:
+            self.wfile.write(b'0\r\n\r\n')
+            self.closed = True
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._handle(None)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            return self._send_json({'error': f"invalid request body: {e}"}, status = 400)
+        self._handle(body)
+
+    def _handle(self, body):
+        parts = self.path.strip('/').split('/')
+        # set once a streamed response has sent its headers
+        self._streaming = False
+        try:
+            if parts == ['health']:
+                return self._send_json({'status': 'ok', 'generation': src.cache.generation()})
+            if len(parts) != 2 or parts[1] not in DATASETS:
+                return self._send_json({'error': f"unknown path {self.path}"}, status = 404)
+            action, name = parts
+            module = page_module(name)
+            # one request sees one version of the dataset, like one rerun in the app
+            src.cache.pin_datasets()
+            try:
+                self._dispatch(action, name, module, body)
+            finally:
+                src.cache.unpin_datasets()
+        except Exception as e:
+            traceback.print_exc()
+            # a 200 and part of the stream are out already: ending the connection cuts the stream short,
+            # which the client's reader reports, where a JSON error would be read as stream bytes
+            if self._streaming:
+                self.close_connection = True
+                return
+            self._send_json({'error': str(e)}, status = 500)
+
+    def _dispatch(self, action, name, module, body):
+        if action == 'version':
+            return self._send_json({'version': module.load_and_transform_data.version()})
+        if action == 'options':
+            return self._send_json(module.local_filter_options())
+        if action == 'query' and body is not None:
+            df, extras = module.local_query(**body)
+            return self._send_arrow(ipc_bytes(to_arrow(df, extras)))
+        if action == 'geometries':
+            geometries = module.local_geometries()
+            id_name = geometries.index.name or 'id'
+            df = gpd.GeoDataFrame({id_name: geometries.index}, geometry = geometries.to_numpy(), crs = geometries.crs)
+            return self._send_arrow(ipc_bytes(to_arrow(df, {'id': id_name})))
+        if action == 'export' and hasattr(module, 'local_export_chunks'):
+            return self._send_arrow_stream(module.local_export_chunks())
+        self._send_json({'error': f"unsupported request {self.command} {self.path}"}, status = 404)
+
+    def _send_json(self, payload, status = 200):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_arrow(self, content):
+        self.send_response(200)
+        self.send_header('Content-Type', ARROW_STREAM)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    # streams one record batch per chunk with chunked transfer encoding, the length being unknown; a stream
+    # cut short by an error lacks the final empty chunk, which the client's HTTP reader reports
+    def _send_arrow_stream(self, chunks):
+        self.send_response(200)
+        self.send_header('Content-Type', ARROW_STREAM)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        self._streaming = True
+        sink = _ChunkedWriter(self.wfile)
+        writer = None
+        for chunk in chunks:
+            table = to_arrow(chunk)
+            if writer is None:
+                writer = pa.ipc.new_stream(sink, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+        sink.close()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host = DEFAULT_HOST, port = DEFAULT_PORT, preload = True):
+    import src.hot_reload
+    if preload:
+        for name in DATASETS:
+            start = time.perf_counter()
+            page_module(name).local_filter_options()
+            print(f"loaded {name} in {time.perf_counter() - start:.1f}s")
+    src.hot_reload.start()
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    print(f"query service listening on http://{host}:{port}")
+    server.serve_forever()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Serve page queries from one shared copy of the datasets')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    serve_parser = subparsers.add_parser('serve', help = 'run the query service')
+    serve_parser.add_argument('--host', default = DEFAULT_HOST, help = 'interface to bind (default: localhost only)')
+    serve_parser.add_argument('--port', type = int, default = DEFAULT_PORT)
+    serve_parser.add_argument('--no-preload', action = 'store_true', help = 'load each dataset on its first query instead of at start')
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        if enabled():
+            parser.error(f"unset {SERVICE_ENV} for the service itself, it answers queries in-process")
+        serve(args.host, args.port, preload = not args.no_preload)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import src.cache
+import src.partitions
+
+# Read-time schemas for the files under data/
+# Every dataset the pages read is declared here with the most compact type each of its columns needs:
+#   'category'          dictionary-encoded strings, categories sorted
+#   'month:<format>'    dictionary-encoded month labels, categories in calendar order
+#   'date:<format>'     parsed to datetime64
+#   'int16', 'int32', 'float32', 'string'
+#   'geometry'          polygons (GeoJSON datasets)
+# read() pushes the column projection and the row predicates into the pyarrow dataset scanner: CSVs are
+# parsed batch by batch straight into the compact types, and rows outside the predicates are dropped
+# before anything reaches pandas. Partitioned TLC datasets are scanned the same way from their memory-mapped
+# Feather partitions (src/partitions.py). Fiona cannot project GeoJSON, so GeoJSON datasets are typed and
+# projected right after the read and take no predicates.
+#
+# read_concurrently() runs several reads at once: pyarrow parses CSVs without holding the GIL, so they overlap
+# with each other and with GeoJSON parsing. The duration of the last read of each dataset is kept for the
+# start-up report (src/warmup.py).
+#
+#   python -m src.schemas report                # resident MB per dataset, default dtypes vs. its schema
+#   python -m src.schemas report --columns      # ... and per column
+
+SCHEMAS = {
+    'air_quality': {
+        'path': os.path.join('data', 'Outdoor_Air_and_Health_Data.csv'),
+        'columns': {'indicator_name': 'category', 'measure_name': 'category', 'display_type': 'category', 'time': 'category',
+                    'geo_join_id': 'int32', 'neighborhood': 'category', 'data_value': 'float32'},
+    },
+    'map_pickup': {
+        'path': src.partitions.DATASETS['map_pickup']['path'],
+        'columns': {'service': 'category', 'year': 'int16', 'month_year': 'month:%b-%Y', 'PULocationID': 'int32',
+                    'PU_Monthly_Total': 'int32', 'PU_Daily_Average': 'int32'},
+    },
+    'map_dropoff': {
+        'path': src.partitions.DATASETS['map_dropoff']['path'],
+        'columns': {'service': 'category', 'year': 'int16', 'month_year': 'month:%b-%Y', 'DOLocationID': 'int32',
+                    'DO_Monthly_Total': 'int32', 'DO_Daily_Average': 'int32'},
+    },
+    'monthly': {
+        'path': src.partitions.DATASETS['monthly']['path'],
+        'columns': {'Weekday_Check': 'category', 'service': 'category', 'year': 'int16', 'month_year': 'date:%b-%y',
+                    'CBD_Check': 'category', 'trips': 'int32', 'trip_miles': 'float32', 'trip_time': 'float32',
+                    'monthly_trips': 'int32', 'monthly_miles': 'int32', 'monthly_time': 'int32'},
+    },
+    'od_flows': {
+        'path': src.partitions.DATASETS['od_flows']['path'],
+        'columns': {'service': 'category', 'year': 'int16', 'month_year': 'month:%b-%Y', 'PULocationID': 'int16',
+                    'DOLocationID': 'int16', 'trips': 'int32'},
+    },
+    'uhf42': {
+        'path': os.path.join('data', 'UHF_42_DOHMH.geojson'),
+        'columns': {'UHFCODE': 'int32', 'UHFNAME': 'string', 'BOROUGH': 'category', 'geometry': 'geometry'},
+    },
+    'taxi_zones': {
+        'path': os.path.join('data', 'CBD_Taxi.geojson'),
+        'columns': {'LocationID': 'int32', 'zone': 'string', 'borough': 'category', 'CBD_Zone': 'category', 'geometry': 'geometry'},
+    },
+}
+
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+ARROW_TYPES = {'int16': pa.int16(), 'int32': pa.int32(), 'float32': pa.float32(), 'string': pa.string()}
+
+
+def _kind(dtype):
+    return dtype.split(':', 1)
+
+
+def arrow_type(dtype):
+    kind = _kind(dtype)[0]
+    if kind in ('category', 'month'):
+        return DICTIONARY
+    if kind == 'date':
+        return pa.timestamp('s')
+    return ARROW_TYPES[kind]
+
+
+def is_geo(name):
+    return 'geometry' in SCHEMAS[name]['columns'].values()
+
+
+# filters are AND-ed (column, op, value) tuples, as in pyarrow.parquet: ('service', '==', 'HVFHV'),
+# ('indicator_name', 'in', [...]); ops are ==, !=, <, >, <=, >=, in and not in
+def expression(filters):
+    return pq.filters_to_expression(filters) if filters else None
+
+
+def csv_format(name):
+    columns = SCHEMAS[name]['columns']
+    return ds.CsvFileFormat(convert_options = csv.ConvertOptions(
+        column_types = {column: arrow_type(dtype) for column, dtype in columns.items()},
+        timestamp_parsers = sorted({_kind(dtype)[1] for dtype in columns.values() if _kind(dtype)[0] == 'date'})
+    ))
+
+
+# casts the columns a reader could not type at parse time (Feather partitions store plain strings and int64)
+def conform(name, table):
+    columns = SCHEMAS[name]['columns']
+    for i, field in enumerate(table.schema):
+        dtype = columns.get(field.name)
+        if dtype is None or field.type == arrow_type(dtype):
+            continue
+        kind = _kind(dtype)
+        if kind[0] in ('category', 'month'):
+            column = table.column(i).dictionary_encode()
+        elif kind[0] == 'date':
+            column = pc.strptime(table.column(i), format = kind[1], unit = 's')
+        else:
+            column = table.column(i).cast(arrow_type(dtype))
+        table = table.set_column(i, field.name, column)
+    return table
+
+
+# categories sorted like astype('category') would, month labels in calendar order
+def order_categories(name, df):
+    for column, dtype in SCHEMAS[name]['columns'].items():
+        if column not in df.columns or df[column].dtype != 'category':
+            continue
+        kind = _kind(dtype)
+        categories = df[column].cat.categories
+        if kind[0] == 'month':
+            ordered = pd.Index(categories[pd.to_datetime(categories, format = kind[1]).argsort()])
+        else:
+            ordered = categories.sort_values()
+        df[column] = df[column].cat.reorder_categories(ordered)
+    return df
+
+
+# gives the categorical columns the frames share one set of categories, so joins and concats on them stay
+# categorical; name is the dataset whose schema orders the categories
+def align_categories(name, *frames):
+    frames = [frame.copy() for frame in frames]
+    for column in SCHEMAS[name]['columns']:
+        if not all(column in frame.columns and frame[column].dtype == 'category' for frame in frames):
+            continue
+        categories = pd.api.types.union_categoricals([frame[column] for frame in frames], ignore_order = True).categories
+        for frame in frames:
+            frame[column] = frame[column].cat.set_categories(categories)
+        for frame in frames:
+            order_categories(name, frame)
+    return frames
+
+
+_times_lock = threading.Lock()
+_read_seconds = {}
+
+
+# seconds the last read of each dataset took
+def read_seconds():
+    with _times_lock:
+        return dict(_read_seconds)
+
+
+# reads a dataset with its schema, only the given columns and only the rows matching filters
+def read(name, columns = None, filters = None):
+    start = time.perf_counter()
+    df = _read(name, columns, filters)
+    with _times_lock:
+        _read_seconds[name] = time.perf_counter() - start
+    return df
+
+
+# runs read(name, **kwargs) for each (name, kwargs) at the same time, returns the frames in order
+def read_concurrently(*reads):
+    with ThreadPoolExecutor(max_workers = len(reads), thread_name_prefix = 'read') as pool:
+        futures = [pool.submit(read, name, **kwargs) for name, kwargs in reads]
+        return [future.result() for future in futures]
+
+
+def _read(name, columns, filters):
+    spec = SCHEMAS[name]
+    columns = list(columns or spec['columns'])
+    if is_geo(name):
+        return read_geo(name, columns, filters)
+
+    if name in src.partitions.DATASETS and src.partitions.is_partitioned(name):
+        table = src.partitions.read_partitions(name, columns, expression(filters))
+    else:
+        dataset = ds.dataset(spec['path'], format = csv_format(name))
+        table = dataset.to_table(columns = columns, filter = expression(filters))
+    df = conform(name, table).to_pandas(split_blocks = True, self_destruct = True)
+    # the CSV reader keeps every value it parsed in the dictionaries, including those of filtered-out rows
+    for column in df.select_dtypes('category').columns:
+        df[column] = df[column].cat.remove_unused_categories()
+    return order_categories(name, df)
+
+
+def read_geo(name, columns, filters = None):
+    if filters:
+        raise ValueError(f"{name}: GeoJSON datasets are read whole, filter the result instead")
+    spec = SCHEMAS[name]
+    gdf = gpd.read_file(spec['path'])[columns]
+    gdf = gdf.astype({column: spec['columns'][column] for column in columns
+                      if spec['columns'][column] not in ('geometry', 'string')})
+    return order_categories(name, gdf)
+
+
+# what the dataset costs read with pandas' default types, every column and row
+def read_default(name):
+    path = SCHEMAS[name]['path']
+    if is_geo(name):
+        return gpd.read_file(path)
+    if name in src.partitions.DATASETS and src.partitions.is_partitioned(name):
+        return src.partitions.read_partitions(name).to_pandas()
+    return pd.read_csv(path, engine = 'pyarrow')
+
+
+def available(name):
+    path = SCHEMAS[name]['path']
+    return os.path.exists(path) or (name in src.partitions.DATASETS and src.partitions.is_partitioned(name))
+
+
+# resident bytes per dataset and column, with default types and with the schema
+def memory_report(names = None):
+    report = []
+    for name in names or SCHEMAS:
+        if not available(name):
+            continue
+        default = read_default(name)
+        typed = read(name)
+        report.append({
+            'dataset': name,
+            'rows': len(typed),
+            'default_bytes': src.cache.estimate_nbytes(default),
+            'schema_bytes': src.cache.estimate_nbytes(typed),
+            'columns': [{
+                'column': column,
+                'dtype': str(typed[column].dtype),
+                'default_bytes': src.cache.estimate_nbytes(default[column]) if column in default.columns else None,
+                'schema_bytes': src.cache.estimate_nbytes(typed[column]),
+            } for column in typed.columns],
+        })
+    return report
+
+
+def print_report(report, columns = False):
+    print(f"{'dataset':<14} {'rows':>9} {'default':>10} {'schema':>10} {'ratio':>6}")
+    for entry in report:
+        print(f"{entry['dataset']:<14} {entry['rows']:>9} {entry['default_bytes'] / 1e6:>8.2f}MB "
+              f"{entry['schema_bytes'] / 1e6:>8.2f}MB {entry['schema_bytes'] / entry['default_bytes']:>6.2f}")
+        if columns:
+            for column in entry['columns']:
+                default = '' if column['default_bytes'] is None else f"{column['default_bytes'] / 1e6:.2f}MB"
+                print(f"  {column['column']:<22} {column['dtype']:<10} {default:>10} {column['schema_bytes'] / 1e6:>8.2f}MB")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Read-time schemas of the datasets under data/')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    report_parser = subparsers.add_parser('report', help = 'resident memory per dataset, default dtypes vs. schema')
+    report_parser.add_argument('datasets', nargs = '*', help = f"datasets to report (default: all of {', '.join(SCHEMAS)})")
+    report_parser.add_argument('--columns', action = 'store_true', help = 'break the report down per column')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.datasets if name not in SCHEMAS]
+    if unknown:
+        parser.error(f"unknown dataset(s) {', '.join(unknown)}")
+
+    if args.command == 'report':
+        print_report(memory_report(args.datasets), columns = args.columns)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
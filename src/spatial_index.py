@@ -0,0 +1,249 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import src.cache
+import src.schemas
+
+# Point-to-zone assignment
+# ZoneIndex assigns whole arrays of coordinates to the polygons of a layer (taxi zones, UHF42 neighborhoods)
+# without a Python loop per point. The polygon edges are packed into horizontal slabs: every edge is listed
+# in each slab its y-range overlaps, ordered by polygon, as flat NumPy arrays. A point only meets the edges
+# of its own slab, and is inside a polygon when a ray from it to the east crosses an odd number of that
+# polygon's edges (holes and multipolygons included). The crossing tests for all points of a slab against
+# all edges of the slab are one array expression, and per-polygon parities one np.add.reduceat.
+#
+# Points are processed in chunks on a thread pool; NumPy releases the GIL inside the array operations, so
+# chunks run on several cores. A point on a border shared by two polygons goes to one of them, a point
+# outside every polygon to none (position -1). Indexes are built once per version of the layer's file.
+#
+# (geopandas' sindex needs rtree or pygeos, which the app does not install, and shapely's STRtree is queried
+# one point at a time.)
+#
+#   python -m src.spatial_index assign points.csv --output zones.csv    # adds taxi zone, CBD and UHF42 columns
+#   python -m src.spatial_index bench --points 1000000                  # random points per second per layer
+
+# polygon layers points can be assigned to: id column and the attributes returned with it
+LAYERS = {
+    'taxi_zones': {'id': 'LocationID', 'attributes': ['zone', 'borough', 'CBD_Zone']},
+    'uhf42': {'id': 'UHFCODE', 'attributes': ['UHFNAME', 'BOROUGH']},
+}
+CBD_ZONE = 'CBD'
+CHUNK_SIZE = 250_000
+# points tested against the edges of a slab at once, bounds the size of the crossing matrix
+BLOCK_SIZE = 1024
+# slabs per square root of the edge count
+SLABS_PER_EDGE = 4
+WORKERS = int(os.environ.get('MTA_SPATIAL_WORKERS', 0)) or os.cpu_count() or 1
+LATITUDE_NAMES = ['latitude', 'lat', 'y']
+LONGITUDE_NAMES = ['longitude', 'lon', 'lng', 'long', 'x']
+
+
+class ZoneIndex:
+    """Polygon edges packed into horizontal slabs for vectorized point-in-polygon lookups"""
+
+    def __init__(self, geometries, attributes = None, slabs = None):
+        self.attributes = attributes
+        x1, y1, x2, y2, polygon = _edges(geometries)
+        self.bounds = (float(min(x1.min(), x2.min())), float(min(y1.min(), y2.min())),
+                       float(max(x1.max(), x2.max())), float(max(y1.max(), y2.max())))
+        # horizontal edges never cross an eastward ray
+        keep = y1 != y2
+        x1, y1, x2, y2, polygon = x1[keep], y1[keep], x2[keep], y2[keep], polygon[keep]
+
+        self.ymin, self.ymax = self.bounds[1], self.bounds[3]
+        self.slabs = slabs or max(1, int(SLABS_PER_EDGE * np.sqrt(len(x1))))
+        self.slab_height = (self.ymax - self.ymin) / self.slabs or 1.0
+
+        low = self._slab(np.minimum(y1, y2))
+        high = self._slab(np.maximum(y1, y2))
+        counts = high - low + 1
+        edge = np.repeat(np.arange(len(x1)), counts)
+        slab = np.repeat(low, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+        order = np.lexsort((polygon[edge], slab))
+        edge, slab = edge[order], slab[order]
+
+        self.x1, self.y1 = x1[edge], y1[edge]
+        # inverse slope, so a crossing is one multiply-add
+        self.dxdy = (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+        self.ylow, self.yhigh = np.minimum(y1, y2)[edge], np.maximum(y1, y2)[edge]
+        self.polygon = polygon[edge].astype(np.int32)
+        self.slab_starts = np.searchsorted(slab, np.arange(self.slabs + 1))
+
+    def _slab(self, y):
+        return np.clip(((y - self.ymin) / self.slab_height).astype(np.int64), 0, self.slabs - 1)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.x1, self.y1, self.dxdy, self.ylow, self.yhigh, self.polygon, self.slab_starts))
+
+    # position of the polygon containing each point in geometries, -1 outside every polygon
+    def positions(self, x, y, workers = None):
+        x = np.asarray(x, dtype = np.float64)
+        y = np.asarray(y, dtype = np.float64)
+        chunks = [slice(start, start + CHUNK_SIZE) for start in range(0, len(x), CHUNK_SIZE)]
+        result = np.full(len(x), -1, dtype = np.int32)
+        workers = min(workers or WORKERS, len(chunks))
+        if workers <= 1:
+            for chunk in chunks:
+                result[chunk] = self._positions(x[chunk], y[chunk])
+            return result
+        with ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'zone-index') as pool:
+            for chunk, positions in zip(chunks, pool.map(lambda chunk: self._positions(x[chunk], y[chunk]), chunks)):
+                result[chunk] = positions
+        return result
+
+    def _positions(self, x, y):
+        result = np.full(len(x), -1, dtype = np.int32)
+        inside = np.isfinite(x) & np.isfinite(y) & (y >= self.ymin) & (y <= self.ymax) & (x <= self.bounds[2])
+        points = np.flatnonzero(inside)
+        slabs = self._slab(y[points])
+        order = np.argsort(slabs, kind = 'stable')
+        points, slabs = points[order], slabs[order]
+        bounds = np.flatnonzero(np.diff(slabs)) + 1
+
+        for block in np.split(np.arange(len(points)), bounds):
+            if len(block) == 0:
+                continue
+            slab = slabs[block[0]]
+            edges = slice(self.slab_starts[slab], self.slab_starts[slab + 1])
+            if edges.start == edges.stop:
+                continue
+            polygon = self.polygon[edges]
+            # first edge of each polygon present in the slab
+            starts = np.flatnonzero(np.r_[True, polygon[1:] != polygon[:-1]])
+            for part in range(0, len(block), BLOCK_SIZE):
+                ids = points[block[part:part + BLOCK_SIZE]]
+                result[ids] = self._block(x[ids], y[ids], edges, polygon[starts], starts)
+        return result
+
+    def _block(self, x, y, edges, polygons, starts):
+        px, py = x[:, None], y[:, None]
+        # half-open in y, so a ray through a vertex counts it once
+        crosses = (self.ylow[edges] <= py) & (py < self.yhigh[edges])
+        crosses &= px < self.x1[edges] + (py - self.y1[edges]) * self.dxdy[edges]
+        odd = np.add.reduceat(crosses.view(np.int8), starts, axis = 1) & 1
+        found = odd.any(axis = 1)
+        return np.where(found, polygons[odd.argmax(axis = 1)], -1)
+
+
+# edge endpoints of every ring, with the position of the polygon they belong to
+def _edges(geometries):
+    rings = []
+    for position, geometry in enumerate(geometries):
+        if geometry is None or geometry.is_empty:
+            continue
+        for polygon in getattr(geometry, 'geoms', [geometry]):
+            for ring in [polygon.exterior, *polygon.interiors]:
+                coords = np.asarray(ring.coords)[:, :2]
+                rings.append((coords[:-1], coords[1:], np.full(len(coords) - 1, position)))
+    start = np.concatenate([ring[0] for ring in rings])
+    end = np.concatenate([ring[1] for ring in rings])
+    return start[:, 0], start[:, 1], end[:, 0], end[:, 1], np.concatenate([ring[2] for ring in rings])
+
+
+def layer_version(layer):
+    return src.cache.signature_digest([src.cache.file_signature(src.schemas.SCHEMAS[layer]['path'])])
+
+
+def _build(layer):
+    spec = LAYERS[layer]
+    gdf = src.schemas.read(layer, columns = [spec['id'], *spec['attributes'], 'geometry'])
+    gdf = gdf[gdf.geometry.notna()].reset_index(drop = True)
+    return ZoneIndex(gdf.geometry.to_numpy(), pd.DataFrame(gdf.drop(columns = 'geometry')))
+
+
+# the cached index of a layer, built on first use of each version of its file
+def zone_index(layer):
+    return src.cache.derived_value(f"zone_index:{layer}", layer_version(layer), lambda: _build(layer),
+                                   sizeof = lambda index: index.nbytes + src.cache.estimate_nbytes(index.attributes))
+
+
+# the id and attributes of the polygon containing each point, one row per point (missing outside the layer)
+def assign(layer, longitude, latitude, workers = None):
+    index = zone_index(layer)
+    positions = index.positions(longitude, latitude, workers)
+    attributes = index.attributes
+    # an all-missing row appended at position -1
+    padded = pd.concat([attributes, attributes.iloc[:0].reindex([len(attributes)])], ignore_index = True)
+    if LAYERS[layer]['id'] in padded:
+        padded[LAYERS[layer]['id']] = padded[LAYERS[layer]['id']].astype('Int32')
+    return padded.take(np.where(positions < 0, len(attributes), positions)).reset_index(drop = True)
+
+
+# taxi zone, CBD membership and UHF42 neighborhood of each point
+def assign_all(longitude, latitude, workers = None):
+    zones = assign('taxi_zones', longitude, latitude, workers)
+    neighborhoods = assign('uhf42', longitude, latitude, workers).rename(columns = {'BOROUGH': 'UHF_BOROUGH'})
+    zones['in_CBD'] = (zones['CBD_Zone'] == CBD_ZONE).fillna(False).astype(bool)
+    return pd.concat([zones, neighborhoods], axis = 1)
+
+
+# the longitude and latitude columns of a frame of points, found by their usual names
+def coordinate_columns(df, latitude = None, longitude = None):
+    columns = {column.lower().strip(): column for column in df.columns}
+    latitude = latitude or next((columns[name] for name in LATITUDE_NAMES if name in columns), None)
+    longitude = longitude or next((columns[name] for name in LONGITUDE_NAMES if name in columns), None)
+    if latitude is None or longitude is None:
+        raise ValueError(f"no latitude/longitude columns among {', '.join(map(str, df.columns))}")
+    return longitude, latitude
+
+
+# df with the assigned zones appended as columns
+def assign_frame(df, latitude = None, longitude = None, workers = None):
+    longitude, latitude = coordinate_columns(df, latitude, longitude)
+    lon = pd.to_numeric(df[longitude], errors = 'coerce').to_numpy()
+    lat = pd.to_numeric(df[latitude], errors = 'coerce').to_numpy()
+    zones = assign_all(lon, lat, workers)
+    zones.index = df.index
+    return pd.concat([df, zones], axis = 1)
+
+
+def bench(points, workers):
+    rng = np.random.default_rng(0)
+    for layer in LAYERS:
+        start = time.perf_counter()
+        index = zone_index(layer)
+        build = time.perf_counter() - start
+        x = rng.uniform(index.bounds[0], index.bounds[2], points)
+        y = rng.uniform(index.bounds[1], index.bounds[3], points)
+        start = time.perf_counter()
+        positions = index.positions(x, y, workers)
+        seconds = time.perf_counter() - start
+        print(f"{layer}: index {build:.2f}s ({index.nbytes / 1e6:.1f}MB, {index.slabs} slabs), "
+              f"{points:,} points in {seconds:.2f}s ({points / seconds:,.0f}/s), {np.mean(positions >= 0):.0%} inside")
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Assign coordinates to taxi zones, the CBD and UHF42 neighborhoods')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    assign_parser = subparsers.add_parser('assign', help = 'add zone columns to a CSV of points')
+    assign_parser.add_argument('points', help = 'CSV with latitude and longitude columns')
+    assign_parser.add_argument('--output', required = True, help = 'CSV to write')
+    assign_parser.add_argument('--latitude', help = 'latitude column (default: latitude, lat or y)')
+    assign_parser.add_argument('--longitude', help = 'longitude column (default: longitude, lon, lng or x)')
+    assign_parser.add_argument('--workers', type = int, default = None, help = f"threads (default: {WORKERS})")
+    bench_parser = subparsers.add_parser('bench', help = 'assign random points within each layer')
+    bench_parser.add_argument('--points', type = int, default = 1_000_000)
+    bench_parser.add_argument('--workers', type = int, default = None, help = f"threads (default: {WORKERS})")
+    args = parser.parse_args(argv)
+
+    if args.command == 'assign':
+        df = pd.read_csv(args.points, engine = 'pyarrow')
+        start = time.perf_counter()
+        result = assign_frame(df, args.latitude, args.longitude, args.workers)
+        result.to_csv(args.output, index = False)
+        print(f"assigned {len(result):,} points in {time.perf_counter() - start:.2f}s, "
+              f"{result['LocationID'].notna().mean():.0%} in a taxi zone, {result['in_CBD'].mean():.0%} in the CBD")
+    if args.command == 'bench':
+        bench(args.points, args.workers)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+import urllib.request
+
+import streamlit as st
+
+# Static assets
+# Stylesheets are bundled under src/static/ instead of being fetched from dashboard.mta.info on every render,
+# and the st_aggrid stylesheet patch is applied once per process (or at image build time) instead of
+# crawling site-packages on every rerun.
+#
+#   python -m src.static_assets build                # fingerprint src/static/*.css into src/static/dist/ and patch st_aggrid
+#   python -m src.static_assets build --vendor-mta   # also replace mta.css with the upstream MTA stylesheets
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+DIST_MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# stylesheets injected into every page, in order
+PAGE_STYLESHEETS = ['mta.css']
+AGGRID_STYLESHEET = 'ag_grid.css'
+MTA_REMOTE_STYLESHEETS = ['https://dashboard.mta.info/default.css', 'https://dashboard.mta.info/app.css']
+
+# appended ahead of our rules so a patched st_aggrid stylesheet is recognised on the next start
+AGGRID_PATCH_MARKER = '/* mta-cbdtp ag-grid patch */'
+
+_lock = threading.Lock()
+_style_tags = {}
+_aggrid_patched = False
+
+
+def fingerprint(content):
+    return hashlib.sha256(content).hexdigest()[:12]
+
+
+def fingerprinted_name(name, content):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{fingerprint(content)}{ext}"
+
+
+# resolves a bundled asset to (fingerprinted name, text), preferring the build output in dist/
+def resolve(name):
+    try:
+        with open(DIST_MANIFEST_PATH, 'r') as f:
+            built_name = json.load(f).get(name)
+    except FileNotFoundError:
+        built_name = None
+
+    if built_name and os.path.exists(os.path.join(DIST_DIR, built_name)):
+        with open(os.path.join(DIST_DIR, built_name), 'rb') as f:
+            return built_name, f.read().decode('utf-8')
+
+    with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+        content = f.read()
+    return fingerprinted_name(name, content), content.decode('utf-8')
+
+
+# <style> tag for a bundled stylesheet, read and built once per process
+def style_tag(name):
+    with _lock:
+        tag = _style_tags.get(name)
+        if tag is None:
+            built_name, css = resolve(name)
+            tag = f'<style data-asset="{built_name}">{css}</style>'
+            _style_tags[name] = tag
+    return tag
+
+
+# Streamlit discards any element a rerun does not emit again, so the prebuilt tags are written on every
+# rerun; that is a constant string, with no file or network access after the first call
+def inject_stylesheets():
+    st.markdown(''.join(style_tag(name) for name in PAGE_STYLESHEETS), unsafe_allow_html = True)
+
+
+# appends our rules to st_aggrid's bundled stylesheets, located through the import system rather than
+# by walking site-packages; runs at most once per process
+def patch_aggrid_css():
+    global _aggrid_patched
+    with _lock:
+        if _aggrid_patched:
+            return True
+
+        spec = importlib.util.find_spec('st_aggrid')
+        if spec is None or spec.origin is None:
+            return False
+        css_dir = os.path.join(os.path.dirname(spec.origin), 'frontend', 'build', 'static', 'css')
+        _, css = resolve(AGGRID_STYLESHEET)
+
+        try:
+            for file in os.listdir(css_dir):
+                if not file.endswith('.css'):
+                    continue
+                path = os.path.join(css_dir, file)
+                with open(path, 'r') as f:
+                    content = f.read()
+                if AGGRID_PATCH_MARKER not in content:
+                    with open(path, 'a') as f:
+                        f.write(f"\n{AGGRID_PATCH_MARKER}\n{css}")
+        except OSError as e:
+            print(f"Could not patch st_aggrid css in {css_dir}: {e}")
+            return False
+
+        _aggrid_patched = True
+        return True
+
+
+# called once at process start from app.py
+def prepare():
+    patch_aggrid_css()
+    for name in PAGE_STYLESHEETS:
+        style_tag(name)
+
+
+def vendor_mta_stylesheets():
+    parts = []
+    for url in MTA_REMOTE_STYLESHEETS:
+        with urllib.request.urlopen(url, timeout = 30) as response:
+            parts.append(f"/* {url} */\n{response.read().decode('utf-8')}")
+    with open(os.path.join(STATIC_DIR, 'mta.css'), 'w') as f:
+        f.write('\n'.join(parts))
+
+
+def build(vendor_mta = False):
+    if vendor_mta:
+        vendor_mta_stylesheets()
+
+    os.makedirs(DIST_DIR, exist_ok = True)
+    manifest = {}
+    for name in sorted(os.listdir(STATIC_DIR)):
+        if not name.endswith('.css'):
+            continue
+        with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+            content = f.read()
+        manifest[name] = fingerprinted_name(name, content)
+        with open(os.path.join(DIST_DIR, manifest[name]), 'wb') as f:
+            f.write(content)
+
+    with open(DIST_MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent = 2, sort_keys = True)
+
+    patched = patch_aggrid_css()
+    for name, built_name in manifest.items():
+        print(f"{name} -> dist/{built_name}")
+    print('patched st_aggrid css' if patched else 'st_aggrid not patched')
+    return manifest
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Build the bundled static assets')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    build_parser = subparsers.add_parser('build', help = 'fingerprint stylesheets and patch st_aggrid')
+    build_parser.add_argument('--vendor-mta', action = 'store_true',
+                              help = 'download the dashboard.mta.info stylesheets into src/static/mta.css first')
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        build(vendor_mta = args.vendor_mta)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
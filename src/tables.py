@@ -0,0 +1,125 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import streamlit as st
+from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
+
+import src.cache
+import src.charts
+import src.telemetry
+
+# Paged data tables
+# Tables are rendered through AgGrid one page at a time: sorting and paging run here, on a cached sort order
+# per (filters, column, direction) and dataset version, and only the visible rows are sent to the browser.
+# Polygons are never shipped as text; each visible row gets its area and vertex count, and the WKT of a
+# row is produced only when that row is selected in the grid.
+
+DEFAULT_PAGE_SIZE = 25
+# projected CRS used for polygon areas (UTM zone 18N, metres)
+AREA_CRS = 'EPSG:32618'
+ROW_ID = '_row'
+DEFAULT_ORDER = 'Default order'
+
+
+def vertex_count(geometry):
+    if geometry is None or geometry.is_empty:
+        return 0
+    if hasattr(geometry, 'geoms'):
+        return sum(vertex_count(part) for part in geometry.geoms)
+    if geometry.geom_type == 'Polygon':
+        return len(geometry.exterior.coords) + sum(len(ring.coords) for ring in geometry.interiors)
+    return len(geometry.coords)
+
+
+# area and vertex count of the polygons on one page
+def geometry_summary(geometries):
+    geometries = gpd.GeoSeries(geometries, crs = geometries.crs or 'EPSG:4326')
+    return pd.DataFrame({
+        'Area (km²)': (geometries.to_crs(AREA_CRS).area / 1e6).round(2).to_numpy(),
+        'Vertices': [vertex_count(geometry) for geometry in geometries],
+    }, index = geometries.index)
+
+
+# row positions of the table sorted by column, cached per filter tuple, sort and dataset version
+def sort_order(df, name, key, version, column, descending):
+    if column == DEFAULT_ORDER:
+        return np.arange(len(df))
+    cache_key = ('table_order', name, src.charts.normalize_key(*key), version, column, descending)
+    return src.cache.dataset_cache.get_or_create(
+        cache_key,
+        lambda: df[column].reset_index(drop = True).sort_values(ascending = not descending, kind = 'stable').index.to_numpy(),
+        sizeof = lambda order: order.nbytes
+    )
+
+
+# keys of a table's sort and paging widgets, kept while its view is hidden (src/views.py)
+def widget_keys(name):
+    state_key = f"table:{name}"
+    return [f"{state_key}:sort", f"{state_key}:descending", f"{state_key}:page"]
+
+
+def _page_controls(df, name, key, sortable, page_size):
+    state_key = f"table:{name}"
+    # a new filter combination starts again from the first page
+    filters = src.charts.normalize_key(*key)
+    if st.session_state.get(f"{state_key}:filters") != filters:
+        st.session_state[f"{state_key}:filters"] = filters
+        st.session_state[f"{state_key}:page"] = 1
+
+    pages = max(1, -(-len(df) // page_size))
+    if st.session_state.get(f"{state_key}:page", 1) > pages:
+        st.session_state[f"{state_key}:page"] = pages
+
+    sort_col, direction_col, page_col = st.columns([2, 1, 1])
+    with sort_col:
+        column = st.selectbox("Sort by:", [DEFAULT_ORDER] + sortable, key = f"{state_key}:sort")
+    with direction_col:
+        descending = st.checkbox("Descending", key = f"{state_key}:descending", disabled = column == DEFAULT_ORDER)
+    with page_col:
+        page = st.number_input(f"Page (of {pages}):", min_value = 1, max_value = pages, step = 1, key = f"{state_key}:page")
+    return column, descending, int(page)
+
+
+# renders df as a paged AgGrid table; key is the filter tuple that produced df
+# geometry_column names the polygon column to summarize instead of display
+def data_table(name, df, key, version, geometry_column = None, page_size = DEFAULT_PAGE_SIZE):
+    with src.telemetry.span('table'):
+        return _data_table(name, df, key, version, geometry_column, page_size)
+
+
+def _data_table(name, df, key, version, geometry_column, page_size):
+    sortable = [column for column in df.columns if column != geometry_column]
+    column, descending, page = _page_controls(df, name, key, sortable, page_size)
+
+    order = sort_order(df, name, key, version, column, descending)
+    start = (page - 1) * page_size
+    positions = order[start:start + page_size]
+    rows = df.iloc[positions]
+
+    page_df = pd.DataFrame(rows[sortable]).reset_index(drop = True)
+    if geometry_column is not None:
+        page_df = page_df.join(geometry_summary(rows[geometry_column]).reset_index(drop = True))
+    for column_name in page_df.select_dtypes('category').columns:
+        page_df[column_name] = page_df[column_name].astype(str)
+    page_df.insert(0, ROW_ID, positions)
+
+    options = GridOptionsBuilder.from_dataframe(page_df)
+    options.configure_default_column(sortable = False, filterable = False, resizable = True)
+    options.configure_column(ROW_ID, hide = True)
+    if geometry_column is not None:
+        options.configure_selection('single')
+    options.configure_auto_height(True)
+    response = AgGrid(
+        page_df,
+        gridOptions = options.build(),
+        fit_columns_on_grid_load = True,
+        update_mode = GridUpdateMode.SELECTION_CHANGED,
+        try_to_convert_back_to_original_types = False
+    )
+    st.caption(f"Rows {min(start + 1, len(df))}–{start + len(positions)} of {len(df)}")
+
+    # WKT only for the row the user selected
+    selected = response['selected_rows'] if response is not None else []
+    if geometry_column is not None and len(selected):
+        position = int(selected[0][ROW_ID])
+        st.text_area("Geometry (WKT):", df[geometry_column].iloc[position].wkt, height = 150, disabled = True)
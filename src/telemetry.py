@@ -0,0 +1,264 @@
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+import streamlit as st
+
+# Rerun telemetry
+# Phases of a rerun (asset injection, data load, filtering, figure build and serialization, table render)
+# are timed with span(). Every span lands in the current rerun's trace, shown in the opt-in sidebar debug
+# panel, and in a process-wide histogram per (page, phase). Page views and cache hit rates are exported
+# with the histograms, at most every MTA_METRICS_INTERVAL seconds, to metrics/metrics.json and to
+# metrics/metrics.prom in the Prometheus text format (for a node-exporter textfile collector or a sidecar).
+# The bytes of the last figure each Plotly chart sent are exported too, against the map payload budget.
+#
+# The debug panel is shown with MTA_DEBUG_PANEL=1 or by adding ?debug=1 to the URL.
+
+METRICS_DIR = os.environ.get('MTA_METRICS_DIR', 'metrics')
+METRICS_INTERVAL = float(os.environ.get('MTA_METRICS_INTERVAL', 15))
+DEBUG_ENV = 'MTA_DEBUG_PANEL'
+# histogram bucket upper bounds in seconds, Prometheus style
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+# recent samples kept per (page, phase) for the percentiles in the JSON export and the debug panel
+RECENT_SAMPLES = 1000
+DEFAULT_PAGE = 'app'
+PAGE_VIEW_STATE = 'telemetry:page'
+
+_lock = threading.Lock()
+_local = threading.local()
+_started = time.time()
+_last_export = 0.0
+
+
+class Histogram:
+    """Cumulative-bucket histogram plus a window of recent samples for percentiles"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen = RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def percentiles(self, qs = (50, 95, 99)):
+        if not self.recent:
+            return {f"p{q}": None for q in qs}
+        values = np.percentile(np.fromiter(self.recent, dtype = float), qs)
+        return {f"p{q}": float(value) for q, value in zip(qs, values)}
+
+    # cumulative counts per upper bound, as Prometheus expects
+    def cumulative(self):
+        return list(zip(BUCKETS, np.cumsum(self.counts).tolist()))
+
+
+_histograms = defaultdict(Histogram)
+_page_views = defaultdict(int)
+_payloads = {}
+
+
+def _trace():
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+        _local.page = DEFAULT_PAGE
+    return _local
+
+
+# starts a new rerun trace; spans are attributed to DEFAULT_PAGE until set_page is called
+def begin_rerun():
+    trace = _trace()
+    trace.spans = []
+    trace.page = DEFAULT_PAGE
+
+
+def set_page(page):
+    _trace().page = page
+
+
+def current_spans():
+    return list(_trace().spans)
+
+
+def observe(phase, seconds, page = None):
+    trace = _trace()
+    page = page or trace.page
+    trace.spans.append((page, phase, seconds))
+    with _lock:
+        _histograms[(page, phase)].observe(seconds)
+
+
+# times the enclosed block as one phase of the current rerun
+@contextlib.contextmanager
+def span(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(phase, time.perf_counter() - start)
+
+
+# counts a view when a session navigates to page; widget reruns on the same page are not views
+def count_pageview(page):
+    if st.session_state.get(PAGE_VIEW_STATE) == page:
+        return
+    st.session_state[PAGE_VIEW_STATE] = page
+    with _lock:
+        _page_views[page] += 1
+
+
+# bytes of the figure spec a chart sent, and the budget it is held to
+def record_payload(chart, nbytes, budget):
+    with _lock:
+        _payloads[chart] = (nbytes, budget)
+
+
+def cache_stats():
+    import src.cache
+    return {
+        'dataset': src.cache.dataset_cache.stats(),
+        'figure': src.cache.figure_cache.stats(),
+        'export': src.cache.export_cache.stats(),
+    }
+
+
+def snapshot():
+    import src.cache
+    with _lock:
+        phases = [{
+            'page': page,
+            'phase': phase,
+            'count': histogram.count,
+            'sum_s': histogram.sum,
+            'max_s': histogram.max,
+            **{f"{name}_s": value for name, value in histogram.percentiles().items()},
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): count for bound, count in histogram.cumulative()},
+        } for (page, phase), histogram in sorted(_histograms.items())]
+        page_views = dict(_page_views)
+        payloads = {chart: {'bytes': nbytes, 'budget_bytes': budget, 'within_budget': nbytes <= budget}
+                    for chart, (nbytes, budget) in sorted(_payloads.items())}
+    return {
+        'generated': time.time(),
+        'uptime_s': time.time() - _started,
+        'pid': os.getpid(),
+        'phases': phases,
+        'page_views': page_views,
+        'chart_payloads': payloads,
+        'dataset_generation': src.cache.generation(),
+        'caches': cache_stats(),
+    }
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(snap = None):
+    snap = snap or snapshot()
+    lines = [
+        '# HELP mta_phase_seconds Time spent in each phase of a page rerun',
+        '# TYPE mta_phase_seconds histogram',
+    ]
+    for phase in snap['phases']:
+        labels = f'page="{_label(phase["page"])}",phase="{_label(phase["phase"])}"'
+        for bound, count in phase['buckets'].items():
+            lines.append(f'mta_phase_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f"mta_phase_seconds_sum{{{labels}}} {phase['sum_s']}")
+        lines.append(f"mta_phase_seconds_count{{{labels}}} {phase['count']}")
+
+    lines += ['# HELP mta_page_views_total Page views', '# TYPE mta_page_views_total counter']
+    lines += [f'mta_page_views_total{{page="{_label(page)}"}} {count}' for page, count in sorted(snap['page_views'].items())]
+
+    lines += ['# HELP mta_chart_payload_bytes Bytes of the last figure spec a chart sent',
+              '# TYPE mta_chart_payload_bytes gauge']
+    lines += [f'mta_chart_payload_bytes{{chart="{_label(chart)}"}} {payload["bytes"]}'
+              for chart, payload in snap['chart_payloads'].items()]
+    lines += ['# HELP mta_chart_payload_budget_bytes Figure spec bytes a chart should stay within',
+              '# TYPE mta_chart_payload_budget_bytes gauge']
+    lines += [f'mta_chart_payload_budget_bytes{{chart="{_label(chart)}"}} {payload["budget_bytes"]}'
+              for chart, payload in snap['chart_payloads'].items()]
+
+    for metric, field, kind, help_text in [
+        ('mta_cache_hits_total', 'hits', 'counter', 'Cache hits'),
+        ('mta_cache_misses_total', 'misses', 'counter', 'Cache misses'),
+        ('mta_cache_evictions_total', 'evictions', 'counter', 'Cache evictions'),
+        ('mta_cache_hit_ratio', 'hit_rate', 'gauge', 'Cache hit ratio since start'),
+        ('mta_cache_bytes', 'bytes', 'gauge', 'Estimated bytes held by the cache'),
+    ]:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{cache="{name}"}} {stats[field]}' for name, stats in snap['caches'].items()]
+    return '\n'.join(lines) + '\n'
+
+
+def _write(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+# writes metrics.json and metrics.prom
+def export(directory = None):
+    directory = directory or METRICS_DIR
+    os.makedirs(directory, exist_ok = True)
+    snap = snapshot()
+    _write(os.path.join(directory, 'metrics.json'), json.dumps(snap, indent = 2))
+    _write(os.path.join(directory, 'metrics.prom'), prometheus_text(snap))
+
+
+# called at the end of every rerun, exports at most every METRICS_INTERVAL seconds
+def maybe_export():
+    global _last_export
+    now = time.monotonic()
+    with _lock:
+        if now - _last_export < METRICS_INTERVAL:
+            return False
+        _last_export = now
+    try:
+        export()
+    except OSError as e:
+        print(f"Could not write metrics to {METRICS_DIR}: {e}")
+        return False
+    return True
+
+
+def debug_enabled():
+    if os.environ.get(DEBUG_ENV, '') not in ('', '0'):
+        return True
+    return st.experimental_get_query_params().get('debug', ['0'])[0] not in ('', '0')
+
+
+# sidebar panel with this rerun's phases, the page's latency percentiles and cache hit rates
+def debug_panel():
+    spans = current_spans()
+    with st.sidebar.expander('Debug: rerun timings', expanded = True):
+        st.caption(f"This rerun ({len(spans)} spans, the page span includes the others)")
+        st.table([{'page': page, 'phase': phase, 'ms': round(seconds * 1000, 1)} for page, phase, seconds in spans])
+
+        page = _trace().page
+        st.caption(f"{page}, since process start")
+        rows = [{'phase': phase['phase'], 'count': phase['count'],
+                 **{name: None if phase[f"{name}_s"] is None else round(phase[f"{name}_s"] * 1000, 1) for name in ('p50', 'p95', 'p99')}}
+                for phase in snapshot()['phases'] if phase['page'] == page]
+        if rows:
+            st.table(rows)
+
+        payloads = snapshot()['chart_payloads']
+        if payloads:
+            st.caption('Chart payloads')
+            st.table([{'chart': chart, 'KB': round(payload['bytes'] / 1000, 1),
+                       'budget KB': round(payload['budget_bytes'] / 1000, 1)} for chart, payload in payloads.items()])
+
+        st.caption('Caches')
+        st.table([{'cache': name, 'entries': stats['entries'], 'MB': round(stats['bytes'] / 1e6, 1),
+                   'hit rate': round(stats['hit_rate'], 3)} for name, stats in cache_stats().items()])
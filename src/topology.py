@@ -0,0 +1,301 @@
+import argparse
+import gzip
+import json
+import math
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+from shapely.geometry import LineString, MultiPolygon, Polygon
+
+import src.charts
+import src.geo_features
+import src.schemas
+import src.spatial_index
+
+# Shared-arc, quantized map geometry
+# Every choropleth ships its polygons to the browser inside the figure, and neighbouring taxi zones or UHF42
+# neighborhoods each carry their own copy of every border they share. Before the polygons reach a feature
+# store (src/geo_features.py) they are converted to a topology, the way TopoJSON does it:
+#   - coordinates are snapped to a grid of MTA_MAP_PRECISION decimal places (5: about a metre) and are sent
+#     with that many digits;
+#   - rings are cut into arcs where borders meet, so a border shared by two polygons is one arc used by both;
+#   - arcs are simplified (Douglas-Peucker, end points kept) to MTA_MAP_TOLERANCE_PX pixels at a zoom level.
+#     A shared border is simplified once, so neighbours never open gaps or overlap.
+# Plotly's map traces only read GeoJSON, so the app decodes the chosen variant back to GeoJSON polygons;
+# the TopoJSON encoding itself is written by the CLI, for other map clients and to compare sizes.
+#
+# A variant is built per zoom level in ZOOMS, its tolerance halving with each level. Maps use the most
+# detailed variant whose GeoJSON fits in the map payload budget (MTA_MAP_BUDGET_KB, src/charts.py), or the
+# zoom set with MTA_MAP_ZOOM ('full' for the quantized polygons without simplification).
+#
+#   python -m src.topology report                                         # bytes per layer and zoom
+#   python -m src.topology export uhf42 --zoom 12 --output uhf42.topojson  # TopoJSON of a variant
+
+PRECISION = int(os.environ.get('MTA_MAP_PRECISION', 5))
+TOLERANCE_PX = float(os.environ.get('MTA_MAP_TOLERANCE_PX', 0.5))
+MAP_ZOOM = os.environ.get('MTA_MAP_ZOOM', 'auto')
+ZOOMS = (10, 11, 12, 13, 14)
+TILE_SIZE = 256
+
+
+class Topology:
+    """Polygons of a layer as quantized arcs shared between neighbours, with simplified variants per zoom"""
+
+    def __init__(self, geometries, precision = PRECISION):
+        self.precision = precision
+        self.step = 10.0 ** -precision
+        self.crs = getattr(geometries, 'crs', None)
+        self.index_name = getattr(getattr(geometries, 'index', None), 'name', None)
+        shapes = [(feature_id, geometry) for feature_id, geometry in geometries.items()
+                  if geometry is not None and not geometry.is_empty]
+        xmin, ymin, _, _ = np.array([geometry.bounds for _, geometry in shapes]).min(axis = 0)
+        # on the grid, so decoded coordinates round to exactly `precision` digits
+        self.translate = tuple(round(math.floor(value / self.step) * self.step, precision) for value in (xmin, ymin))
+        latitude = np.mean([geometry.centroid.y for _, geometry in shapes])
+        self.latitude_scale = math.cos(math.radians(latitude))
+
+        # (feature id, geometry type, polygons as lists of rings as quantized point lists)
+        features = []
+        for feature_id, geometry in shapes:
+            polygons = []
+            for polygon in getattr(geometry, 'geoms', [geometry]):
+                rings = [self._quantize(ring.coords) for ring in [polygon.exterior, *polygon.interiors]]
+                # a ring smaller than the grid disappears, a polygon with it when it is the exterior
+                if len(rings[0]) >= 4:
+                    polygons.append([ring for ring in rings if len(ring) >= 4])
+            if polygons:
+                features.append((feature_id, geometry.geom_type, polygons))
+
+        junctions = _junctions(ring for _, _, polygons in features for polygon in polygons for ring in polygon)
+        self.arcs = []
+        self._arc_index = {}
+        self.features = [(feature_id, geom_type, [[self._cut(ring, junctions) for ring in polygon] for polygon in polygons])
+                         for feature_id, geom_type, polygons in features]
+        self._variants = {}
+
+    def _quantize(self, coords):
+        points = np.round((np.asarray(coords)[:, :2] - self.translate) / self.step).astype(np.int64)
+        # points that snap to the same grid cell as the previous one
+        keep = np.r_[True, np.any(points[1:] != points[:-1], axis = 1)]
+        return [tuple(point) for point in points[keep].tolist()]
+
+    # arc references of a closed ring, cut at the junctions it passes through; ~i is arc i reversed
+    def _cut(self, ring, junctions):
+        points = ring[:-1]
+        cuts = [i for i, point in enumerate(points) if point in junctions]
+        if not cuts:
+            # a ring no other ring touches, or shared whole (an island and the hole around it): one closed
+            # arc, starting at its smallest point so both rings find the same arc
+            start = points.index(min(points))
+            points = points[start:] + points[:start]
+            return [self._arc(points + points[:1])]
+        points = points[cuts[0]:] + points[:cuts[0]] + points[cuts[0]:cuts[0] + 1]
+        cuts = [i - cuts[0] for i in cuts] + [len(ring) - 1]
+        return [self._arc(points[start:end + 1]) for start, end in zip(cuts, cuts[1:])]
+
+    def _arc(self, points):
+        key = tuple(points)
+        if key in self._arc_index:
+            return self._arc_index[key]
+        if key[::-1] in self._arc_index:
+            return ~self._arc_index[key[::-1]]
+        self._arc_index[key] = len(self.arcs)
+        self.arcs.append(np.array(points, dtype = np.int64))
+        return len(self.arcs) - 1
+
+    # Douglas-Peucker tolerance of a zoom level in grid units: TOLERANCE_PX web mercator pixels, measured
+    # along the latitude axis, the shorter one in degrees
+    def tolerance(self, zoom):
+        return TOLERANCE_PX * 360 / (TILE_SIZE * 2 ** zoom) * self.latitude_scale / self.step
+
+    # the arcs of a variant; zoom None is the quantized arcs without simplification
+    def variant(self, zoom):
+        if zoom is None:
+            return self.arcs
+        if zoom not in self._variants:
+            tolerance = self.tolerance(zoom)
+            simplified = []
+            for arc in self.arcs:
+                line = np.asarray(LineString(arc).simplify(tolerance, preserve_topology = False).coords, dtype = np.int64)
+                # a closed arc is a ring by itself and keeps at least a triangle
+                closed = (arc[0] == arc[-1]).all()
+                simplified.append(arc if closed and len(line) < 4 else line)
+            self._variants[zoom] = simplified
+        return self._variants[zoom]
+
+    def _ring(self, references, arcs):
+        parts = [arcs[reference] if reference >= 0 else arcs[~reference][::-1] for reference in references]
+        return np.concatenate([parts[0], *[part[1:] for part in parts[1:]]])
+
+    # decoded rings in degrees; a ring whose simplified arcs leave less than a triangle keeps its full arcs
+    def _polygons(self, polygons, arcs):
+        decoded = []
+        for polygon in polygons:
+            rings = []
+            for references in polygon:
+                ring = self._ring(references, arcs)
+                if len(ring) < 4:
+                    ring = self._ring(references, self.arcs)
+                rings.append(np.round(ring * self.step + self.translate, self.precision))
+            decoded.append(rings)
+        return decoded
+
+    # GeoSeries of the variant's polygons indexed by feature id, what a feature store is built from
+    def geometries(self, zoom = None):
+        arcs = self.variant(zoom)
+        ids, shapes = [], []
+        for feature_id, geom_type, polygons in self.features:
+            parts = [Polygon(rings[0], rings[1:]) for rings in self._polygons(polygons, arcs)]
+            ids.append(feature_id)
+            shapes.append(parts[0] if geom_type == 'Polygon' and len(parts) == 1 else MultiPolygon(parts))
+        series = gpd.GeoSeries(shapes, index = ids, crs = self.crs)
+        series.index.name = self.index_name
+        return series
+
+    # GeoJSON FeatureCollection of the variant, as a choropleth receives it
+    def geojson(self, zoom = None):
+        arcs = self.variant(zoom)
+        features = []
+        for feature_id, geom_type, polygons in self.features:
+            coordinates = [[ring.tolist() for ring in rings] for rings in self._polygons(polygons, arcs)]
+            if geom_type == 'Polygon' and len(coordinates) == 1:
+                geometry = {'type': 'Polygon', 'coordinates': coordinates[0]}
+            else:
+                geometry = {'type': 'MultiPolygon', 'coordinates': coordinates}
+            features.append({'type': 'Feature', 'id': src.geo_features._plain(feature_id), 'geometry': geometry})
+        return {'type': 'FeatureCollection', 'features': features}
+
+    # TopoJSON of the variant: delta-encoded arcs on the quantization grid
+    def topojson(self, zoom = None, name = 'features'):
+        arcs = self.variant(zoom)
+        geometries = []
+        for feature_id, geom_type, polygons in self.features:
+            if geom_type == 'Polygon' and len(polygons) == 1:
+                geometries.append({'type': 'Polygon', 'id': src.geo_features._plain(feature_id), 'arcs': polygons[0]})
+            else:
+                geometries.append({'type': 'MultiPolygon', 'id': src.geo_features._plain(feature_id), 'arcs': polygons})
+        return {
+            'type': 'Topology',
+            'transform': {'scale': [self.step, self.step], 'translate': list(self.translate)},
+            'objects': {name: {'type': 'GeometryCollection', 'geometries': geometries}},
+            'arcs': [np.vstack([arc[:1], np.diff(arc, axis = 0)]).tolist() for arc in arcs],
+        }
+
+    # bytes of a variant as GeoJSON and TopoJSON, raw and gzipped
+    def sizes(self, zoom = None):
+        geojson = json_bytes(self.geojson(zoom))
+        topojson = json_bytes(self.topojson(zoom))
+        return {
+            'points': int(sum(len(arc) for arc in self.variant(zoom))),
+            'geojson_bytes': len(geojson),
+            'geojson_gzip_bytes': len(gzip.compress(geojson)),
+            'topojson_bytes': len(topojson),
+            'topojson_gzip_bytes': len(gzip.compress(topojson)),
+        }
+
+    # the zoom of the variant maps use: MTA_MAP_ZOOM, or the most detailed variant whose GeoJSON fits in
+    # the budget (the coarsest when none does)
+    def map_zoom(self, budget = None):
+        if MAP_ZOOM != 'auto':
+            return None if MAP_ZOOM == 'full' else _zoom(MAP_ZOOM)
+        budget = budget or src.charts.PAYLOAD_BUDGET
+        for zoom in [None, *sorted(ZOOMS, reverse = True)]:
+            if len(json_bytes(self.geojson(zoom))) <= budget:
+                return zoom
+        return min(ZOOMS)
+
+
+# points of the rings met with different neighbours: where a border stops being shared, and where three
+# or more polygons meet
+def _junctions(rings):
+    neighbours = {}
+    junctions = set()
+    for ring in rings:
+        points = ring[:-1]
+        for i, point in enumerate(points):
+            before, after = points[i - 1], points[(i + 1) % len(points)]
+            pair = (before, after) if before <= after else (after, before)
+            if neighbours.setdefault(point, pair) != pair:
+                junctions.add(point)
+    return junctions
+
+
+def _zoom(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def variant_name(zoom):
+    return 'full' if zoom is None else f"{zoom:g}"
+
+
+# compact JSON as Plotly serializes it, NumPy arrays included
+def json_bytes(value):
+    return json.dumps(value, separators = (',', ':'), default = lambda array: array.tolist()).encode('utf-8')
+
+
+def layer_geometries(layer):
+    spec = src.spatial_index.LAYERS[layer]
+    gdf = src.schemas.read(layer, columns = [spec['id'], 'geometry'])
+    return gdf.set_index(spec['id']).geometry
+
+
+# bytes per variant of every layer, against the budget
+def report(budget = None):
+    budget = budget or src.charts.PAYLOAD_BUDGET
+    layers = {}
+    for layer in src.spatial_index.LAYERS:
+        try:
+            geometries = layer_geometries(layer)
+        except (OSError, ValueError) as e:
+            layers[layer] = {'error': f"{type(e).__name__}: {e}"}
+            continue
+        topology = Topology(geometries)
+        original = src.geo_features.FeatureStore(geometries).collection()
+        variants = {variant_name(zoom): {**topology.sizes(zoom), 'within_budget': None}
+                    for zoom in [None, *ZOOMS]}
+        for sizes in variants.values():
+            sizes['within_budget'] = sizes['geojson_bytes'] <= budget
+        map_zoom = topology.map_zoom(budget)
+        layers[layer] = {
+            'features': len(topology.features),
+            'arcs': len(topology.arcs),
+            'original_geojson_bytes': len(json_bytes(original)),
+            'map_variant': variant_name(map_zoom),
+            'variants': variants,
+        }
+    return {'budget_bytes': budget, 'precision': PRECISION, 'tolerance_px': TOLERANCE_PX, 'layers': layers}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Quantized, shared-arc map geometry and its payload size')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    report_parser = subparsers.add_parser('report', help = 'bytes per layer and zoom variant against the budget')
+    report_parser.add_argument('--budget-kb', type = float, default = None,
+                               help = f"map payload budget (default: {src.charts.PAYLOAD_BUDGET / 1000:g})")
+    report_parser.add_argument('--check', action = 'store_true', help = 'exit with 1 when a map variant is over the budget')
+    export_parser = subparsers.add_parser('export', help = 'write a layer variant as TopoJSON')
+    export_parser.add_argument('layer', choices = list(src.spatial_index.LAYERS))
+    export_parser.add_argument('--zoom', type = _zoom, default = None, help = 'zoom variant (default: unsimplified)')
+    export_parser.add_argument('--output', required = True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'report':
+        result = report(args.budget_kb and int(args.budget_kb * 1000))
+        print(json.dumps(result, indent = 2))
+        over = [layer for layer, sizes in result['layers'].items()
+                if 'variants' in sizes and not sizes['variants'][sizes['map_variant']]['within_budget']]
+        if args.check and over:
+            print(f"over the {result['budget_bytes'] / 1000:g} KB map budget: {', '.join(over)}", file = sys.stderr)
+            return 1
+    if args.command == 'export':
+        topology = Topology(layer_geometries(args.layer))
+        with open(args.output, 'wb') as f:
+            f.write(json_bytes(topology.topojson(args.zoom, name = args.layer)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
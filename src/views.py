@@ -0,0 +1,20 @@
+import streamlit as st
+
+# On-demand page views
+# st.tabs sends the contents of every tab on every rerun and only hides the inactive ones in the browser, so
+# a page with a map, a chart and a table built all three whenever a filter changed. view_tabs() draws the
+# tab row as a horizontal radio instead and returns the selected view; the page builds and renders only
+# that one, and another view is computed when it is opened. The selection is kept per page in session state.
+#
+# Streamlit drops the state of widgets that were not drawn in a rerun, so widgets inside a view (a table's
+# sort and page, an export format, the map mode) would reset each time their view is hidden. Their keys are
+# passed as keep and carried over until the view is shown again.
+
+VIEW_STATE = 'view:{}'
+
+
+def view_tabs(page, views, keep = ()):
+    for key in keep:
+        if key in st.session_state:
+            st.session_state[key] = st.session_state[key]
+    return st.radio("View", views, horizontal = True, key = VIEW_STATE.format(page), label_visibility = 'collapsed')
@@ -0,0 +1,198 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import src.page_registry
+
+# Start-up warm-up
+# Instead of the first visitor of each page paying for its dataset load, the server loads every page's
+# dataset as soon as it starts: the page modules are imported one after the other (imports share the
+# interpreter's import lock), then their datasets are loaded on a thread pool. The pyarrow CSV reads and
+# the GeoJSON parsing release the GIL for most of their time, so the pages' loads, and the reads inside
+# one page (src.schemas.read_concurrently), overlap.
+#
+# When the warm-up finishes, successful or not, the process is ready: metrics/ready.json is written with
+# the time each page and each dataset read took, and GET /ready on MTA_READY_PORT (when set) answers 200
+# instead of 503, for a load balancer or container health check to hold traffic until then. A page that
+# failed to warm is listed with its error and loads on first visit as before.
+#
+#   python -m src.warmup serve app.py --server.port 5000    # warm up in the Streamlit server process, then serve
+#   python -m src.warmup once                               # warm up, print the report and exit
+#
+# app.py also starts the warm-up on the first session of a plain `streamlit run`. MTA_WARMUP=0 turns it
+# off, MTA_WARMUP_WORKERS sets the pool size (default: one thread per page).
+
+PAGES = ['src.pages.air_quality', 'src.pages.monthly_averages', 'src.pages.pickups_dropoffs', 'src.pages.od_flows',
+         'src.pages.zone_lookup']
+READY_FILE = os.environ.get('MTA_READY_FILE', os.path.join(os.environ.get('MTA_METRICS_DIR', 'metrics'), 'ready.json'))
+READY_HOST = os.environ.get('MTA_READY_HOST', '0.0.0.0')
+READY_PORT_ENV = 'MTA_READY_PORT'
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_thread = None
+_report = None
+
+
+def enabled():
+    return os.environ.get('MTA_WARMUP', '1') not in ('', '0')
+
+
+def ready():
+    return _ready.is_set()
+
+
+def report():
+    return _report
+
+
+# imports every page, then loads their datasets concurrently; returns the report
+def warm(pages = None, workers = None):
+    # here rather than at the top: app.py imports this module, and src.schemas loads geopandas and shapely
+    import src.schemas
+
+    pages = pages or PAGES
+    workers = workers or int(os.environ.get('MTA_WARMUP_WORKERS', 0)) or len(pages)
+    start = time.perf_counter()
+    lazy_pages = [src.page_registry.get(module) for module in pages]
+    results = {}
+
+    def load(page):
+        try:
+            page.load()
+            return {'import_seconds': page.import_seconds, 'warm_seconds': page.warm_seconds}
+        except Exception as e:
+            print(f"Warming up {page.module_name} failed, it loads on first visit instead")
+            traceback.print_exc()
+            return {'error': f"{type(e).__name__}: {e}"}
+
+    # imports one at a time (a failed import is reported by load()), the datasets at the same time
+    for page in lazy_pages:
+        try:
+            page.load_module()
+        except Exception:
+            pass
+    with ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'warmup') as pool:
+        for page, result in zip(lazy_pages, pool.map(load, lazy_pages)):
+            results[page.module_name] = result
+
+    return {
+        'ready': True,
+        'finished': time.time(),
+        'seconds': time.perf_counter() - start,
+        'pid': os.getpid(),
+        'workers': workers,
+        'pages': results,
+        'datasets': {name: {'read_seconds': seconds} for name, seconds in sorted(src.schemas.read_seconds().items())},
+    }
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _clear_ready_file():
+    try:
+        os.remove(READY_FILE)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Could not remove {READY_FILE}: {e}")
+
+
+def _run(pages, workers):
+    global _report
+    try:
+        _report = warm(pages, workers)
+    except Exception as e:
+        traceback.print_exc()
+        _report = {'ready': True, 'finished': time.time(), 'error': f"{type(e).__name__}: {e}"}
+    try:
+        _write(READY_FILE, json.dumps(_report, indent = 2))
+    except OSError as e:
+        print(f"Could not write {READY_FILE}: {e}")
+    _ready.set()
+    print(f"Warm-up finished in {_report.get('seconds', 0):.1f}s")
+
+
+class ReadyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') not in ('/ready', ''):
+            return self._send_json({'error': f"unknown path {self.path}"}, status = 404)
+        if ready():
+            return self._send_json(_report)
+        self._send_json({'ready': False}, status = 503)
+
+    def _send_json(self, payload, status = 200):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_readiness(port, host = READY_HOST):
+    server = ThreadingHTTPServer((host, port), ReadyHandler)
+    server.daemon_threads = True
+    threading.Thread(target = server.serve_forever, name = 'readiness', daemon = True).start()
+    return server
+
+
+# starts the warm-up, and the readiness endpoint when MTA_READY_PORT is set, once per process; calls from
+# later reruns are no-ops
+def start(pages = None, workers = None):
+    global _thread
+    if not enabled():
+        _ready.set()
+        return False
+    with _lock:
+        if _thread is not None:
+            return True
+        _clear_ready_file()
+        port = os.environ.get(READY_PORT_ENV)
+        if port:
+            try:
+                serve_readiness(int(port))
+            except OSError as e:
+                print(f"Could not serve readiness on port {port}: {e}")
+        _thread = threading.Thread(target = _run, args = (pages, workers), name = 'warmup', daemon = True)
+        _thread.start()
+    return True
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Load every page dataset at server start')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+    serve_parser = subparsers.add_parser('serve', help = 'start the warm-up, then run the Streamlit server in this process')
+    serve_parser.add_argument('script', help = 'the Streamlit app, e.g. app.py')
+    serve_parser.add_argument('streamlit_args', nargs = argparse.REMAINDER, help = 'passed on to `streamlit run`')
+    once_parser = subparsers.add_parser('once', help = 'warm up, print the report and exit')
+    once_parser.add_argument('--workers', type = int, default = None, help = 'thread pool size (default: one per page)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        # the server runs in this process, so the sessions find the datasets the warm-up loaded
+        import streamlit.web.cli
+        start()
+        return streamlit.web.cli.main(['run', args.script, *args.streamlit_args], prog_name = 'streamlit')
+    if args.command == 'once':
+        print(json.dumps(warm(workers = args.workers), indent = 2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())